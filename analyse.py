@@ -1,106 +1,215 @@
 #!/usr/bin/env python2
 """Functions to analyse and visualise simulation results."""
 import argparse
-from array import array
+import collections
 import numpy as np
 import ROOT as r
 import shipunit as u
 import rootUtils as ut
 from get_geo import get_geo
 from disney_common import FCN
+import columnar
+from columnar import Z_Sensitive_Plane
 
-Z_T4 = 3538
-Z_T1 = Z_T4 - 940
-Z_Sensitive_Plane = Z_T1
+HIT_COLUMNS = [
+    'Entry$',
+    'vetoPoint.fPdgCode',
+    'vetoPoint.fX',
+    'vetoPoint.fY',
+    'vetoPoint.fZ',
+    'vetoPoint.fPx',
+    'vetoPoint.fPy',
+    'vetoPoint.fPz',
+    'vetoPoint.fELoss',
+]
+TRACK_DTYPE = np.dtype([
+    ('event', 'i4'),
+    ('pid', 'i4'),
+    ('x', 'f4'),
+    ('y', 'f4'),
+    ('z', 'f4'),
+])
+MAX_TRACKS = 100  # events in the acceptance of which the tracks are recorded
 
+TRACK_COLUMNS = [
+    'MCTrack[1].GetStartX()',
+    'MCTrack[1].GetStartY()',
+    'MCTrack[1].GetP()',
+    'MCTrack[1].GetPt()',
+]
 
-def graph_tracks(event):
-    """Create graphs of tracks in event by interpolating between vetoPoints."""
-    hits = []
+
+def read_columns(tree, columns, selection=''):
+    """Read expressions of the entries passing `selection` in bulk.
+
+    Only the branches needed for `columns` and `selection` are read.
+
+    Returns
+    -------
+    list
+        One array per column, with one element per entry or, for columns of
+        arrays like `vetoPoint`, per array element
+
+    """
+    rows = tree.Draw(':'.join(columns), selection, 'goff')
+    if rows > tree.GetEstimate():
+        tree.SetEstimate(rows)
+        rows = tree.Draw(':'.join(columns), selection, 'goff')
+    values = []
+    for i in range(len(columns)):
+        buffer = tree.GetVal(i)
+        buffer.SetSize(rows)
+        values.append(np.frombuffer(buffer, dtype=np.float64,
+                                    count=rows).copy())
+    return values
+
+
+def fill_hist(hist, *columns):
+    """Fill `hist` with the arrays `columns` and optional weights."""
+    columns = [np.ascontiguousarray(c, dtype=np.float64) for c in columns]
+    n = len(columns[0])
+    if not n:
+        return
+    if len(columns) == hist.GetDimension():
+        columns.append(np.ones(n))
+    hist.FillN(n, *columns)
+
+
+def track_points(event, number, pid):
+    """Points along the tracks of `event`, to be drawn by `render_tracks`.
+
+    The points are the start vertices of the tracks and the entry and exit
+    points of their hits in the sensitive volumes.
+
+    Parameters
+    ----------
+    event
+        Event with the usual `cbmsim` branches
+    number : int
+        Number of the event, as counted by `StreamingAnalysis`
+    pid : int
+        PDG code of the muon in the acceptance
+
+    Returns
+    -------
+    np.ndarray
+        Array of `TRACK_DTYPE`, sorted in z
+
+    """
+    hits = collections.defaultdict(list)
+    for hit in event.vetoPoint:
+        hits[hit.GetTrackID()].append(hit)
+    points = []
     fPos = r.TVector3()
     for n, track in enumerate(event.MCTrack):
         track.GetStartVertex(fPos)
-        hitlist = {}
-        hitlist[fPos.Z()] = [
-            fPos.X(), fPos.Y(), fPos.Px(), fPos.Py(), fPos.Pz()
-        ]
-        # loop over all sensitive volumes to find hits
-        for hit in event.vetoPoint:
-            if hit.GetTrackID() == (n - 1):
-                lp = hit.LastPoint()
-                lm = hit.LastMom()
-                assert not (lp.x() == lp.y() and lp.x() == lp.z() and
-                            lp.x() == 0)
-                # must be old data, don't expect hit at 0,0,0
-                # first point:
-                # Entry point as p in centre of volume, halfway between
-                # entry and exit
-                hitlist[2. * hit.GetZ() - lp.z()] = [
-                    2. * hit.GetX() - lp.x(), 2. * hit.GetY() - lp.y(), 0.0,
-                    0.0, 0.0
-                ]
-                # last point:
-                hitlist[lp.z()] = [lp.x(), lp.y(), lm.Px(), lm.Py(), lm.Pz()]
+        hitlist = {fPos.Z(): (fPos.X(), fPos.Y())}
+        for hit in hits[n - 1]:
+            lp = hit.LastPoint()
+            assert not (lp.x() == lp.y() and lp.x() == lp.z() and
+                        lp.x() == 0)
+            # must be old data, don't expect hit at 0,0,0
+            # first point:
+            # Entry point as p in centre of volume, halfway between
+            # entry and exit
+            hitlist[2. * hit.GetZ() - lp.z()] = (2. * hit.GetX() - lp.x(),
+                                                 2. * hit.GetY() - lp.y())
+            # last point:
+            hitlist[lp.z()] = (lp.x(), lp.y())
         if len(hitlist) == 1:
             if track.GetMotherId() < 0:
                 continue
+        for z, (x, y) in hitlist.items():
+            points.append((number, pid, x, y, z))
+    points = np.array(points, dtype=TRACK_DTYPE)
+    return np.sort(points, order='z', kind='mergesort')
 
-        zs = hitlist.keys()
-        for z in zs:
-            hits.append([hitlist[z][0], hitlist[z][1], z])
-    # sort in z
-    hits.sort(key=lambda x: x[2])
-    xs, ys, zs = zip(*hits)
-    return r.TGraph(len(hits), array('f', zs), array('f', xs)), r.TGraph(
-        len(hits), array('f', zs), array('f', ys))
 
+class CurrentEvent(object):
+    """Event being simulated by the running FairRunSim, like a `cbmsim` entry.
+
+    Only valid after `FairRunSim.Init`.
+
+    """
+
+    def __init__(self):
+        manager = r.FairRootManager.Instance()
+        self.MCTrack = manager.GetObject('MCTrack')
+        self.vetoPoint = manager.GetObject('vetoPoint')
 
-def analyse(tree, outputfile):
-    """Analyse tree to find hit positions and create histograms.
+
+class StreamingAnalysis(object):
+    """Find hit positions and fill histograms one event at a time.
+
+    Events can come from a tree, see `analyse`, or from a running simulation,
+    see `fill_current_event`.
 
     Parameters
     ----------
-    tree
-        Tree or Chain of trees with the usual `cbmsim` format
     outputfile : str
         Filename for the file in which the histograms are saved,
         will be overwritten
-
-    Returns
-    -------
-    std::vector<double>
-        Vector of hit x-positions [cm]
+    bound : float
+        If given, the simulation is stopped as soon as the sum of the muon
+        weights exceeds it, see `fill_current_event`
+    tracks : str
+        If given, the tracks of the first `max_tracks` events in the
+        acceptance are saved to this `.npy` file, see `track_points`
+    hits : str
+        If given, the muon hits with energy loss are saved to this `.npz`
+        file for re-analysis, see `columnar.HIT_DTYPE` and `reanalyse.py`
 
     """
-    r.gROOT.SetBatch(True)
-    maxpt = 6.5
-    maxp = 360.
-    f = r.TFile.Open(outputfile, 'recreate')
-    f.cd()
-    h = {}
-    ut.bookHist(h, 'mu_pos', '#mu- hits;x[cm];y[cm]', 100, -1000, +1000, 100,
-                -800, 1000)
-    ut.bookHist(h, 'anti-mu_pos', '#mu+ hits;x[cm];y[cm]', 100, -1000, +1000,
-                100, -800, 1000)
-    ut.bookHist(h, 'mu_w_pos', '#mu- hits;x[cm];y[cm]', 100, -1000, +1000, 100,
-                -800, 1000)
-    ut.bookHist(h, 'anti-mu_w_pos', '#mu+ hits;x[cm];y[cm]', 100, -1000, +1000,
-                100, -800, 1000)
-    ut.bookHist(h, 'mu_p', '#mu+-;p[GeV];', 100, 0, maxp)
-    ut.bookHist(h, 'mu_p_original', '#mu+-;p[GeV];', 100, 0, maxp)
-    ut.bookHist(h, 'mu_pt_original', '#mu+-;p_t[GeV];', 100, 0, maxpt)
-    ut.bookHist(h, 'mu_ppt_original', '#mu+-;p[GeV];p_t[GeV];', 100, 0, maxp,
-                100, 0, maxpt)
-    ut.bookHist(h, 'smear', '#mu+- initial vertex;x[cm];y[cm]', 100, -10, +10,
-                100, -10, 10)
-    xs = r.std.vector('double')()
-    i, n = 0, tree.GetEntries()
-    print '0/{}\r'.format(n),
-    mom = r.TVector3()
-    for event in tree:
-        i += 1
+
+    def __init__(self, outputfile, bound=None, tracks=None,
+                 max_tracks=MAX_TRACKS, hits=None):
+        r.gROOT.SetBatch(True)
+        maxpt = 6.5
+        maxp = 360.
+        self.f = r.TFile.Open(outputfile, 'recreate')
+        self.f.cd()
+        h = {}
+        ut.bookHist(h, 'mu_pos', '#mu- hits;x[cm];y[cm]', 100, -1000, +1000,
+                    100, -800, 1000)
+        ut.bookHist(h, 'anti-mu_pos', '#mu+ hits;x[cm];y[cm]', 100, -1000,
+                    +1000, 100, -800, 1000)
+        ut.bookHist(h, 'mu_w_pos', '#mu- hits;x[cm];y[cm]', 100, -1000, +1000,
+                    100, -800, 1000)
+        ut.bookHist(h, 'anti-mu_w_pos', '#mu+ hits;x[cm];y[cm]', 100, -1000,
+                    +1000, 100, -800, 1000)
+        ut.bookHist(h, 'mu_p', '#mu+-;p[GeV];', 100, 0, maxp)
+        ut.bookHist(h, 'mu_p_original', '#mu+-;p[GeV];', 100, 0, maxp)
+        ut.bookHist(h, 'mu_pt_original', '#mu+-;p_t[GeV];', 100, 0, maxpt)
+        ut.bookHist(h, 'mu_ppt_original', '#mu+-;p[GeV];p_t[GeV];', 100, 0,
+                    maxp, 100, 0, maxpt)
+        ut.bookHist(h, 'smear', '#mu+- initial vertex;x[cm];y[cm]', 100, -10,
+                    +10, 100, -10, 10)
+        self.h = h
+        self.xs = r.std.vector('double')()
+        self.i = 0
+        self.mom = r.TVector3()
+        self.current_event = None
+        self.bound = bound
+        self.muons_w = 0.
+        self.tracks = tracks
+        self.max_tracks = max_tracks
+        self.track_points = []
+        self.hits = hits
+        self.hit_records = [
+            # arrays of `columnar.HIT_DTYPE`
+        ]
+        self.hit_rows = [
+            # single hits from `fill_event`
+        ]
+
+    def fill_event(self, event):
+        """Analyse one event with the usual `cbmsim` branches."""
+        h = self.h
+        mom = self.mom
+        self.i += 1
+        i = self.i
         if i % 1000 == 0:
-            print '{}/{}\r'.format(i, n),
+            print '{}\r'.format(i),
         original_muon = event.MCTrack[1]
         h['smear'].Fill(original_muon.GetStartX(), original_muon.GetStartY())
         draw = False
@@ -110,6 +219,11 @@ def analyse(tree, outputfile):
                 if not hit.GetEnergyLoss() > 0:
                     continue
                 pid = hit.PdgCode()
+                if self.hits and abs(pid) == 13:
+                    hit.Momentum(mom)
+                    self.hit_rows.append(
+                        (i - 1, pid, hit.GetX(), hit.GetY(), hit.GetZ(),
+                         mom.Px(), mom.Py(), mom.Pz()))
                 if (
                         hit.GetZ() > (Z_Sensitive_Plane - 1) and
                         hit.GetZ() < (Z_Sensitive_Plane + 1) and
@@ -139,47 +253,146 @@ def analyse(tree, outputfile):
                                                   original_muon.GetPt())
                         if pid == 13:
                             h['mu_w_pos'].Fill(x, y, w)
-                            draw = 4
                         else:
                             h['anti-mu_w_pos'].Fill(-x, y, w)
-                            draw = 6
-        xs.push_back(weight)
+                        draw = pid
+        self.xs.push_back(weight)
+        self.muons_w += weight
         if draw:
-            graph_x, graph_y = graph_tracks(event)
-            graph_x.SetLineColor(draw)
-            graph_y.SetLineColor(draw)
-            name = 'c{}'.format(i)
-            c = r.TCanvas(name, name, 1600, 900)
-            multigraph = r.TMultiGraph(
-                'tracks_{}'.format(i),
-                'Tracks in acceptance and side;z [cm];x/y [cm]')
-            graph_x.SetLineStyle(1)
-            graph_x.SetMarkerStyle(20)
-            graph_x.SetTitle('x-projection')
-            graph_x.SetFillStyle(0)
-            graph_y.SetTitle('y-projection')
-            graph_y.SetLineStyle(2)
-            graph_y.SetMarkerStyle(20)
-            graph_y.SetFillStyle(0)
-            multigraph.Add(graph_x, 'lp')
-            multigraph.Add(graph_y, 'lp')
-            multigraph.Draw('Alp')
-            c.BuildLegend()
-            c.Write()
-    print 'Loop done'
-    for key in h:
-        classname = h[key].Class().GetName()
-        if 'TH' in classname or 'TP' in classname:
-            h[key].Write()
-    f.Close()
-    return xs
+            self.record_tracks(event, i, draw)
+
+    def record_tracks(self, event, number, pid):
+        """Keep the track points of an event in the acceptance."""
+        if self.tracks and len(self.track_points) < self.max_tracks:
+            self.track_points.append(track_points(event, number, pid))
+
+    @property
+    def exceeded(self):
+        """Whether the sum of the muon weights exceeds the bound."""
+        return self.bound is not None and self.muons_w > self.bound
+
+    def fill_tree(self, tree):
+        """Analyse all events of `tree` at once, see `columnar`.
+
+        Gives the same histograms, weights and tracks as `fill_event`. Only
+        the events of which the tracks are recorded are read in full.
+
+        """
+        h = self.h
+        n_events = tree.GetEntries()
+        event, pid, x, y, z, px, py, pz, eloss = read_columns(
+            tree, HIT_COLUMNS, 'abs(vetoPoint.fPdgCode) == 13')
+        start_x, start_y, p_original, pt_original = read_columns(
+            tree, TRACK_COLUMNS)
+        event = event.astype(int)
+
+        if self.hits:
+            muons = eloss > 0
+            self.hit_records.append(columnar.hit_records(
+                self.i + event[muons], pid[muons], x[muons], y[muons],
+                z[muons], px[muons], py[muons], pz[muons]))
+        selected = columnar.select_hits(pid, z, eloss)
+        event, pid, x, y = event[selected], pid[selected], x[selected], \
+            y[selected]
+        p = columnar.momentum(px[selected], py[selected], pz[selected])
+        x_mirrored, accepted, w = columnar.muon_weights(pid, x, y, p)
+        weights = columnar.event_weights(event, w, n_events)
+
+        fill_hist(h['smear'], start_x, start_y)
+        fill_hist(h['mu_pos'], x[pid == 13], y[pid == 13])
+        fill_hist(h['anti-mu_pos'], x[pid == -13], y[pid == -13])
+        original = event[accepted]
+        fill_hist(h['mu_p'], p[accepted])
+        fill_hist(h['mu_p_original'], p_original[original])
+        fill_hist(h['mu_pt_original'], pt_original[original])
+        fill_hist(h['mu_ppt_original'], p_original[original],
+                  pt_original[original])
+        muons = accepted & (pid == 13)
+        fill_hist(h['mu_w_pos'], x_mirrored[muons], y[muons], w[muons])
+        anti_muons = accepted & (pid == -13)
+        fill_hist(h['anti-mu_w_pos'], -x_mirrored[anti_muons], y[anti_muons],
+                  w[anti_muons])
+
+        if self.tracks:
+            # pid of the last muon in the acceptance of every event
+            reverse = event[accepted][::-1]
+            events, last = np.unique(reverse, return_index=True)
+            pids = pid[accepted][::-1][last]
+            for n, muon_pid in zip(events[:self.max_tracks],
+                                   pids[:self.max_tracks]):
+                tree.GetEntry(int(n))
+                self.record_tracks(tree, self.i + n + 1, int(muon_pid))
+
+        for weight in weights:
+            self.xs.push_back(weight)
+        self.i += n_events
+        self.muons_w += weights.sum()
+
+    def fill_current_event(self):
+        """Analyse the event which the running simulation just finished.
+
+        Stops the run once the bound is exceeded, since the weights of the
+        remaining events can only increase the sum.
+
+        """
+        if self.current_event is None:
+            self.current_event = CurrentEvent()
+        self.fill_event(self.current_event)
+        if self.exceeded:
+            print 'Bound of {} exceeded after {} events.'.format(
+                self.bound, self.i)
+            r.TVirtualMC.GetMC().StopRun()
+
+    def close(self):
+        """Save histograms and tracks, return the vector of muon weights."""
+        print 'Loop done'
+        if self.tracks:
+            np.save(self.tracks, np.concatenate(
+                self.track_points or [np.empty(0, dtype=TRACK_DTYPE)]))
+        if self.hits:
+            hits = self.hit_records + [
+                np.array(self.hit_rows, dtype=columnar.HIT_DTYPE)]
+            np.savez_compressed(
+                self.hits, hits=np.concatenate(hits), n_events=self.i)
+        self.f.cd()
+        for key in self.h:
+            classname = self.h[key].Class().GetName()
+            if 'TH' in classname or 'TP' in classname:
+                self.h[key].Write()
+        self.f.Close()
+        return self.xs
+
+
+def analyse(tree, outputfile, tracks=None):
+    """Analyse tree to find hit positions and create histograms.
+
+    Parameters
+    ----------
+    tree
+        Tree or Chain of trees with the usual `cbmsim` format
+    outputfile : str
+        Filename for the file in which the histograms are saved,
+        will be overwritten
+    tracks : str
+        If given, the tracks of some events in the acceptance are saved to
+        this file, see `StreamingAnalysis`
+
+    Returns
+    -------
+    std::vector<double>
+        Vector of hit x-positions [cm]
+
+    """
+    analysis = StreamingAnalysis(outputfile, tracks=tracks)
+    analysis.fill_tree(tree)
+    return analysis.close()
 
 
 def main():
     """Run standalone analysis and print FCN."""
     f = r.TFile.Open(args.input, 'read')
     tree = f.cbmsim
-    xs = analyse(tree, args.output)
+    xs = analyse(tree, args.output, tracks=args.tracks)
     L, W = get_geo(args.geofile)
     fcn = FCN(W, np.array(xs), L)
     print fcn, len(xs)
@@ -192,5 +405,6 @@ if __name__ == '__main__':
     parser.add_argument('-f', '--input', required=True)
     parser.add_argument('-g', '--geofile', required=True)
     parser.add_argument('-o', '--output', default='test.root')
+    parser.add_argument('--tracks', help='File for the tracks to be drawn')
     args = parser.parse_args()
     main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Analytic length and mass of the muon shield from its parameter vector.
+
+Mirrors the construction of the shield by FairShip's `ShipMuonShield` (design
+8) as described by the 56 parameters (see `reconstruct_vector`): 8 half
+lengths including half of the gap between magnets, followed by dXIn, dXOut,
+dYIn, dYOut, gapIn, gapOut for each of the 8 magnets. Every magnet consists of
+the middle magnets, the return yokes and the four corners, each a TGeoArb8
+whose 4 vertices at the entrance are linearly connected to the 4 vertices at
+the exit.
+
+All functions take a single parameter vector or an array of shape
+`(n_points, 56)`, and return a float or an array of shape `(n_points,)`.
+
+"""
+import os
+import json
+import sqlite3
+import argparse
+
+import numpy as np
+
+N_MAGNETS = 8
+Z_GAP = 10.  # cm, between magnets
+ANTI_OVERLAP = 0.1  # cm, between fields in the corners of the magnets
+IRON_DENSITY = 7.87  # g/cm^3
+MIN_CHECKED = 20  # built geometries needed to trust `WeightDeviation`
+
+
+def _Params(params):
+    params = np.asarray(params, dtype=float)
+    return params if params.ndim == 2 else params[np.newaxis]
+
+
+def _Result(result, params):
+    return result if np.ndim(params) == 2 else float(result[0])
+
+
+def _Magnets(params):
+    """Split the parameters into arrays of shape `(n_points, N_MAGNETS)`."""
+    params = _Params(params)
+    dZ = params[:, :N_MAGNETS] - Z_GAP / 2
+    per_magnet = params[:, N_MAGNETS:].reshape(-1, N_MAGNETS, 6)
+    dXIn, dXOut, dYIn, dYOut, gapIn, gapOut = np.moveaxis(per_magnet, 2, 0)
+    return dZ, (dXIn, dYIn, gapIn), (dXOut, dYOut, gapOut)
+
+
+def _Corners(dX, dY, gap):
+    """Vertices of the pieces of a magnet in one z plane.
+
+    Returns
+    -------
+    list
+        `(multiplicity, x, y)` for each piece, with arrays of shape
+        `(..., 4)` for the x and y coordinates of its 4 vertices
+
+    """
+    middle_gap = 0.
+    a = ANTI_OVERLAP
+
+    def stack(*vertices):
+        return np.stack(np.broadcast_arrays(*vertices), -1)
+
+    middle_mag = (
+        stack(middle_gap, middle_gap, dX + middle_gap, dX + middle_gap),
+        stack(-(dY + dX - a), dY + dX - a, dY - a, -(dY - a)),
+    )
+    mag_ret = (
+        stack(dX + middle_gap + gap, dX + middle_gap + gap,
+              2 * dX + middle_gap + gap, 2 * dX + middle_gap + gap),
+        stack(-(dY - a), dY - a, dY + dX - a, -(dY + dX - a)),
+    )
+    corner = (
+        stack(middle_gap + dX, middle_gap, 2 * dX + middle_gap + gap,
+              dX + middle_gap + gap),
+        stack(dY, dY + dX, dY + dX, dY),
+    )
+    # left and right middle magnets and return yokes, four corners
+    return [(2, ) + middle_mag, (2, ) + mag_ret, (4, ) + corner]
+
+
+def _Area(x, y):
+    """Shoelace area of the polygons with vertices along the last axis."""
+    return 0.5 * np.abs(
+        np.sum(x * np.roll(y, -1, axis=-1) - np.roll(x, -1, axis=-1) * y,
+               axis=-1))
+
+
+def MagnetVolumes(params):
+    """Iron volume of each magnet [cm^3], shape `(n_points, N_MAGNETS)`.
+
+    The cross section of an Arb8 is quadratic in z, so Simpson's rule on the
+    entrance, middle and exit areas is exact.
+
+    """
+    dZ, entrance, exit = _Magnets(params)
+    middle = [(i + o) / 2 for i, o in zip(entrance, exit)]
+    volume = 0.
+    planes = [_Corners(*plane) for plane in (entrance, middle, exit)]
+    for (n, x_in, y_in), (_, x_mid, y_mid), (_, x_out, y_out) in zip(*planes):
+        volume += n * 2 * dZ / 6 * (
+            _Area(x_in, y_in) + 4 * _Area(x_mid, y_mid) + _Area(x_out, y_out))
+    return volume
+
+
+def MagnetMass(params):
+    """Mass of the magnets [kg], like `get_geo.magnetMass`."""
+    mass = MagnetVolumes(params).sum(axis=1) * IRON_DENSITY / 1000.
+    return _Result(mass, params)
+
+
+def MagnetLength(params):
+    """Length of the shield [cm], like `get_geo.magnetLength`.
+
+    Sum of the magnet lengths and the gaps between them, ignoring one gap.
+
+    """
+    length = 2 * _Params(params)[:, :N_MAGNETS].sum(axis=1) - Z_GAP
+    return _Result(length, params)
+
+
+def CheckCatalog(store, cache_dir):
+    """Compare with the results of `get_geo` in the geometry cache.
+
+    The catalog of the `geometry_cache.GeometryCache` in `cache_dir` holds
+    the length and weight of every geometry built by a job, by the id of its
+    parameters. The parameters are taken from the point store `store`.
+
+    Returns
+    -------
+    list
+        `(id, length, analytic length, weight, analytic weight)` per point
+
+    """
+    catalog = os.path.join(cache_dir, 'catalog.sqlite')
+    if not os.path.exists(catalog):
+        return []
+    db = sqlite3.connect(catalog, timeout=60)
+    try:
+        geometries = {
+            key: (length, weight)
+            for key, length, weight in db.execute(
+                'SELECT id, length, weight FROM geometries '
+                'WHERE weight IS NOT NULL')
+        }
+    finally:
+        db.close()
+    rows = store.db.execute('SELECT DISTINCT id, params FROM points')
+    checked = []
+    for point_id, params in rows:
+        if point_id not in geometries:
+            continue
+        length, weight = geometries[point_id]
+        params = json.loads(params)
+        checked.append((point_id, length, MagnetLength(params), weight,
+                        MagnetMass(params)))
+    return checked
+
+
+def WeightDeviation(checked):
+    """Largest relative deviation of `MagnetMass` from the `get_geo` weights.
+
+    `checked` are the results of `CheckCatalog`. Returns None with fewer than
+    `MIN_CHECKED` points, which are too few to tell.
+
+    """
+    if len(checked) < MIN_CHECKED:
+        return None
+    _, _, _, weight, weight_ = map(np.array, zip(*checked))
+    return float(np.max(np.abs(weight_ / weight - 1)))
+
+
+def main():
+    from point_store import PointStore
+    from config import POINT_STORE, GEOMETRY_CACHE
+    parser = argparse.ArgumentParser(
+        description='Check the analytic geometry against get_geo.')
+    parser.add_argument('--store', default=POINT_STORE)
+    parser.add_argument('--cache', default=GEOMETRY_CACHE)
+    args = parser.parse_args()
+    checked = CheckCatalog(PointStore(args.store), args.cache)
+    for point_id, length, length_, weight, weight_ in checked:
+        print('{} L: {:.1f} {:.1f} W: {:.0f} {:.0f} ({:+.2%})'.format(
+            point_id, length, length_, weight, weight_,
+            weight_ / weight - 1))
+    if checked:
+        _, length, length_, weight, weight_ = map(np.array, zip(*checked))
+        print('{} points, max |dL| {:.2f} cm, W deviation {:+.2%} +- {:.2%}'.
+              format(
+                  len(checked), np.max(np.abs(length_ - length)),
+                  np.mean(weight_ / weight - 1), np.std(weight_ / weight - 1)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""Batch acquisition by scoring a large candidate pool at once.
+
+Instead of refitting the surrogate once per batch member (constant liar),
+the latest surrogate of the optimizer scores a pool of random and locally
+perturbed candidates in one vectorised prediction, split over a process
+pool which lives as long as the optimizer. The batch is then picked greedily
+by expected improvement, skipping candidates too close to points already
+picked, evaluated or pending.
+
+"""
+import os
+import atexit
+import pickle
+import itertools
+import tempfile
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+from scipy.stats import norm
+
+N_CANDIDATES = 20000
+LOCAL_SHARE = 0.5  # of the candidates perturbed around the best points
+N_BEST = 10  # best points to perturb around
+LOCAL_SCALE = 0.05  # std of the perturbation relative to the dimension range
+MIN_DISTANCE = 0.02  # rms distance in the normalised space
+CHUNK_SIZE = 2000
+
+# surrogate loaded by a worker and the file it was loaded from
+model = None
+model_file = None
+
+
+def _Predict(task):
+    """Predict a chunk in a worker, loading the surrogate once per ask."""
+    global model, model_file
+    path, X = task
+    if path != model_file:
+        with open(path, 'rb') as f:
+            model = pickle.load(f)
+        # the worker's own copy, the pool already uses every core
+        if hasattr(model, 'n_jobs'):
+            model.n_jobs = 1
+        model_file = path
+    return model.predict(X, return_std=True)
+
+
+def ExpectedImprovement(mu, std, y_opt, xi=0.01):
+    improvement = y_opt - xi - mu
+    std = np.maximum(std, 1e-12)
+    z = improvement / std
+    return improvement * norm.cdf(z) + std * norm.pdf(z)
+
+
+def Bounds(space):
+    bounds = np.array([dim.bounds for dim in space.dimensions], dtype=float)
+    return bounds[:, 0], bounds[:, 1]
+
+
+def Normalise(space, X):
+    low, high = Bounds(space)
+    return (np.asarray(X, dtype=float) - low) / (high - low)
+
+
+def Candidates(clf, n_candidates, local_share=LOCAL_SHARE):
+    """Sample random candidates and perturbations of the best points."""
+    n_local = int(n_candidates * local_share) if clf.yi else 0
+    random = np.asarray(
+        clf.space.rvs(n_candidates - n_local, random_state=clf.rng),
+        dtype=float)
+    if not n_local:
+        return random
+    low, high = Bounds(clf.space)
+    best = np.asarray(clf.Xi, dtype=float)[np.argsort(clf.yi)[:N_BEST]]
+    centres = best[clf.rng.randint(len(best), size=n_local)]
+    local = centres + clf.rng.normal(
+        scale=LOCAL_SCALE * (high - low), size=centres.shape)
+    local = np.clip(np.rint(local), low, high)
+    return np.vstack([random, local])
+
+
+class PredictionPool:
+    """Process pool predicting with the latest surrogate of an optimizer.
+
+    The workers are started once. For every prediction the surrogate is
+    pickled once to a temporary file, which each worker loads at most once.
+
+    """
+
+    def __init__(self, processes=None):
+        self.processes = processes or cpu_count()
+        self.pool = None
+        self.asks = itertools.count()
+
+    def predict(self, model, X):
+        """Predict mean and std of `X` in chunks."""
+        chunks = [X[i:i + CHUNK_SIZE] for i in range(0, len(X), CHUNK_SIZE)]
+        if self.processes <= 1 or len(chunks) <= 1:
+            predictions = [
+                model.predict(chunk, return_std=True) for chunk in chunks
+            ]
+        else:
+            if self.pool is None:
+                self.pool = Pool(processes=self.processes)
+            fd, path = tempfile.mkstemp(
+                prefix='surrogate_{}_'.format(next(self.asks)))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(model, f)
+                predictions = self.pool.map(
+                    _Predict, [(path, chunk) for chunk in chunks])
+            finally:
+                os.remove(path)
+        mu, std = zip(*predictions)
+        return np.concatenate(mu), np.concatenate(std)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+pools = {
+    # processes: PredictionPool
+}
+
+
+def GetPool(processes=None):
+    """Pool of this process, shared by all asks of its optimizer."""
+    if processes not in pools:
+        pools[processes] = PredictionPool(processes)
+        atexit.register(pools[processes].close)
+    return pools[processes]
+
+
+def Predict(model, X, processes=None):
+    """Predict mean and std of `X` in chunks over a process pool."""
+    return GetPool(processes).predict(model, X)
+
+
+def SelectDiverse(X, scores, n_points, excluded=(), min_distance=MIN_DISTANCE):
+    """Greedily pick the best scores at least `min_distance` apart.
+
+    Distances are rms distances between rows of the normalised `X` and to
+    the normalised `excluded` points. If the pool runs out of candidates the
+    distance is halved.
+
+    """
+    available = np.ones(len(X), dtype=bool)
+    for x in excluded:
+        available &= np.sqrt(np.mean((X - x)**2, axis=1)) >= min_distance
+    chosen = []
+    while len(chosen) < n_points:
+        candidates = np.flatnonzero(available)
+        if not len(candidates):
+            if min_distance < 1e-6:
+                break
+            return chosen + SelectDiverse(
+                X, scores, n_points - len(chosen),
+                excluded=list(excluded) + [X[i] for i in chosen],
+                min_distance=min_distance / 2)
+        i = candidates[np.argmax(scores[candidates])]
+        chosen.append(i)
+        available &= np.sqrt(np.mean((X - X[i])**2, axis=1)) >= min_distance
+    return chosen
+
+
+def AskBatch(clf,
+             n_points,
+             pending=(),
+             n_candidates=N_CANDIDATES,
+             processes=None):
+    """Ask `clf` for a diverse batch of `n_points` points.
+
+    Falls back to random points while the optimizer has no surrogate yet.
+
+    """
+    if not clf.models:
+        return clf.space.rvs(n_points, random_state=clf.rng)
+
+    candidates = Candidates(clf, n_candidates)
+    mu, std = Predict(
+        clf.models[-1], clf.space.transform(candidates.tolist()), processes)
+    scores = ExpectedImprovement(mu, std, np.min(clf.yi))
+
+    X = Normalise(clf.space, candidates)
+    excluded = Normalise(clf.space, list(clf.Xi) + list(pending))
+    chosen = SelectDiverse(X, scores, n_points, excluded=excluded)
+    return [[int(x) for x in candidates[i]] for i in chosen]
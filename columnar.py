@@ -0,0 +1,121 @@
+"""Vectorised cuts and weights of the muon hits at the sensitive plane.
+
+Same selection and weights as the event loop of `analyse.StreamingAnalysis`,
+applied to the hits of many events at once. Hits are given as flat arrays
+with the index of the event of each hit, or as the records of `HIT_DTYPE`
+which the shards save for re-analysis. Units are those of `shipunit`.
+
+"""
+import numpy as np
+
+Z_T4 = 3538
+Z_T1 = Z_T4 - 940
+Z_Sensitive_Plane = Z_T1
+
+m = 100.  # cm, as `shipunit.m`
+GeV = 1.  # as `shipunit.GeV`
+
+# muon hits with energy loss, in any sensitive volume
+HIT_DTYPE = np.dtype([
+    ('event', 'i4'),
+    ('pid', 'i4'),
+    ('x', 'f4'),
+    ('y', 'f4'),
+    ('z', 'f4'),
+    ('px', 'f4'),
+    ('py', 'f4'),
+    ('pz', 'f4'),
+])
+
+CUTS = {
+    'z_plane': Z_Sensitive_Plane,
+    'z_window': 1.,
+    'p_min': 1.,
+    'y_max': 5 * m,
+    'x_min': -3 * m,
+    'x_max': 2.6 * m,
+}
+
+
+def select_hits(pid, z, eloss, z_plane=CUTS['z_plane'],
+                z_window=CUTS['z_window']):
+    """Mask of the muon hits with energy loss in the sensitive plane."""
+    return ((eloss > 0) & (np.abs(pid) == 13) & (z > z_plane - z_window) &
+            (z < z_plane + z_window))
+
+
+def momentum(px, py, pz):
+    """Momentum [GeV] of the hits, like `TVector3.Mag`."""
+    return np.sqrt(px * px + py * py + pz * pz) / GeV
+
+
+def weight(x):
+    """Weight of a muon hit in the acceptance at mirrored x."""
+    return np.sqrt((560. - (x + 300.)) / 560.)
+
+
+def muon_weights(pid, x, y, p, p_min=CUTS['p_min'], y_max=CUTS['y_max'],
+                 x_min=CUTS['x_min'], x_max=CUTS['x_max'], weight=weight):
+    """Acceptance and weights of selected muon hits.
+
+    x is mirrored for anti-muons, so that both are bent to the same side.
+
+    Returns
+    -------
+    tuple
+        mirrored x, mask of hits in the acceptance, weight of each hit
+        (zero outside of the acceptance)
+
+    """
+    x = x * (pid / 13.)
+    accepted = ((p > p_min) & (np.abs(y) < y_max) & (x < x_max) &
+                (x > x_min))
+    w = np.zeros(len(x))
+    w[accepted] = weight(x[accepted])
+    return x, accepted, w
+
+
+def event_weights(event, w, n_events):
+    """Sum of the hit weights `w` of each event."""
+    return np.bincount(event, weights=w, minlength=n_events)
+
+
+def hit_records(event, pid, x, y, z, px, py, pz):
+    """Records of `HIT_DTYPE` from the columns of the hits."""
+    hits = np.empty(len(event), dtype=HIT_DTYPE)
+    for name, column in zip(HIT_DTYPE.names,
+                            (event, pid, x, y, z, px, py, pz)):
+        hits[name] = column
+    return hits
+
+
+def analyse_hits(hits, n_events, weight=weight, **cuts):
+    """Weights of the events from their hit records, see `HIT_DTYPE`.
+
+    Parameters
+    ----------
+    hits : np.ndarray
+        Records of the muon hits with energy loss
+    n_events : int
+        Number of simulated events
+    weight : callable
+        Weight of a hit in the acceptance at mirrored x
+    cuts
+        Replace the default `CUTS`
+
+    Returns
+    -------
+    np.ndarray
+        Sum of the hit weights of each event, like `xs` of the shards
+
+    """
+    cuts = dict(CUTS, **cuts)
+    selected = select_hits(hits['pid'], hits['z'], np.ones(len(hits)),
+                           cuts['z_plane'], cuts['z_window'])
+    hits = hits[selected]
+    p = momentum(hits['px'].astype(float), hits['py'].astype(float),
+                 hits['pz'].astype(float))
+    _, _, w = muon_weights(
+        hits['pid'], hits['x'].astype(float), hits['y'].astype(float), p,
+        cuts['p_min'], cuts['y_max'], cuts['x_min'], cuts['x_max'], weight)
+    return event_weights(hits['event'], w, n_events)
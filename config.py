@@ -85,6 +85,7 @@ RESULTS_TEMPLATE = {
     'length': None,
     'muons': None,
     'muons_w': None,
+    'bounded': False,
     'args': None,
     'status': None,
 }
@@ -115,7 +116,12 @@ JOB_TEMPLATE = {
         '''muons_{job_id}_16.root '''
         '''--results /output/result.json '''
         '''--hists /output/hists_{IMAGE_TAG}_'''
-        '''{params}_{job_id}_{sampling}_{seed}.root --seed {seed}' ''',
+        '''{params}_{job_id}_{sampling}_{seed}.root --seed {seed} '''
+        '''--tracks /output/tracks_{IMAGE_TAG}_'''
+        '''{params}_{job_id}_{sampling}_{seed}.npy '''
+        '''--hits /output/hits_{IMAGE_TAG}_'''
+        '''{point_id}_{sampling}_{seed}_{job_id}.npz'''
+        '''{geofile}{bound}' ''',
     },
     'required_outputs': {
         'output_uri': 'eos:/eos/experiment/ship/skygrid/histograms_raw',
@@ -126,6 +132,42 @@ JOB_TEMPLATE = {
     }
 }
 
+GEOMETRY_URI = 'eos:/eos/experiment/ship/skygrid/geometries'
+GEOMETRY_JOB_TEMPLATE = {
+    'input': [],
+    'container': {
+        'workdir':
+        '',
+        'name':
+        '{}:{}'.format(IMAGE, IMAGE_TAG),
+        'volumes': [
+            '/home/sashab1/ship-shield:/shield',
+            '/home/sashab1/ship/shared:/shared',
+        ],
+        'cpu_needed':
+        1,
+        'max_memoryMB':
+        1024,
+        'min_memoryMB':
+        512,
+        'run_id':
+        'near_run3',
+        'cmd':
+        '''/bin/bash -l -c 'source /opt/FairShipRun/config.sh; '''
+        '''python2 /code/slave.py '''
+        '''--params {params} '''
+        '''--geometry_only '''
+        '''--results /output/result.json' ''',
+    },
+    'required_outputs': {
+        'output_uri': GEOMETRY_URI,
+        'file_contents': [{
+            'file': 'result.json',
+            'to_variable': 'result'
+        }]
+    }
+}
+
 METADATA_TEMPLATE = {
     'user': {
         'tag': '',
@@ -137,6 +179,19 @@ METADATA_TEMPLATE = {
     'disney': {}
 }
 
+GEOMETRY_CACHE = '/shared/geometries'
+GEOMETRY_CACHE_BUDGET = 20 * 2**30  # bytes
+WORKER_SOCKET = '/shared/worker.sock'
+WEIGHT_LIMIT = 3e6  # kg, heavier geometries are not simulated
+WEIGHT_MARGIN = 0.02  # accuracy of `analytic_geo.MagnetMass` needed to screen
+# Share of the `muons_w` at which a point loses against the incumbent given to
+# each shard as `--bound`. With 1 a stopped shard proves that its point loses,
+# smaller shares stop earlier but may give up on points which could still win.
+SHARD_BOUND_SHARE = 1.
+# Points are pruned once the loss of their completed shards exceeds this
+# quantile of the losses so far, 0 being the incumbent.
+PRUNE_QUANTILE = 0.
+
 RUN = 'discrete4'
 POINTS_IN_BATCH = 20
 RANDOM_STARTS = 100
@@ -147,3 +202,5 @@ MIN = [
     192, 14, 9, 10, 31, 35, 31, 51, 11, 3, 32, 54, 24, 8, 8, 22, 32, 209, 35,
     8, 13, 33, 77, 85, 241, 9, 26
 ]
+
+POINT_STORE = 'points.sqlite'
@@ -2,13 +2,27 @@ import json
 import hashlib
 import numpy as np
 from skopt.space.space import Integer, Space
-from config import FIXED_PARAMS, FIXED_RANGES
+from config import FIXED_PARAMS, FIXED_RANGES, WEIGHT_LIMIT
 
 
 def FCN(W, Sxi2, _):
     W_star = 1915820.
     return (1 + np.exp(10. * (W - W_star) / W_star)) * (
-        1. + Sxi2) if W <= 3e6 else 1e8
+        1. + Sxi2) if W <= WEIGHT_LIMIT else 1e8
+
+
+def MuonsBound(W, y):
+    """Largest `Sxi2` for which `FCN(W, Sxi2, _)` does not exceed `y`.
+
+    Since FCN increases with `Sxi2`, any point of weight `W` with a larger
+    `Sxi2` has a loss above `y`. Returns None if no such `Sxi2` exists.
+
+    """
+    if W > WEIGHT_LIMIT:
+        return None
+    # FCN is proportional to 1 + Sxi2 below the weight limit
+    bound = y / FCN(W, 0., None) - 1.
+    return float(bound) if bound >= 0 else None
 
 
 def ParseParams(params_string):
@@ -71,5 +85,5 @@ def AddFixedParams(point):
 def create_id(params):
     params_json = json.dumps(params)
     h = hashlib.md5()
-    h.update(params_json)
+    h.update(params_json.encode('utf8'))
     return h.hexdigest()
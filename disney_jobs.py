@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+import time
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from disneylandClient import (
+    Job,
+    RequestWithId,
+)
+
+STATUS_IN_PROCESS = set([
+    Job.PENDING,
+    Job.PULLED,
+    Job.RUNNING,
+])
+STATUS_FINAL = set([
+    Job.COMPLETED,
+    Job.FAILED,
+])
+
+MIN_POLL_INTERVAL = 5  # seconds
+MAX_POLL_INTERVAL = 60  # seconds
+POLL_BACKOFF = 1.5
+POLL_THREADS = 16
+
+
+class JobTracker:
+    """Track groups of jobs (e.g. the shards of a point) until they are final.
+
+    Every poll only refreshes jobs which are not final yet, and all requests of
+    one poll are sent concurrently. The interval between polls grows by
+    `backoff` while nothing changes and drops back to `min_interval` as soon as
+    any job changes its status. A group is reported once, as soon as all of
+    its jobs are final. Groups may be added from another thread while a poll
+    is in progress. The threads of the tracker are stopped by `close`, or by
+    leaving a `with` block.
+
+    """
+
+    def __init__(self,
+                 stub,
+                 min_interval=MIN_POLL_INTERVAL,
+                 max_interval=MAX_POLL_INTERVAL,
+                 backoff=POLL_BACKOFF,
+                 threads=POLL_THREADS):
+        self.stub = stub
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.groups = {
+            # key: latest known state of the jobs
+        }
+        self.started = {
+            # key: time the group was added
+        }
+        self.changes = [
+            # (key, old job, new job) whose status changed in the last poll
+        ]
+        self._keys = itertools.count()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop the polling threads."""
+        self._pool.shutdown()
+
+    def add(self, jobs, key=None):
+        """Start tracking `jobs` as one group and return the group key."""
+        with self._lock:
+            if key is None:
+                key = next(self._keys)
+            self.groups[key] = list(jobs)
+            self.started[key] = time.time()
+            self.interval = self.min_interval
+        return key
+
+    def remove(self, key):
+        """Stop tracking a group and return its latest known jobs."""
+        with self._lock:
+            self.started.pop(key, None)
+            return self.groups.pop(key)
+
+    def cancel(self, key):
+        """Stop tracking a group, cancel its unfinished jobs, return the group.
+
+        Unfinished jobs are marked as failed, so that no worker pulls them.
+
+        """
+        with self._lock:
+            pending = [(i, job) for i, job in enumerate(self.groups[key])
+                       if job.status not in STATUS_FINAL]
+        for i, job in pending:
+            cancelled = self._cancel_job(job)
+            if cancelled is None:
+                continue
+            with self._lock:
+                if key in self.groups:
+                    self.groups[key][i] = cancelled
+        return self.remove(key)
+
+    def _cancel_job(self, job):
+        """Mark `job` as failed, return the job or None if that failed."""
+        try:
+            return self.stub.ModifyJob(Job(id=job.id, status=Job.FAILED))
+        except Exception as e:
+            print('Could not cancel job {}: {}'.format(job.id, e))
+
+    def _get_job(self, job):
+        return self.stub.GetJob(RequestWithId(id=job.id))
+
+    def poll(self):
+        """Refresh all unfinished jobs once.
+
+        Returns
+        -------
+        list
+            `(key, jobs)` for every group which became final during this poll
+
+        """
+        with self._lock:
+            pending = [(key, i, job)
+                       for key, jobs in self.groups.items()
+                       for i, job in enumerate(jobs)
+                       if job.status not in STATUS_FINAL]
+        updated = list(
+            self._pool.map(self._get_job, [job for _, _, job in pending]))
+
+        with self._lock:
+            self.changes = []
+            for (key, i, old), new in zip(pending, updated):
+                if key in self.groups:
+                    if new.status != old.status:
+                        self.changes.append((key, old, new))
+                    self.groups[key][i] = new
+
+            self.interval = self.min_interval if self.changes else min(
+                self.interval * self.backoff, self.max_interval)
+
+            final = [
+                key for key, jobs in self.groups.items()
+                if all(job.status in STATUS_FINAL for job in jobs)
+            ]
+        return [(key, self.remove(key)) for key in final]
+
+    def expire(self, timeout):
+        """Stop tracking and return groups added more than `timeout` s ago."""
+        now = time.time()
+        with self._lock:
+            expired = [
+                key for key, started in self.started.items()
+                if now - started > timeout
+            ]
+        return [(key, self.remove(key)) for key in expired]
+
+    def wait(self, timeout=None, verbose=False):
+        """Yield `(key, jobs)` for each group as soon as it is final.
+
+        Stops when no groups are left or, if given, after `timeout` seconds.
+        Groups which are still unfinished then remain in the tracker. Only
+        polls which changed the status of a job are logged, with `verbose`
+        every change.
+
+        """
+        start = time.time()
+        while self.groups:
+            time.sleep(self.interval)
+            final = self.poll()
+            if verbose:
+                for key, old, new in self.changes:
+                    print('[{}] Job {} of group {}: status {} -> {}'.format(
+                        time.time(), new.id, key, old.status, new.status))
+            for item in final:
+                yield item
+            if not self.groups:
+                return
+            if self.changes and not verbose:
+                print('[{}] Waiting for {} points...'.format(
+                    time.time(), len(self.groups)))
+            if timeout is not None and time.time() - start > timeout:
+                return
@@ -1,27 +1,19 @@
 #!/usr/bin/env python3
-import time
 import json
 import base64
 import copy
 import argparse
+import numpy as np
 from disneylandClient import (
     new_client,
     Job,
-    RequestWithId,
 )
 import config
 from config import RUN, IMAGE_TAG
 import disney_common as common
+from disney_jobs import JobTracker, STATUS_IN_PROCESS, STATUS_FINAL  # noqa
 
-STATUS_IN_PROCESS = set([
-    Job.PENDING,
-    Job.PULLED,
-    Job.RUNNING,
-])
-STATUS_FINAL = set([
-    Job.COMPLETED,
-    Job.FAILED,
-])
+MIN_SHARDS = 8  # completed shards needed for a partial estimate
 
 
 def ProcessPoint(jobs, tag):
@@ -52,7 +44,16 @@ def ExtractParams(metadata):
     return common.ParseParams(params)
 
 
-def get_result(jobs):
+def get_job_result(job):
+    var = [o for o in json.loads(job.output)
+           if o.startswith("variable")][0]
+    result = json.loads(var.split("=", 1)[1])
+    if result['error']:
+        raise Exception(result['error'])
+    return result
+
+
+def get_result(jobs, geometry=None):
     results = []
     for job in jobs:
         if job.status != Job.COMPLETED:
@@ -60,19 +61,10 @@ def get_result(jobs):
                 "Incomplete job while calculating result: %d",
                 job.id
             )
+        results.append(get_job_result(job))
 
-        var = [o for o in json.loads(job.output)
-               if o.startswith("variable")][0]
-        result = json.loads(var.split("=", 1)[1])
-        if result['error']:
-            raise Exception(result['error'])
-        results.append(result)
-
-    # Only one job per machine calculates the weight and the length
-    # -> take first we find
-    weight = float([r['weight'] for r in results if r['weight']][0])
-    length = float([r['length'] for r in results if r['length']][0])
-    if weight < 3e6:
+    weight, length = get_geometry(results, geometry)
+    if weight < config.WEIGHT_LIMIT:
         muons = sum(int(result['muons']) for result in results)
         muons_w = sum(float(result['muons_w']) for result in results)
     else:
@@ -80,7 +72,76 @@ def get_result(jobs):
     return weight, length, muons, muons_w
 
 
-def CreateMetaData(point, tag, sampling, seed):
+def is_bounded(jobs):
+    """Whether a shard stopped at its bound, so `muons_w` is a lower bound."""
+    return any(
+        get_job_result(job).get('bounded') for job in jobs
+        if job.status == Job.COMPLETED)
+
+
+def get_geometry(results, geometry=None):
+    if geometry is not None:
+        result = get_job_result(geometry)
+        return float(result['weight']), float(result['length'])
+    # Only one job per machine calculates the weight and the length
+    # -> take first we find
+    try:
+        weight = float([r['weight'] for r in results if r['weight']][0])
+        length = float([r['length'] for r in results if r['length']][0])
+    except IndexError:
+        raise Exception("No completed shard reported weight and length")
+    return weight, length
+
+
+def get_partial_result(jobs, geometry=None, min_shards=MIN_SHARDS):
+    """Estimate the result of a point of which not all shards completed.
+
+    The sum of `muons_w` over all N shards is estimated from the k completed
+    shards as N times their mean. Its uncertainty is the standard error of
+    that estimate for k shards drawn without replacement from N.
+
+    Returns
+    -------
+    tuple
+        weight, length, muons_w, uncertainty of muons_w, k
+
+    """
+    completed = [job for job in jobs if job.status == Job.COMPLETED]
+    if len(completed) < min_shards:
+        raise Exception(
+            "Only %d of %d shards completed" % (len(completed), len(jobs)))
+    results = [get_job_result(job) for job in completed]
+    weight, length = get_geometry(results, geometry)
+    if weight >= config.WEIGHT_LIMIT:
+        return weight, length, 0, 0, len(completed)
+
+    n, k = len(jobs), len(completed)
+    muons_w = np.array([float(r['muons_w']) for r in results])
+    error = n * muons_w.std(ddof=1) / np.sqrt(k) * np.sqrt(
+        float(n - k) / (n - 1)) if k > 1 else float('inf')
+    return weight, length, float(n * muons_w.mean()), float(error), k
+
+
+def get_lower_bound(jobs, geometry=None):
+    """Lower bound on the result of a point from its completed shards.
+
+    Since every `muons_w` is non-negative, the sum over the completed shards
+    bounds the sum over all shards from below.
+
+    Returns
+    -------
+    tuple
+        weight, length, muons_w of the completed shards, k
+
+    """
+    results = [get_job_result(job) for job in jobs
+               if job.status == Job.COMPLETED]
+    weight, length = get_geometry(results, geometry)
+    muons_w = sum(float(result['muons_w']) for result in results)
+    return weight, length, muons_w, len(results)
+
+
+def CreateMetaData(point, tag, sampling, seed, stage=None):
     metadata = copy.deepcopy(config.METADATA_TEMPLATE)
     metadata['user'].update([
         ('tag', tag),
@@ -88,46 +149,57 @@ def CreateMetaData(point, tag, sampling, seed):
         ('seed', seed),
         ('sampling', sampling),
     ])
+    if stage:
+        metadata['user']['stage'] = stage
     return json.dumps(metadata)
 
 
-def CreateJobInput(point, number, sampling, seed):
+def GeometryFile(point):
+    """Name of the parameter file written by the geometry job of `point`."""
+    return 'params_{}.root'.format(common.create_id([float(x) for x in point]))
+
+
+def CreateJobInput(point, number, sampling, seed, geofile=None, bound=None):
+    """Input of simulation job `number` of `point`.
+
+    With `geofile` the geometry created by the geometry job of the point is
+    used, instead of the shards creating it themselves. With `bound` the job
+    stops transporting muons once its `muons_w` exceeds it.
+
+    """
     job = copy.deepcopy(config.JOB_TEMPLATE)
+    if geofile:
+        job['input'] = job['input'] + [config.GEOMETRY_URI + '/' + geofile]
     job['container']['cmd'] = \
         job['container']['cmd'].format(
             params=base64.b64encode(str(point).encode('utf8')).decode('utf8'),
             sampling=sampling,
             seed=seed,
             job_id=number+1,
-            IMAGE_TAG=IMAGE_TAG
+            IMAGE_TAG=IMAGE_TAG,
+            point_id=common.create_id([float(x) for x in point]),
+            geofile=' --geofile /input/' + geofile if geofile else '',
+            bound=' --bound {!r}'.format(float(bound))
+            if bound is not None else ''
+        )
+
+    return json.dumps(job)
+
+
+def CreateGeometryInput(point):
+    job = copy.deepcopy(config.GEOMETRY_JOB_TEMPLATE)
+    job['container']['cmd'] = \
+        job['container']['cmd'].format(
+            params=base64.b64encode(str(point).encode('utf8')).decode('utf8')
         )
 
     return json.dumps(job)
 
 
 def WaitForCompleteness(jobs, verbose=False):
-    uncompleted_jobs = jobs
-
-    while True:
-        time.sleep(3)
-        uncompleted_jobs = [
-            stub.GetJob(RequestWithId(id=job.id))
-            for job in uncompleted_jobs
-        ]
-        if verbose:
-            print("[{}] Job :\n {}\n".format(time.time(), uncompleted_jobs[0]))
-        else:
-            print("[{}] Waiting...".format(time.time()))
-
-        uncompleted_jobs = [
-            job for job in uncompleted_jobs
-            if job.status not in STATUS_FINAL
-        ]
-
-        if not uncompleted_jobs:
-            break
-
-    jobs = [stub.GetJob(RequestWithId(id=job.id)) for job in jobs]
+    with JobTracker(stub, min_interval=3) as tracker:
+        tracker.add(jobs)
+        _, jobs = next(tracker.wait(verbose=verbose))
 
     if any(job.status == Job.FAILED for job in jobs):
         print("Job failed!")
@@ -1,10 +1,14 @@
 #!/usr/bin/env python3
+import os
 import time
 import argparse
+import asyncio
 import json
-import pickle
+import collections
 
-from disneylandClient import (Job, RequestWithId, ListJobsRequest, new_client)
+import numpy as np
+
+from disneylandClient import (Job, new_client)
 
 from sklearn.ensemble import GradientBoostingRegressor
 from skopt import Optimizer
@@ -12,28 +16,66 @@ from skopt.learning import (GaussianProcessRegressor, RandomForestRegressor,
                             GradientBoostingQuantileRegressor)
 
 from disney_common import (FCN, CreateReducedSpace, CreateDiscreteSpace,
-                           StripFixedParams, AddFixedParams)
-from disney_oneshot import (get_result, CreateJobInput, CreateMetaData,
-                            ExtractParams, STATUS_FINAL)
+                           StripFixedParams, AddFixedParams, MuonsBound)
+from disney_oneshot import (get_result, get_partial_result, get_geometry,
+                            get_lower_bound, get_job_result, is_bounded,
+                            MIN_SHARDS, CreateJobInput,
+                            CreateGeometryInput, CreateMetaData,
+                            ExtractParams, GeometryFile)
+from stragglers import RUNTIME_HISTORY
+from pipeline import PointPipeline
+from point_store import PointStore
+from disney_sync import SyncPoints
+from optimizer_log import OptimizerLog
+from surrogate import CreateSurrogate, CommitSurrogate
+from batch_acquisition import AskBatch
+from analytic_geo import (MagnetMass, MagnetLength, CheckCatalog,
+                          WeightDeviation)
 
 from config import (RUN, POINTS_IN_BATCH, RANDOM_STARTS, MIN, IMAGE_TAG,
-                    COMPATIBLE_TAGS)
+                    COMPATIBLE_TAGS, POINT_STORE, WEIGHT_LIMIT, WEIGHT_MARGIN,
+                    SHARD_BOUND_SHARE, PRUNE_QUANTILE, GEOMETRY_CACHE)
+
+WAIT_TIMEOUT = 60 * 60 * 3  # seconds
+
 
-SLEEP_TIME = 60  # seconds
+def ProcessPoint(geometry, jobs, tag):
+    """Calculate the loss of a point from its geometry job and its shards.
 
+    `jobs` is None if the geometry job failed or the geometry is too heavy.
 
-def ProcessPoint(jobs, tag):
-    if json.loads(jobs[0].metadata)['user']['tag'] == tag:
+    """
+    metadata = jobs[0].metadata if jobs else geometry.metadata
+    if json.loads(metadata)['user']['tag'] == tag:
         try:
-            weight, length, _, muons_w = get_result(jobs)
+            if jobs is None:
+                weight, length = get_geometry([], geometry)
+                if weight < WEIGHT_LIMIT:
+                    raise Exception(
+                        'Geometry job {} did not finish'.format(geometry.id))
+                muons_w = 0
+            elif any(job.status != Job.COMPLETED for job in jobs):
+                return ProcessPartialPoint(geometry, jobs)
+            elif is_bounded(jobs):
+                return ProcessBoundedPoint(geometry, jobs)
+            else:
+                weight, length, _, muons_w = get_result(jobs, geometry)
             y = FCN(weight, muons_w, length)
-            X = ExtractParams(jobs[0].metadata)
+            X = ExtractParams(metadata)
 
-            stub.CreateJob(
+            point = stub.CreateJob(
                 Job(input='',
                     output=str(y),
                     kind='point',
-                    metadata=jobs[0].metadata))
+                    metadata=metadata))
+            store.add_metadata(
+                metadata,
+                y,
+                weight=weight,
+                length=length,
+                muons_w=muons_w,
+                job_id=point.id,
+                shards=0 if jobs is None else None)
             # TODO modify original jobs to mark them as processed,
             # job_id of point
             print(X, y)
@@ -42,8 +84,142 @@ def ProcessPoint(jobs, tag):
             print(e)
 
 
-def CreateOptimizer(clf_type, space, random_state=None):
-    if clf_type == 'rf':
+def ProcessPartialPoint(geometry, jobs):
+    """Estimate the loss of a point from the shards which completed.
+
+    The estimate is only kept in the local point store, since other users of
+    the Disneyland `point` jobs expect the loss of all shards. With too few
+    completed shards for an estimate, e.g. for pruned points, the lower bound
+    from the completed shards is stored instead, see `ProcessBoundedPoint`.
+
+    """
+    if sum(job.status == Job.COMPLETED for job in jobs) < MIN_SHARDS:
+        return ProcessBoundedPoint(geometry, jobs)
+    weight, length, muons_w, error, shards = get_partial_result(
+        jobs, geometry)
+    y = FCN(weight, muons_w, length)
+    uncertainty = FCN(weight, muons_w + error, length) - y
+    X = ExtractParams(jobs[0].metadata)
+    store.add_metadata(
+        jobs[0].metadata,
+        y,
+        weight=weight,
+        length=length,
+        muons_w=muons_w,
+        uncertainty=uncertainty,
+        shards=shards,
+        partial=True)
+    print('Estimated from {} of {} shards:'.format(shards, len(jobs)), X, y,
+          '+-', uncertainty)
+    return X, y
+
+
+def ProcessBoundedPoint(geometry, jobs):
+    """Store a lower bound on the loss of a point as a censored value.
+
+    The bound comes from shards which stopped at their bound or from the
+    completed shards of a pruned point. Like partial estimates, it is only
+    kept in the local point store, with an infinite uncertainty.
+
+    """
+    weight, length, muons_w, shards = get_lower_bound(jobs, geometry)
+    y = FCN(weight, muons_w, length)
+    X = ExtractParams(jobs[0].metadata)
+    store.add_metadata(
+        jobs[0].metadata,
+        y,
+        weight=weight,
+        length=length,
+        muons_w=muons_w,
+        uncertainty=float('inf'),
+        shards=shards,
+        bounded=True)
+    print('Bounded by {} of {} shards:'.format(shards, len(jobs)), X, '>=', y)
+    return X, y
+
+
+def PrunePoint(geometry, jobs, losses):
+    """Whether the completed shards of a point already show that it loses.
+
+    That is the case once the lower bound on its loss exceeds the
+    `PRUNE_QUANTILE` of `losses`.
+
+    """
+    if not losses or all(job.status == Job.COMPLETED for job in jobs):
+        return False
+    try:
+        weight, length, muons_w, _ = get_lower_bound(jobs, geometry)
+    except Exception as e:
+        print(geometry.id, e)
+        return False
+    return FCN(weight, muons_w, length) > np.percentile(
+        losses, 100 * PRUNE_QUANTILE)
+
+
+def ShardBound(geometry, losses):
+    """Bound on `muons_w` for each shard of a point, see `slave.py --bound`.
+
+    Returns None without any `losses`, the shards then run in full.
+
+    """
+    if not losses:
+        return None
+    bound = MuonsBound(float(get_job_result(geometry)['weight']), min(losses))
+    return None if bound is None else bound * SHARD_BOUND_SHARE
+
+
+def ScreenMargin(cache_dir):
+    """Margin above `WEIGHT_LIMIT` beyond which points are screened.
+
+    `WEIGHT_MARGIN` is only used once the geometries built for the stored
+    points (see `analytic_geo.CheckCatalog`) confirm that `MagnetMass` is
+    that accurate. Otherwise None is returned and all points are weighed by
+    their geometry jobs.
+
+    """
+    deviation = WeightDeviation(CheckCatalog(store, cache_dir))
+    if deviation is None or deviation > WEIGHT_MARGIN:
+        print('Analytic weights not confirmed within {:.1%} (deviation {}), '
+              'not screening points.'.format(WEIGHT_MARGIN, deviation))
+        return None
+    return WEIGHT_MARGIN
+
+
+def ScreenPoint(point, tag, sampling, seed):
+    """Return the loss of `point` if it is too heavy to simulate, else None.
+
+    The weight is calculated analytically and only trusted up to
+    `screen_margin`, points closer to the limit are simulated. Too heavy
+    points are added to the point store without any shards.
+
+    """
+    if screen_margin is None:
+        return None
+    weight = MagnetMass(point)
+    if weight <= WEIGHT_LIMIT * (1 + screen_margin):
+        return None
+    length = MagnetLength(point)
+    y = FCN(weight, 0, length)
+    store.add(
+        point,
+        y,
+        image_tag=IMAGE_TAG,
+        seed=seed,
+        sampling=sampling,
+        tag=tag,
+        weight=weight,
+        length=length,
+        muons_w=0,
+        shards=0)
+    print('Too heavy ({:.0f} kg), not submitted:'.format(weight), point, y)
+    return y
+
+
+def CreateOptimizer(clf_type, space, random_state=None, incremental=False):
+    if incremental and clf_type in ('rf', 'gb', 'gp'):
+        clf = Optimizer(
+            space, CreateSurrogate(clf_type), random_state=random_state)
+    elif clf_type == 'rf':
         clf = Optimizer(
             space,
             RandomForestRegressor(n_estimators=500, max_depth=7, n_jobs=-1),
@@ -68,39 +244,172 @@ def CreateOptimizer(clf_type, space, random_state=None):
     return clf
 
 
-def WaitCompleteness(jobs):
+def CreatePipeline(tag, sampling, seed, losses=None):
+    """Pipeline evaluating points with the given tag, sampling and seed.
 
-    work_time = 0
-    while True:
-        time.sleep(SLEEP_TIME)
+    `losses()` returns the losses so far, against which the shards are
+    bounded when they are submitted and points are pruned.
+
+    """
+    def SubmitShards(point, geometry):
+        bound = ShardBound(geometry, losses() if losses else None)
+        return SubmitDockerJobs(point, tag, sampling, seed,
+                                geofile=GeometryFile(point), bound=bound)
 
-        ids = [[job.id for job in point] for point in jobs]
-        uncompleted_jobs = [[
-            stub.GetJob(RequestWithId(id=id)) for id in point
-        ] for point in ids]
-        jobs_completed = [
-            job.status in STATUS_FINAL
-            for point in uncompleted_jobs for job in point
-        ]
+    return PointPipeline(
+        stub,
+        lambda point: SubmitGeometryJob(point, tag, sampling, seed),
+        SubmitShards,
+        runtimes=runtimes,
+        prune=lambda geometry, jobs: PrunePoint(
+            geometry, jobs, losses() if losses else None))
 
-        if all(jobs_completed):
-            return uncompleted_jobs
 
-        print('[{}] Waiting...'.format(time.time()))
-        work_time += 60
+def WaitCompleteness(pipeline):
+    """Wait for all points, at most `WAIT_TIMEOUT` seconds.
 
-        if work_time > 60 * 60 * 3:
-            completed_jobs = []
-            for point in uncompleted_jobs:
-                if all([job.status in STATUS_FINAL for job in point]):
-                    completed_jobs.append(point)
+    Points which are unfinished by then are returned with their unfinished
+    shards, to be estimated from the completed ones.
 
-            return completed_jobs
+    """
+    completed = {
+        key: (geometry, jobs)
+        for key, geometry, jobs in pipeline.wait(timeout=WAIT_TIMEOUT)
+    }
+    completed.update((key, (geometry, jobs))
+                     for key, geometry, jobs in pipeline.expire(0))
+    return [completed[key] for key in sorted(completed)]
+
+
+def AskPoints(clf, n_points, pending=(), n_candidates=0):
+    """Ask for new points while the `pending` points are still evaluated.
+
+    The pending points are told to a copy of the optimizer with the mean loss
+    as a constant lie, so that the new points are not proposed on top of them.
+    With `n_candidates` the batch is instead picked from a scored candidate
+    pool, away from the pending points.
+
+    """
+    if n_candidates:
+        return AskBatch(clf, n_points, pending, n_candidates=n_candidates)
+    if pending and clf.yi:
+        clf = clf.copy(random_state=clf.rng.randint(0, np.iinfo(np.int32).max))
+        clf.tell(list(pending), [float(np.mean(clf.yi))] * len(pending))
+    return clf.ask(n_points=n_points, strategy='cl_mean')
+
+
+def TellOptimizer(clf, log, X, y):
+    clf.tell(X, y)
+    CommitSurrogate(clf)
+    log.tell(clf, X, y)
+
+
+def DropFailed(log, points, X):
+    """Log the asked `points` which are not in `X`, i.e. got no loss.
+
+    A resumed optimizer then does not submit them again.
+
+    """
+    told = set(json.dumps([float(x) for x in point]) for point in X)
+    failed = [
+        point for point in points
+        if json.dumps([float(x) for x in point]) not in told
+    ]
+    if failed:
+        log.drop(failed)
+
+
+async def SteadyState(clf,
+                      log,
+                      tag,
+                      sampling,
+                      seed,
+                      in_flight,
+                      n_candidates=0):
+    """Keep `in_flight` points evaluating and tell each as soon as it is done.
+
+    Every finished point is told to the optimizer immediately and replaced by
+    a newly asked point, instead of waiting for a whole batch. Points which
+    are not finished after `WAIT_TIMEOUT` are estimated from their completed
+    shards and replaced.
+
+    """
+    loop = asyncio.get_running_loop()
+    pipeline = CreatePipeline(
+        tag, sampling, seed, losses=lambda: list(clf.yi))
+    pending = {
+        # key: point
+    }
+    finished = asyncio.Queue()
+
+    async def Poll():
+        while True:
+            await asyncio.sleep(pipeline.interval)
+            try:
+                polled = await loop.run_in_executor(None, pipeline.poll)
+                expired = await loop.run_in_executor(None, pipeline.expire,
+                                                     WAIT_TIMEOUT)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # a failed poll is retried, the points are still tracked
+                print('[{}] Polling failed: {!r}'.format(time.time(), e))
+                continue
+            for item in polled:
+                await finished.put(item)
+            for item in expired:
+                print('[{}] Deadline passed for point {}'.format(
+                    time.time(), pending[item[0]]))
+                await finished.put(item)
+
+    async def Tell(X_new, y_new):
+        X_new = [StripFixedParams(point) for point in X_new]
+        await loop.run_in_executor(None, TellOptimizer, clf, log, X_new, y_new)
+
+    async def Refill():
+        # points answered by the store or screened are told right away, ask
+        # again until `in_flight` points are really submitted
+        while len(pending) < in_flight:
+            points = await loop.run_in_executor(
+                None, AskPoints, clf, in_flight - len(pending),
+                [StripFixedParams(point) for point in pending.values()],
+                n_candidates)
+            log.ask(clf, points)
+            for point in [
+                    AddFixedParams([float(x) for x in p]) for p in points
+            ]:
+                loss = store.get(
+                    point, IMAGE_TAGS, seed=seed, sampling=sampling)
+                if loss is None:
+                    loss = ScreenPoint(point, tag, sampling, seed)
+                if loss is not None:
+                    await Tell([point], [loss])
+                    continue
+                key = await loop.run_in_executor(None, pipeline.add, point)
+                pending[key] = point
+
+    poller = asyncio.ensure_future(Poll())
+    try:
+        await Refill()
+        while True:
+            key, geometry, jobs = await finished.get()
+            point = pending.pop(key)
+            X_new, y_new = await loop.run_in_executor(
+                None, ProcessJobs, [(geometry, jobs)], tag)
+            print('Received new points ', X_new, y_new)
+            if X_new:
+                await Tell(X_new, y_new)
+            else:
+                log.drop([StripFixedParams(point)])
+            await Refill()
+    finally:
+        poller.cancel()
+        pipeline.close()
 
 
 def ProcessJobs(jobs, tag):
     print('[{}] Processing jobs...'.format(time.time()))
-    results = [ProcessPoint(point, tag) for point in jobs]
+    results = [ProcessPoint(geometry, point, tag) for geometry, point in jobs]
     print(f'Got results {results}')
     results = [result for result in results if result]
     return zip(*results) if results else ([], [])
@@ -108,15 +417,29 @@ def ProcessJobs(jobs, tag):
 
 stub = new_client()
 
-cache = {
-    # id: loss
-}
+store = PointStore(POINT_STORE)
+
+runtimes = collections.deque(maxlen=RUNTIME_HISTORY)
+
+IMAGE_TAGS = [IMAGE_TAG] + COMPATIBLE_TAGS[IMAGE_TAG]
+
+screen_margin = None  # see `ScreenMargin`
+
+
+def SubmitGeometryJob(point, tag, sampling, seed):
+    return stub.CreateJob(
+        Job(input=CreateGeometryInput(point),
+            kind='docker',
+            metadata=CreateMetaData(
+                point, tag, sampling=sampling, seed=seed, stage='geometry')))
 
 
-def SubmitDockerJobs(point, tag, sampling, seed):
+def SubmitDockerJobs(point, tag, sampling, seed, geofile=None, bound=None):
     return [
         stub.CreateJob(
-            Job(input=CreateJobInput(point, i, sampling=sampling, seed=seed),
+            Job(input=CreateJobInput(
+                point, i, sampling=sampling, seed=seed, geofile=geofile,
+                bound=bound),
                 kind='docker',
                 metadata=CreateMetaData(
                     point, tag, sampling=sampling, seed=seed)))
@@ -153,21 +476,41 @@ def FilterPoints(points, seed, sampling, image_tag=IMAGE_TAG, tag='all'):
     return filtered
 
 
-def CalculatePoints(points, tag, sampling, seed):
-    shield_jobs = [
-        SubmitDockerJobs(point, tag, sampling=sampling, seed=seed)
-        for point in points if json.dumps(point) not in cache
-    ]
-
-    X_cached, y_cached = zip(*[(point, cache[json.dumps(point)])
-                               for point in points
-                               if json.dumps(point) in cache])
+def CalculatePoints(points, tag, sampling, seed, losses=None):
+    """Losses of `points`, from the point store or by evaluating them.
 
-    if shield_jobs:
-        shield_jobs = WaitCompleteness(shield_jobs)
-        X_new, y_new = ProcessJobs(shield_jobs, tag)
+    `losses` are the losses observed by the optimizer so far, against which
+    the shards are bounded and points are pruned.
 
-    X, y = X_cached + X_new, y_cached + y_new
+    """
+    cached = [
+        store.get(point, IMAGE_TAGS, seed=seed, sampling=sampling)
+        for point in points
+    ]
+    cached = [
+        loss if loss is not None else ScreenPoint(point, tag, sampling, seed)
+        for point, loss in zip(points, cached)
+    ]
+    X_cached, y_cached = [], []
+    for point, loss in zip(points, cached):
+        if loss is not None:
+            X_cached.append(point)
+            y_cached.append(loss)
+
+    pipeline = CreatePipeline(
+        tag, sampling, seed, losses=lambda: losses)
+    for point, loss in zip(points, cached):
+        if loss is None:
+            pipeline.add(point)
+
+    X_new, y_new = [], []
+    try:
+        if len(pipeline):
+            X_new, y_new = ProcessJobs(WaitCompleteness(pipeline), tag)
+    finally:
+        pipeline.close()
+
+    X, y = X_cached + list(X_new), y_cached + list(y_new)
 
     return X, y
 
@@ -181,6 +524,38 @@ def main():
     parser.add_argument('--seed', help='Random seed of simulation', default=1)
     parser.add_argument('--sampling', default=37)
     parser.add_argument('--reduced', action='store_true')
+    parser.add_argument(
+        '--refresh',
+        help='Re-import all jobs from Disneyland into the point store',
+        action='store_true')
+    parser.add_argument(
+        '--log',
+        help='Checkpoint log of the optimizer, resumed if it exists',
+        default='optimiser.jsonl')
+    parser.add_argument(
+        '--incremental',
+        help='Update the surrogate incrementally instead of refitting it',
+        action='store_true')
+    parser.add_argument(
+        '--steady',
+        help='Keep this many points in flight instead of running batches',
+        type=int,
+        default=0)
+    parser.add_argument(
+        '--batch',
+        help='Number of points in a batch',
+        type=int,
+        default=POINTS_IN_BATCH)
+    parser.add_argument(
+        '--geometry_cache',
+        help='Geometry cache whose weights confirm the analytic weights',
+        default=GEOMETRY_CACHE)
+    parser.add_argument(
+        '--candidates',
+        help='Pick batches from this many scored candidates instead of '
+        'constant-liar asks',
+        type=int,
+        default=0)
     args = parser.parse_args()
     tag = f'{RUN}_{args.opt}' + f'_{args.tag}' if args.tag else ''
 
@@ -188,40 +563,49 @@ def main():
                                0.1) if args.reduced else CreateDiscreteSpace()
 
     clf = CreateOptimizer(
-        args.opt, space, random_state=int(args.state) if args.state else None)
+        args.opt,
+        space,
+        random_state=int(args.state) if args.state else None,
+        incremental=args.incremental)
 
     # TODO use random points for init, don't tag them with optimiser
 
-    all_points = stub.ListJobs(ListJobsRequest(kind='point', how_many=0)).jobs
-    X, y = ProcessPoints(
-        FilterPoints(
-            all_points, tag='all', seed=args.seed, sampling=args.sampling))
-
-    for x, loss in zip(X, y):
-        cache[json.dumps(x)] = loss
-
-    for image in COMPATIBLE_TAGS[IMAGE_TAG]:
-        for x, loss in zip(
-                ProcessPoints(
-                    FilterPoints(
-                        all_points,
-                        tag='all',
-                        seed=args.seed,
-                        sampling=args.sampling,
-                        image_tag=image))):
-            cache[json.dumps(x)] = loss
-
-    if X and y:
-        print('Received previous points ', X, y)
-        X = [StripFixedParams(point) for point in X]
-        try:
-            X, y = zip(*[(x, loss) for x, loss in zip(X, y)
-                         if space.__contains__(x)])
-            clf.tell(X, y)
-        except ValueError:
-            print('None of the previous points are contained in the space.')
+    SyncPoints(stub, store, full=args.refresh)
+
+    global screen_margin
+    screen_margin = ScreenMargin(args.geometry_cache)
+
+    log = OptimizerLog(args.log)
+    if os.path.exists(args.log):
+        clf, pending = log.resume(clf)
+        CommitSurrogate(clf)
+        X = clf.Xi
+        print('Resumed optimizer with {} points'.format(len(X)))
+        if pending:
+            X_new, y_new = CalculatePoints(
+                [AddFixedParams(p) for p in pending],
+                tag,
+                sampling=args.sampling,
+                seed=args.seed)
+            X_new = [StripFixedParams(point) for point in X_new]
+            DropFailed(log, pending, X_new)
+            if X_new:
+                TellOptimizer(clf, log, X_new, y_new)
+    else:
+        X, y = store.query([IMAGE_TAG], seed=args.seed, sampling=args.sampling)
+
+        if X and y:
+            print('Received previous points ', X, y)
+            X = [StripFixedParams(point) for point in X]
+            try:
+                X, y = zip(*[(x, loss) for x, loss in zip(X, y)
+                             if space.__contains__(x)])
+                TellOptimizer(clf, log, X, y)
+            except ValueError:
+                print(
+                    'None of the previous points are contained in the space.')
     while not (X and len(X) > RANDOM_STARTS):
-        points = space.rvs(n_samples=POINTS_IN_BATCH)
+        points = space.rvs(n_samples=args.batch)
         points = [AddFixedParams(p) for p in points]
 
         X_new, y_new = CalculatePoints(
@@ -229,27 +613,40 @@ def main():
         print('Received new points ', X_new, y_new)
         if X_new and y_new:
             X_new = [StripFixedParams(point) for point in X_new]
-            clf.tell(X_new, y_new)
+            TellOptimizer(clf, log, X_new, y_new)
+            X = list(X) + X_new
+
+    if args.steady:
+        asyncio.run(
+            SteadyState(
+                clf,
+                log,
+                tag,
+                sampling=args.sampling,
+                seed=args.seed,
+                in_flight=args.steady,
+                n_candidates=args.candidates))
+        return
 
     while True:
-        points = clf.ask(n_points=POINTS_IN_BATCH, strategy='cl_mean')
+        asked = AskPoints(clf, args.batch, n_candidates=args.candidates)
+        log.ask(clf, asked)
 
-        points = [AddFixedParams(p) for p in points]
+        points = [AddFixedParams(p) for p in asked]
 
         X_new, y_new = CalculatePoints(
-            points, tag, sampling=args.sampling, seed=args.seed)
+            points,
+            tag,
+            sampling=args.sampling,
+            seed=args.seed,
+            losses=list(clf.yi))
 
         print('Received new points ', X_new, y_new)
 
         X_new = [StripFixedParams(point) for point in X_new]
+        DropFailed(log, asked, X_new)
 
-        result = clf.tell(X_new, y_new)
-
-        with open('optimiser.pkl', 'wb') as f:
-            pickle.dump(clf, f)
-
-        with open('result.pkl', 'wb') as f:
-            pickle.dump(result, f)
+        TellOptimizer(clf, log, X_new, y_new)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Incremental synchronisation of Disneyland jobs into the point store."""
+from disneylandClient import ListJobsRequest, RequestWithId
+
+from disney_jobs import STATUS_FINAL
+
+SYNC_PAGE = 100  # jobs
+
+
+def IterNewJobs(stub, kind, watermark, page=SYNC_PAGE):
+    """Yield pages of jobs of `kind` with ids above `watermark`, oldest first.
+
+    `ListJobs` only takes a limit (`how_many`) and returns the newest jobs
+    first, so the limit is doubled until the response reaches back to the
+    watermark. A refresh therefore transfers at most about twice the number
+    of new jobs instead of the whole history. Should the server return the
+    oldest jobs first, the limit would cut off the new ones and the whole
+    list is fetched once instead.
+
+    """
+    how_many = page
+    while True:
+        jobs = stub.ListJobs(
+            ListJobsRequest(kind=kind, how_many=how_many)).jobs
+        if len(jobs) < how_many:
+            break
+        if jobs[0].id < jobs[-1].id:
+            jobs = stub.ListJobs(ListJobsRequest(kind=kind, how_many=0)).jobs
+            break
+        if min(job.id for job in jobs) <= watermark:
+            break
+        how_many *= 2
+
+    new_jobs = sorted(
+        (job for job in jobs if job.id > watermark), key=lambda job: job.id)
+    del jobs
+    for i in range(0, len(new_jobs), page):
+        yield new_jobs[i:i + page]
+
+
+def SyncJobs(stub, store, kind, importer, page=SYNC_PAGE):
+    """Import new jobs of `kind` page by page and advance the watermark.
+
+    The watermark is stored after every page, so an interrupted sync resumes
+    where it stopped.
+
+    """
+    imported = 0
+    for jobs in IterNewJobs(stub, kind, store.watermark(kind), page=page):
+        imported += importer(jobs)
+        store.set_watermark(kind, jobs[-1].id)
+    return imported
+
+
+def RefreshShards(stub, store):
+    """Update the status of the stored shards which were not final yet.
+
+    Returns the number of shards whose status changed.
+
+    """
+    jobs = []
+    for job_id in store.unfinished_shards(STATUS_FINAL):
+        try:
+            jobs.append(stub.GetJob(RequestWithId(id=job_id)))
+        except Exception as e:
+            print(job_id, e)
+    return store.update_shards(jobs)
+
+
+def SyncPoints(stub, store, full=False):
+    """Bring `point` and `docker` jobs in the store up to date."""
+    if full:
+        store.set_watermark('point', 0)
+        store.set_watermark('docker', 0)
+    refreshed = RefreshShards(stub, store)
+    points = SyncJobs(stub, store, 'point', store.import_jobs)
+    shards = SyncJobs(stub, store, 'docker', store.import_shards)
+    print('Synchronised {} new points and {} new shards, {} shards changed.'.
+          format(points, shards, refreshed))
+    return points, shards
@@ -0,0 +1,259 @@
+"""Content-addressed cache of geometries shared by the jobs on a node.
+
+Geometries are stored by the id of their parameters, which is a hash of
+their content, in a directory per geometry. One SQLite catalog holds the
+status, length, weight, size and last use of every geometry. The first job
+to need a geometry claims it in the catalog and builds it, all other jobs
+wait until the builder has published it. Waiters are woken up by inotify if
+`inotify_simple` is available and otherwise poll with exponential backoff.
+Least recently used geometries are evicted once the cache exceeds its size
+budget, unless a job has pinned them while it reads their files.
+
+"""
+import os
+import time
+import shutil
+import socket
+import sqlite3
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+import config
+
+BUILDING = 'building'
+LIGHT = 'light'
+HEAVY = 'heavy'
+
+BUILD_TIMEOUT = 60 * 60  # seconds, after which a claim is considered stale
+MIN_AGE = 60 * 60  # seconds since the last use before a geometry is evicted
+PIN_TIMEOUT = 24 * 60 * 60  # seconds, after which a pin is considered stale
+MIN_WAIT = 1  # seconds
+MAX_WAIT = 60  # seconds
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS geometries (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    length REAL,
+    weight REAL,
+    size INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    claimed REAL,
+    used REAL
+);
+CREATE INDEX IF NOT EXISTS geometries_used ON geometries (status, used);
+CREATE TABLE IF NOT EXISTS pins (
+    id TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    pinned REAL NOT NULL,
+    PRIMARY KEY (id, owner)
+);
+'''
+
+
+class GeometryCache(object):
+    """Cache of geometries under `root`, at most `budget` bytes large."""
+
+    def __init__(self, root=config.GEOMETRY_CACHE,
+                 budget=config.GEOMETRY_CACHE_BUDGET):
+        self.root = root
+        self.budget = budget
+        self.events = os.path.join(root, 'events')
+        for directory in (root, self.events, os.path.join(root, 'tmp')):
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # created by another job in the meantime
+                    pass
+        self.db = sqlite3.connect(
+            os.path.join(root, 'catalog.sqlite'),
+            timeout=60,
+            isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        for _ in range(10):
+            try:
+                self.db.executescript(SCHEMA)
+                break
+            except sqlite3.OperationalError:
+                # schema changed by another job creating the catalog
+                time.sleep(MIN_WAIT)
+        self.owner = '{}:{}'.format(socket.gethostname(), os.getpid())
+
+    def directory(self, key):
+        return os.path.join(self.root, key)
+
+    def params_file(self, key):
+        return os.path.join(self.directory(key), 'params_{}.root'.format(key))
+
+    def geo_file(self, key):
+        return os.path.join(self.directory(key), 'geo_{}.root'.format(key))
+
+    def lookup(self, key):
+        """Return the catalog entry of `key` as a dict or None."""
+        cursor = self.db.execute('SELECT * FROM geometries WHERE id = ?',
+                                 (key, ))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def claim(self, key):
+        """Claim building `key`, returns whether this job has to build it."""
+        now = time.time()
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            entry = self.lookup(key)
+            claimed = entry is None or (entry['status'] == BUILDING and
+                                        now - entry['claimed'] > BUILD_TIMEOUT)
+            if claimed:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO geometries '
+                    '(id, status, owner, claimed) VALUES (?, ?, ?, ?)',
+                    (key, BUILDING, self.owner, now))
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        return claimed
+
+    def _notify(self):
+        with open(os.path.join(self.events, 'published'), 'a'):
+            pass
+
+    def publish(self, key, tmp_directory, length, weight):
+        """Move a built geometry into the cache and wake up its waiters.
+
+        Only the catalog entry is kept for geometries which are too heavy to
+        be simulated.
+
+        """
+        status = LIGHT if weight < config.WEIGHT_LIMIT else HEAVY
+        size = 0
+        if status == LIGHT:
+            size = sum(
+                os.path.getsize(os.path.join(tmp_directory, name))
+                for name in os.listdir(tmp_directory))
+            if os.path.exists(self.directory(key)):
+                shutil.rmtree(self.directory(key))
+            os.rename(tmp_directory, self.directory(key))
+        else:
+            shutil.rmtree(tmp_directory)
+        self.db.execute(
+            'UPDATE geometries SET status = ?, length = ?, weight = ?, '
+            'size = ?, used = ? WHERE id = ?',
+            (status, length, weight, size, time.time(), key))
+        self._notify()
+        self.evict()
+
+    def release(self, key):
+        """Give up building `key`, so that another job can claim it."""
+        self.db.execute(
+            'DELETE FROM geometries WHERE id = ? AND status = ? AND owner = ?',
+            (key, BUILDING, self.owner))
+        self._notify()
+
+    def wait(self, key, timeout=BUILD_TIMEOUT):
+        """Wait until `key` is no longer being built or `timeout` passed."""
+        deadline = time.time() + timeout
+        interval = MIN_WAIT
+        inotify = None
+        if INotify is not None:
+            inotify = INotify()
+            inotify.add_watch(self.events, flags.CLOSE_WRITE)
+        try:
+            while time.time() < deadline:
+                entry = self.lookup(key)
+                if entry is None or entry['status'] != BUILDING:
+                    return entry
+                if inotify is not None:
+                    inotify.read(timeout=MAX_WAIT * 1000)
+                else:
+                    time.sleep(interval)
+                    interval = min(2 * interval, MAX_WAIT)
+            return self.lookup(key)
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def pin(self, key):
+        """Keep `key` from being evicted until `unpin` is called."""
+        self.db.execute('INSERT OR REPLACE INTO pins VALUES (?, ?, ?)',
+                        (key, self.owner, time.time()))
+
+    def unpin(self, key):
+        self.db.execute('DELETE FROM pins WHERE id = ? AND owner = ?',
+                        (key, self.owner))
+
+    def fetch(self, key, build, pin=False):
+        """Return the catalog entry of `key`, building it if necessary.
+
+        `build(directory, key)` creates the files of the geometry in
+        `directory` and returns its length and weight. It is called by at
+        most one job at a time for every key. With `pin` the geometry is
+        pinned before it is returned, see `pin`.
+
+        Returns
+        -------
+        dict
+            Catalog entry, with `built` set if this job built the geometry
+
+        """
+        while True:
+            entry = self.lookup(key)
+            if entry is not None and entry['status'] != BUILDING:
+                if pin:
+                    self.pin(key)
+                self.db.execute(
+                    'UPDATE geometries SET used = ? WHERE id = ?',
+                    (time.time(), key))
+                entry['built'] = False
+                return entry
+            if not self.claim(key):
+                self.wait(key)
+                continue
+            tmp_directory = os.path.join(
+                self.root, 'tmp', '{}.{}'.format(key, os.getpid()))
+            try:
+                if os.path.exists(tmp_directory):
+                    shutil.rmtree(tmp_directory)
+                os.makedirs(tmp_directory)
+                length, weight = build(tmp_directory, key)
+                if pin:
+                    self.pin(key)
+                self.publish(key, tmp_directory, length, weight)
+            except BaseException:
+                self.unpin(key)
+                self.release(key)
+                raise
+            entry = self.lookup(key)
+            entry['built'] = True
+            return entry
+
+    def evict(self):
+        """Remove least recently used geometries to stay within the budget.
+
+        Geometries which are pinned or were used within the last `MIN_AGE`
+        seconds are kept, since jobs may still be reading them. Pins older
+        than `PIN_TIMEOUT`, e.g. of crashed jobs, are ignored.
+
+        """
+        total, = self.db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM geometries').fetchone()
+        if total <= self.budget:
+            return
+        now = time.time()
+        candidates = self.db.execute(
+            'SELECT id, size FROM geometries WHERE status = ? AND used < ? '
+            'AND id NOT IN (SELECT id FROM pins WHERE pinned > ?) '
+            'ORDER BY used', (LIGHT, now - MIN_AGE,
+                              now - PIN_TIMEOUT)).fetchall()
+        for key, size in candidates:
+            if total <= self.budget:
+                break
+            self.db.execute('DELETE FROM geometries WHERE id = ?', (key, ))
+            shutil.rmtree(self.directory(key), ignore_errors=True)
+            total -= size
@@ -4,6 +4,9 @@ IMAGE_TAG = 20180216.1
 SLEEP_TIME = 60
 POINTS_IN_BATCH = 1
 RUN = 'imp_sampling_test'
+WEIGHT_LIMIT = 3e6  # kg, as in the config of the optimizer
+MIN_ESS = 10  # effective muons needed to trust an estimate of muons_w
+TARGET_ERROR = 0.05  # relative error of muons_w the weighter samples for
 
 JOB_TEMPLATE_IMP_SAMPLING = {
     'input': ['eos:/eos/experiment/ship/skygrid/importance_sampling',
@@ -34,7 +37,8 @@ JOB_TEMPLATE_IMP_SAMPLING = {
         '''--results /output/result.json '''
         '''--hists /output/hists_{IMAGE_TAG}_'''
         '''{params}_{job_id}_{sampling}_{seed}.root --seed {seed} '''
-        '''--share_muons {share} --tag {tag} --point_id {point_id}' ''',
+        '''--share_muons {share} --target_error {target_error} '''
+        '''--tag {tag} --point_id {point_id}' ''',
     },
     'required_outputs': {
         'output_uri': 'eos:/eos/experiment/ship/skygrid/importance_sampling',
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
+import os
 import argparse
-import pickle
 
 from muon_shield_optimisation.disney_common import (AddFixedParams, CreateDiscreteSpace, StripFixedParams)
+from muon_shield_optimisation.optimizer_log import OptimizerLog
 from config import POINTS_IN_BATCH
 
 from utils import (WaitCompleteness, ProcessJobs, ConvertToPoints, CollectResults, SubmitDockerJobs)
@@ -26,6 +27,11 @@ def main():
         help='Random state of Optimizer',
         type=int
     )
+    parser.add_argument(
+        '--log',
+        help='Checkpoint log of the optimizer, resumed if it exists',
+        default='optimiser.jsonl'
+    )
     args = parser.parse_args()
     tag = "important_sampling_{opt}_{tag}".format(**vars(args))
     print(tag)
@@ -37,18 +43,25 @@ def main():
         random_state=args.state
     )
 
-    all_jobs_list = stub.ListJobs(ListJobsRequest(kind='point', how_many=0))
-    X, y = ConvertToPoints(all_jobs_list.jobs, tag)
+    log = OptimizerLog(args.log)
+    if os.path.exists(args.log):
+        clf, _ = log.resume(clf)
+        print('Resumed optimizer with {} points'.format(len(clf.Xi)))
+    else:
+        all_jobs_list = stub.ListJobs(ListJobsRequest(kind='point', how_many=0))
+        X, y = ConvertToPoints(all_jobs_list.jobs, tag)
 
-    if len(X) > 0:
-        print('Received previous points ', X, y)
-        X = [StripFixedParams(point) for point in X]
-        clf.tell(X, y)
+        if len(X) > 0:
+            print('Received previous points ', X, y)
+            X = [StripFixedParams(point) for point in X]
+            clf.tell(X, y)
+            log.tell(clf, X, y)
 
     while True:
         points = clf.ask(
             n_points=POINTS_IN_BATCH,
             strategy='cl_mean')
+        log.ask(clf, points)
 
         points = [AddFixedParams(p) for p in points]
 
@@ -62,15 +75,10 @@ def main():
 
         print('Received new points ', X_new, y_new)
         X_new = [StripFixedParams(point) for point in X_new]
-        result = clf.tell(X_new, y_new)
+        clf.tell(X_new, y_new)
+        log.tell(clf, X_new, y_new)
         CollectResults(stub, "impsampl")
 
-        with open('optimiser.pkl', 'wb') as f:
-            pickle.dump(clf, f)
-
-        with open('result.pkl', 'wb') as f:
-            pickle.dump(result, f)
-
 
 if __name__ == '__main__':
     main()
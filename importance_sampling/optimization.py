@@ -1,4 +1,5 @@
 from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.utils import check_random_state
 from skopt import Optimizer
 from skopt.learning import GaussianProcessRegressor
 from skopt.learning import RandomForestRegressor
@@ -8,13 +9,16 @@ from skopt.learning import GradientBoostingQuantileRegressor
 class RandomSearchOptimizer:
     def __init__(self, space, random_state=None):
         self.space_ = space
-        self.state_ = random_state
+        self.rng = check_random_state(random_state)
+        self.Xi = []
+        self.yi = []
 
     def tell(self, X, y):
-        pass
+        self.Xi += list(X)
+        self.yi += list(y)
 
     def ask(self, n_points=1, strategy=None):
-        return self.space_.rvs(n_points, random_state=self.state_)
+        return self.space_.rvs(n_points, random_state=self.rng)
 
 
 def CreateOptimizer(clf_type, space, random_state=None):
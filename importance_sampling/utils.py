@@ -4,17 +4,19 @@ import json
 import copy
 import time
 
+from muon_shield_optimisation import disney_common as common
 from muon_shield_optimisation.disney_oneshot import (
+    get_job_result,
     get_result,
     CreateMetaData,
     ExtractParams,
-    STATUS_IN_PROCESS,
-    STATUS_FINAL
 )
+from muon_shield_optimisation.disney_jobs import JobTracker
 
-from disneylandClient import (Job, RequestWithId, ListJobsRequest)
+from disneylandClient import (Job, ListJobsRequest)
 
-from config import JOB_TEMPLATE_IMP_SAMPLING, IMAGE_TAG, SLEEP_TIME
+from config import (JOB_TEMPLATE_IMP_SAMPLING, IMAGE_TAG, SLEEP_TIME, MIN_ESS,
+                    TARGET_ERROR)
 from muon_shield_optimisation.weighter.config import JOB_TEMPLATE as JOB_COLLECTOR_TEMPLATE
 
 
@@ -29,6 +31,7 @@ def CreateSimulationJobInput(point, sampling, seed, point_id, share, tag):
             IMAGE_TAG=IMAGE_TAG,
             point_id=point_id,
             share=share,
+            target_error=TARGET_ERROR,
             tag=tag
         )
 
@@ -56,11 +59,30 @@ def SubmitDockerJobs(stub, point, user_tag, sampling, seed, point_id, share, tag
 
 
 def ProcessJob(stub, job, space, tag):
+    """Calculate the loss of a point from the estimate of its muons_w.
+
+    Points whose estimate rests on fewer than `MIN_ESS` effective muons are
+    reported with their loss plus its uncertainty, so that the optimizer
+    does not trust them more than their estimate allows.
+
+    """
     if json.loads(job[0].metadata)['user']['tag'] == tag:
         try:
             weight, length, _, muons_w = get_result(job)
             y = common.FCN(weight, muons_w, length)
             X = ExtractParams(job[0].metadata)
+            result = get_job_result(job[0])
+            if result.get('ess') is not None:
+                uncertainty = common.FCN(
+                    weight, muons_w + result['muons_w_error'], length) - y
+                if result['ess'] < MIN_ESS:
+                    print('Too few effective muons, reporting the upper '
+                          'end of the estimate.')
+                    y += uncertainty
+                print('Estimated from {:.0f} effective muons:'.format(
+                    result['ess']), X, y, '+-', uncertainty)
+            else:
+                print(X, y)
 
             stub.CreateJob(Job(
                 input='',
@@ -68,8 +90,6 @@ def ProcessJob(stub, job, space, tag):
                 kind='point',
                 metadata=job[0].metadata
             ))
-
-            print(X, y)
             return X, y
         except Exception as e:
             print(e)
@@ -90,36 +110,11 @@ def ProcessJobs(stub, jobs, space, tag):
 
 
 def WaitCompleteness(stub, jobs):
-    work_time = 0
-    while True:
-        time.sleep(SLEEP_TIME)
-
-        ids = [[job.id for job in point] for point in jobs]
-        jobs = [
-            [
-                stub.GetJob(RequestWithId(id=id))
-                for id in point
-            ]
-            for point in ids
-        ]
-        jobs_completed = [job.status
-                          in STATUS_FINAL
-                          for point in jobs
-                          for job in point]
-
-        if all(jobs_completed):
-            return jobs
-
-        print("[{}] Waiting...".format(time.time()))
-        work_time += 60
-
-        if work_time > 60 * 60 * 3:
-            completed_jobs = []
-            for point in jobs:
-                if all([job.status in STATUS_FINAL for job in point]):
-                    completed_jobs.append(point)
-
-            return completed_jobs
+    with JobTracker(stub, max_interval=SLEEP_TIME) as tracker:
+        for point in jobs:
+            tracker.add(point)
+        completed = dict(tracker.wait(timeout=60 * 60 * 3))
+    return [completed[key] for key in sorted(completed)]
 
 
 def CollectResults(stub, tag):
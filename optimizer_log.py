@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Append-only checkpoint log of optimizer ask and tell events."""
+import os
+import json
+import pickle
+
+import numpy as np
+
+SNAPSHOT_EVERY = 50  # tell events
+
+
+def _GetRandomState(rng):
+    name, keys, pos, has_gauss, cached_gaussian = rng.get_state()
+    return [name, keys.tolist(), pos, has_gauss, cached_gaussian]
+
+
+def _SetRandomState(rng, state):
+    name, keys, pos, has_gauss, cached_gaussian = state
+    rng.set_state((name, np.array(keys, dtype=np.uint32), pos, has_gauss,
+                   cached_gaussian))
+
+
+class OptimizerLog:
+    """Checkpoint an optimizer by appending its ask and tell events.
+
+    Every event is one JSON line, so a checkpoint costs O(new points) instead
+    of pickling the whole optimizer. Every `snapshot_every` tells the
+    optimizer is additionally pickled to `path + '.snapshot'`, which lets
+    `resume` skip refitting the surrogate on the whole history.
+
+    """
+
+    def __init__(self, path, snapshot_every=SNAPSHOT_EVERY):
+        self.path = path
+        self.snapshot_path = path + '.snapshot'
+        self.snapshot_every = snapshot_every
+        self.told = 0
+
+    def _append(self, event):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(event) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _events(self):
+        """Read all events and cut off a partially written last line."""
+        events = []
+        if not os.path.exists(self.path):
+            return events
+        with open(self.path, 'r+') as f:
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    f.truncate(offset)
+                    break
+        return events
+
+    def ask(self, clf, points):
+        self._append({
+            'event': 'ask',
+            'X': [[float(x) for x in point] for point in points],
+            'rng': _GetRandomState(clf.rng),
+        })
+
+    def tell(self, clf, X, y):
+        self._append({
+            'event': 'tell',
+            'X': [[float(x) for x in point] for point in X],
+            'y': [float(loss) for loss in y],
+        })
+        self.told += 1
+        if self.told % self.snapshot_every == 0:
+            self.snapshot(clf)
+
+    def drop(self, points):
+        """Record asked points which will never be told, e.g. failed ones."""
+        self._append({
+            'event': 'drop',
+            'X': [[float(x) for x in point] for point in points],
+        })
+
+    def snapshot(self, clf):
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(clf, f)
+        os.rename(tmp_path, self.snapshot_path)
+        self._append({'event': 'snapshot', 'told': self.told})
+
+    def resume(self, clf):
+        """Restore the optimizer from the log.
+
+        Parameters
+        ----------
+        clf
+            Fresh optimizer, used if there is no snapshot yet
+
+        Returns
+        -------
+        clf
+            Optimizer after replaying all events
+        list
+            Points which were asked but neither told nor dropped yet
+
+        """
+        events = self._events()
+        self.told = sum(event['event'] == 'tell' for event in events)
+        snapshots = [
+            i for i, event in enumerate(events) if event['event'] == 'snapshot'
+        ]
+        if snapshots and os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as f:
+                clf = pickle.load(f)
+            replay = events[snapshots[-1] + 1:]
+        else:
+            replay = events
+
+        X, y = [], []
+        for event in replay:
+            if event['event'] == 'tell':
+                X += event['X']
+                y += event['y']
+        if X:
+            clf.tell(X, y)
+
+        asks = [event for event in events if event['event'] == 'ask']
+        if asks:
+            _SetRandomState(clf.rng, asks[-1]['rng'])
+
+        finished = set(
+            json.dumps(x) for event in events
+            if event['event'] in ('tell', 'drop') for x in event['X'])
+        pending = [
+            x for event in asks for x in event['X']
+            if json.dumps(x) not in finished
+        ]
+        return clf, pending
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Evaluation of points by a geometry job followed by simulation shards."""
+import time
+
+from disneylandClient import Job
+
+import config
+from disney_jobs import JobTracker
+from disney_oneshot import get_job_result
+from stragglers import StragglerTracker
+
+
+def IsLight(geometry):
+    """Whether a geometry job completed with a geometry worth simulating."""
+    if geometry.status != Job.COMPLETED:
+        return False
+    try:
+        return float(get_job_result(geometry)['weight']) < config.WEIGHT_LIMIT
+    except Exception as e:
+        print(geometry.id, e)
+        return False
+
+
+class PointPipeline:
+    """Track points through their geometry job and their simulation shards.
+
+    `add` submits the geometry job of a point with `submit_geometry(point)`.
+    As soon as it reports a geometry lighter than `WEIGHT_LIMIT`, the shards
+    are submitted with `submit_shards(point, geometry)`. Heavy points thereby
+    cost a single job, and the shards don't have to wait for each other to
+    create the geometry.
+
+    Finished points are reported as `(key, geometry, shards)`, where `shards`
+    is None if the geometry job failed or the geometry is too heavy.
+
+    After every poll `prune(geometry, shards)` is asked about each point with
+    unfinished shards. If it returns True, the remaining shards are cancelled
+    and the point is reported with them unfinished.
+
+    """
+
+    def __init__(self,
+                 stub,
+                 submit_geometry,
+                 submit_shards,
+                 runtimes=None,
+                 prune=None):
+        self.geometries = JobTracker(stub)
+        self.shards = StragglerTracker(stub, runtimes=runtimes)
+        self.submit_geometry = submit_geometry
+        self.submit_shards = submit_shards
+        self.prune = prune
+        self.points = {
+            # key: point
+        }
+        self.geometry = {
+            # key: completed geometry job of points being simulated
+        }
+        self.started = {
+            # key: time the point was added
+        }
+
+    def __len__(self):
+        return len(self.points)
+
+    def close(self):
+        """Stop the polling threads of the trackers."""
+        self.geometries.close()
+        self.shards.close()
+
+    @property
+    def interval(self):
+        return min(self.geometries.interval, self.shards.interval)
+
+    def add(self, point):
+        """Submit the geometry job of `point` and return the point key."""
+        key = self.geometries.add([self.submit_geometry(point)])
+        self.points[key] = point
+        self.started[key] = time.time()
+        return key
+
+    def _finish(self, key, geometry, shards):
+        self.points.pop(key, None)
+        self.started.pop(key, None)
+        self.geometry.pop(key, None)
+        return key, geometry, shards
+
+    def poll(self):
+        """Refresh all unfinished jobs and return the finished points."""
+        finished = []
+        for key, (geometry, ) in self.geometries.poll():
+            if IsLight(geometry):
+                self.geometry[key] = geometry
+                self.shards.add(
+                    self.submit_shards(self.points[key], geometry), key=key)
+            else:
+                finished.append(self._finish(key, geometry, None))
+        for key, shards in self.shards.poll():
+            finished.append(self._finish(key, self.geometry[key], shards))
+        if self.prune is not None:
+            for key, geometry in list(self.geometry.items()):
+                if self.prune(geometry, self.shards.peek(key)):
+                    print('[{}] Pruned point {}'.format(time.time(), key))
+                    finished.append(
+                        self._finish(key, geometry, self.shards.cancel(key)))
+        return finished
+
+    def expire(self, timeout):
+        """Stop tracking and return points added more than `timeout` s ago.
+
+        The unfinished jobs of these points are cancelled.
+
+        """
+        now = time.time()
+        expired = []
+        for key, started in list(self.started.items()):
+            if now - started <= timeout:
+                continue
+            if key in self.geometry:
+                expired.append(
+                    self._finish(key, self.geometry[key],
+                                 self.shards.cancel(key)))
+            else:
+                (geometry, ) = self.geometries.cancel(key)
+                expired.append(self._finish(key, geometry, None))
+        return expired
+
+    def wait(self, timeout=None):
+        """Yield `(key, geometry, shards)` for each point once it finished.
+
+        Stops when no points are left or, if given, after `timeout` seconds.
+
+        """
+        start = time.time()
+        while self.points:
+            time.sleep(self.interval)
+            for item in self.poll():
+                yield item
+            if not self.points:
+                return
+            print('[{}] Waiting for {} geometries and {} points...'.format(
+                time.time(), len(self.geometries), len(self.shards)))
+            if timeout is not None and time.time() - start > timeout:
+                return
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""Local on-disk store of evaluated points, shared between optimizers."""
+import json
+import sqlite3
+
+from disney_common import create_id, ParseParams
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS points (
+    id TEXT NOT NULL,
+    image_tag TEXT NOT NULL,
+    seed TEXT NOT NULL,
+    sampling TEXT NOT NULL,
+    tag TEXT,
+    params TEXT NOT NULL,
+    weight REAL,
+    length REAL,
+    muons_w REAL,
+    loss REAL NOT NULL,
+    job_id INTEGER,
+    uncertainty REAL,
+    shards INTEGER,
+    partial INTEGER,
+    bounded INTEGER,
+    PRIMARY KEY (id, image_tag, seed, sampling)
+);
+CREATE TABLE IF NOT EXISTS shards (
+    job_id INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
+    image_tag TEXT NOT NULL,
+    seed TEXT NOT NULL,
+    sampling TEXT NOT NULL,
+    tag TEXT,
+    status INTEGER
+);
+CREATE INDEX IF NOT EXISTS shards_point
+    ON shards (id, image_tag, seed, sampling);
+CREATE TABLE IF NOT EXISTS watermarks (
+    kind TEXT PRIMARY KEY,
+    job_id INTEGER NOT NULL
+);
+'''
+# columns added to the points table after its creation
+MIGRATIONS = [
+    ('uncertainty', 'REAL'),
+    ('shards', 'INTEGER'),
+    ('partial', 'INTEGER'),
+    ('bounded', 'INTEGER'),
+]
+
+
+def CanonicalParams(params):
+    return [float(x) for x in params]
+
+
+def CanonicalId(params):
+    """Hash of the parameter vector, identical to the geometry file id."""
+    return create_id(CanonicalParams(params))
+
+
+class PointStore:
+    """Evaluated points indexed by parameter hash, image tag, seed, sampling.
+
+    Backed by SQLite, so several optimizers on one machine can read and write
+    the same file concurrently. Seeds and samplings are compared as strings,
+    since they arrive both as numbers and as command line arguments.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        columns = [
+            row[1] for row in self.db.execute('PRAGMA table_info(points)')
+        ]
+        for column, column_type in MIGRATIONS:
+            if column not in columns:
+                self.db.execute('ALTER TABLE points ADD COLUMN {} {}'.format(
+                    column, column_type))
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM points').fetchone()[0]
+
+    def add(self,
+            params,
+            loss,
+            image_tag,
+            seed,
+            sampling,
+            tag='',
+            weight=None,
+            length=None,
+            muons_w=None,
+            job_id=None,
+            uncertainty=None,
+            shards=None,
+            partial=False,
+            bounded=False):
+        """Add an evaluated point.
+
+        Points estimated from only some of their shards are `partial`, with
+        the number of completed `shards` and the `uncertainty` of the loss
+        set. The loss of `bounded` points is only a lower bound. Neither is
+        returned by `get`, so such points are evaluated again when asked.
+
+        """
+        params = CanonicalParams(params)
+        self.db.execute(
+            'INSERT OR REPLACE INTO points (id, image_tag, seed, sampling, '
+            'tag, params, weight, length, muons_w, loss, job_id, uncertainty, '
+            'shards, partial, bounded) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (create_id(params), str(image_tag), str(seed), str(sampling), tag,
+             json.dumps(params), weight, length, muons_w, float(loss), job_id,
+             uncertainty, shards, int(partial), int(bounded)))
+
+    def add_metadata(self, metadata, loss, **results):
+        """Add a point described by the metadata of its Disneyland jobs."""
+        user = json.loads(metadata)['user']
+        self.add(
+            ParseParams(user['params']),
+            loss,
+            image_tag=user['image_tag'],
+            seed=user['seed'],
+            sampling=user['sampling'],
+            tag=user['tag'],
+            **results)
+
+    def import_jobs(self, jobs):
+        """Add Disneyland `point` jobs, returns the number of points added.
+
+        Points which are already stored only get the loss and the job id of
+        the job, so that their weight, length and `muons_w` are kept.
+
+        """
+        added = 0
+        self.db.execute('BEGIN')
+        try:
+            for job in jobs:
+                try:
+                    user = json.loads(job.metadata)['user']
+                    params = ParseParams(user['params'])
+                    if len(params) != 56:
+                        continue
+                    updated = self.db.execute(
+                        'UPDATE points SET loss = ?, job_id = ? WHERE id = ? '
+                        'AND image_tag = ? AND seed = ? AND sampling = ?',
+                        (float(job.output), job.id, CanonicalId(params),
+                         str(user['image_tag']), str(user['seed']),
+                         str(user['sampling']))).rowcount
+                    if not updated:
+                        self.add_metadata(job.metadata, job.output,
+                                          job_id=job.id)
+                    added += 1
+                except (ValueError, KeyError) as e:
+                    print(job.id, e)
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        return added
+
+    def import_shards(self, jobs):
+        """Record `docker` jobs of points, returns the number recorded."""
+        added = 0
+        self.db.execute('BEGIN')
+        try:
+            for job in jobs:
+                try:
+                    user = json.loads(job.metadata)['user']
+                    if user.get('stage') == 'geometry':
+                        continue
+                    self.db.execute(
+                        'INSERT OR REPLACE INTO shards VALUES '
+                        '(?, ?, ?, ?, ?, ?, ?)',
+                        (job.id, CanonicalId(ParseParams(user['params'])),
+                         str(user['image_tag']), str(user['seed']),
+                         str(user['sampling']), user['tag'], job.status))
+                    added += 1
+                except (ValueError, KeyError):
+                    # not a shard of a point, e.g. a collector job
+                    pass
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        return added
+
+    def unfinished_shards(self, final):
+        """Return the job ids of shards whose status is not in `final`."""
+        final = list(final)
+        rows = self.db.execute(
+            'SELECT job_id FROM shards WHERE status IS NULL '
+            'OR status NOT IN ({})'.format(', '.join('?' * len(final))),
+            final)
+        return [job_id for job_id, in rows.fetchall()]
+
+    def update_shards(self, jobs):
+        """Update the status of recorded shards, returns the number changed."""
+        changed = 0
+        self.db.execute('BEGIN')
+        try:
+            for job in jobs:
+                changed += self.db.execute(
+                    'UPDATE shards SET status = ? WHERE job_id = ? '
+                    'AND status IS NOT ?',
+                    (job.status, job.id, job.status)).rowcount
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        return changed
+
+    def watermark(self, kind):
+        """Return the highest job id of `kind` which has been imported."""
+        row = self.db.execute('SELECT job_id FROM watermarks WHERE kind = ?',
+                              (kind, )).fetchone()
+        return row[0] if row else 0
+
+    def set_watermark(self, kind, job_id):
+        self.db.execute('INSERT OR REPLACE INTO watermarks VALUES (?, ?)',
+                        (kind, job_id))
+
+    def get(self, params, image_tags, seed, sampling):
+        """Return the loss of `params` or None if it was not evaluated.
+
+        Partial estimates and lower bounds count as not evaluated.
+
+        """
+        image_tags = [str(image_tag) for image_tag in image_tags]
+        row = self.db.execute(
+            'SELECT loss FROM points WHERE id = ? AND seed = ? '
+            'AND sampling = ? AND NOT COALESCE(partial, 0) '
+            'AND NOT COALESCE(bounded, 0) AND image_tag IN ({})'.format(
+                ', '.join('?' * len(image_tags))),
+            [CanonicalId(params), str(seed), str(sampling)] +
+            image_tags).fetchone()
+        return row[0] if row else None
+
+    def query(self, image_tags, seed='all', sampling='all', tag='all'):
+        """Return all matching points as `(X, y)`."""
+        image_tags = [str(image_tag) for image_tag in image_tags]
+        query = 'SELECT params, loss FROM points WHERE image_tag IN ({})'
+        query = query.format(', '.join('?' * len(image_tags)))
+        values = list(image_tags)
+        for column, value in (('seed', seed), ('sampling', sampling),
+                              ('tag', tag)):
+            if value != 'all':
+                query += ' AND {} = ?'.format(column)
+                values.append(str(value))
+        rows = self.db.execute(query, values).fetchall()
+        X = [json.loads(params) for params, _ in rows]
+        y = [loss for _, loss in rows]
+        return X, y
@@ -1,23 +1,24 @@
 #!/usr/bin/env python3
 import json
 import pandas as pd
-import numpy as np
 
-from disneylandClient import ListJobsRequest, new_client
-from disney_optimize import ProcessPoints, FilterPoints
-from config import IMAGE_TAG
+from disneylandClient import new_client
+from disney_sync import SyncPoints
+from point_store import PointStore
+from config import IMAGE_TAG, POINT_STORE
 
 stub = new_client()
-all_points = stub.ListJobs(ListJobsRequest(kind='point', how_many=0)).jobs
-points = FilterPoints(all_points, seed='all', sampling='all')
-X, y = ProcessPoints(points)
-ids = [job.id for job in points]
-metadata = pd.DataFrame.from_dict(
-    data=[json.loads(point.metadata)['user'] for point in points]).drop(
-        'params', axis=1)
-data = pd.DataFrame(
-    data=np.concatenate([np.array(X).T, np.array([y]), np.array([ids])]).T,
-    columns=list(range(1, 57)) + ['loss', 'job_id'])
-df = pd.concat([data, metadata], axis=1).set_index(['job_id']).sort_index()
+store = PointStore(POINT_STORE)
+SyncPoints(stub, store)
+points = pd.read_sql_query(
+    'SELECT * FROM points WHERE image_tag = ?',
+    store.db,
+    params=(str(IMAGE_TAG), ))
+params = pd.DataFrame(
+    data=[json.loads(p) for p in points['params']],
+    columns=list(range(1, 57)))
+df = pd.concat(
+    [params, points.drop(['id', 'params'], axis=1)],
+    axis=1).set_index(['job_id']).sort_index()
 df.to_csv(f'points_{IMAGE_TAG}.csv')
 print(df)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Recompute the losses of evaluated points from the hits saved by shards.
+
+Every shard saves the muon hits with energy loss to a `hits_*.npz` file (see
+`analyse.StreamingAnalysis`). The cuts and weights of the analysis are
+applied to these hits again, so that changes of the cost function only need
+the hit files instead of a new simulation of every point.
+
+"""
+import os
+import glob
+import argparse
+
+import numpy as np
+
+from disney_common import FCN, ParseParams
+from point_store import PointStore
+from columnar import CUTS, analyse_hits
+from config import POINT_STORE, WEIGHT_LIMIT
+
+N_SHARDS = 16
+
+
+def HitFiles(directory, point_id, image_tag, sampling, seed):
+    """Hit files of the shards of a point, as named by `JOB_TEMPLATE`."""
+    return sorted(
+        glob.glob(
+            os.path.join(
+                directory, 'hits_{}_{}_{}_{}_*.npz'.format(
+                    image_tag, point_id, sampling, seed))))
+
+
+def ReanalyseShards(files, **cuts):
+    """Return the sum of the muon weights of the shards in `files`."""
+    muons_w = 0.
+    for filename in files:
+        shard = np.load(filename)
+        muons_w += analyse_hits(shard['hits'], int(shard['n_events']),
+                                **cuts).sum()
+    return muons_w
+
+
+def Reanalyse(store, directory, output, **cuts):
+    """Recompute the points of `store` with `cuts` and add them to `output`.
+
+    Points which are too heavy to be simulated keep their loss, points
+    without the hit files of all their shards are skipped.
+
+    Returns
+    -------
+    tuple
+        Number of recomputed and of skipped points
+
+    """
+    rows = store.db.execute(
+        'SELECT id, image_tag, seed, sampling, tag, params, weight, length '
+        'FROM points WHERE weight IS NOT NULL AND length IS NOT NULL')
+    recomputed, skipped = 0, 0
+    for point_id, image_tag, seed, sampling, tag, params, weight, \
+            length in rows.fetchall():
+        if weight < WEIGHT_LIMIT:
+            files = HitFiles(directory, point_id, image_tag, sampling, seed)
+            if len(files) < N_SHARDS:
+                skipped += 1
+                continue
+            muons_w = ReanalyseShards(files, **cuts)
+        else:
+            muons_w = 0
+        y = FCN(weight, muons_w, length)
+        output.add(
+            ParseParams(params),
+            y,
+            image_tag=image_tag,
+            seed=seed,
+            sampling=sampling,
+            tag=tag,
+            weight=weight,
+            length=length,
+            muons_w=muons_w)
+        recomputed += 1
+    return recomputed, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Recompute the losses of points from their hit files.')
+    parser.add_argument('--store', default=POINT_STORE)
+    parser.add_argument(
+        '--hits', help='Directory with the hit files', required=True)
+    parser.add_argument(
+        '-o',
+        '--output',
+        help='Point store for the recomputed points',
+        required=True)
+    for cut, default in sorted(CUTS.items()):
+        parser.add_argument('--' + cut, type=float, default=default)
+    args = parser.parse_args()
+    cuts = {cut: getattr(args, cut) for cut in CUTS}
+    recomputed, skipped = Reanalyse(
+        PointStore(args.store), args.hits, PointStore(args.output), **cuts)
+    print('Recomputed {} points, skipped {} points without all hit files.'.
+          format(recomputed, skipped))
+
+
+if __name__ == '__main__':
+    main()
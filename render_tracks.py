@@ -0,0 +1,82 @@
+#!/usr/bin/env python2
+"""Draw the tracks of events in the acceptance recorded by `analyse`."""
+import argparse
+from array import array
+import numpy as np
+import ROOT as r
+
+COLOURS = {13: 4, -13: 6}
+
+
+def graph_tracks(points):
+    """Create graphs of the tracks of an event from its track points."""
+    zs = array('f', points['z'])
+    return (r.TGraph(len(points), zs, array('f', points['x'])),
+            r.TGraph(len(points), zs, array('f', points['y'])))
+
+
+def draw_event(points):
+    """Draw the x and y projections of the tracks of one event."""
+    number = int(points['event'][0])
+    colour = COLOURS.get(int(points['pid'][0]), 1)
+    graph_x, graph_y = graph_tracks(points)
+    graph_x.SetLineColor(colour)
+    graph_y.SetLineColor(colour)
+    name = 'c{}'.format(number)
+    c = r.TCanvas(name, name, 1600, 900)
+    multigraph = r.TMultiGraph(
+        'tracks_{}'.format(number),
+        'Tracks in acceptance and side;z [cm];x/y [cm]')
+    graph_x.SetLineStyle(1)
+    graph_x.SetMarkerStyle(20)
+    graph_x.SetTitle('x-projection')
+    graph_x.SetFillStyle(0)
+    graph_y.SetTitle('y-projection')
+    graph_y.SetLineStyle(2)
+    graph_y.SetMarkerStyle(20)
+    graph_y.SetFillStyle(0)
+    multigraph.Add(graph_x, 'lp')
+    multigraph.Add(graph_y, 'lp')
+    multigraph.Draw('Alp')
+    c.BuildLegend()
+    # keep the graphs alive as long as the canvas
+    c.graphs = multigraph, graph_x, graph_y
+    return c
+
+
+def render_tracks(tracks, outputfile, events=None, max_events=None):
+    """Write canvases of the tracks recorded in `tracks` to `outputfile`.
+
+    Parameters
+    ----------
+    tracks : str
+        `.npy` file with the track points written by `analyse`
+    outputfile : str
+        ROOT file for the canvases, will be overwritten
+    events : list
+        Numbers of the events to draw, all recorded events if None
+    max_events : int
+        Draw at most this many events
+
+    """
+    r.gROOT.SetBatch(True)
+    points = np.load(tracks)
+    numbers = np.unique(points['event'])
+    if events:
+        numbers = numbers[np.in1d(numbers, events)]
+    f = r.TFile.Open(outputfile, 'recreate')
+    for number in numbers[:max_events]:
+        c = draw_event(points[points['event'] == number])
+        f.WriteTObject(c, c.GetName())
+    f.Close()
+    print 'Drew {} events.'.format(len(numbers[:max_events]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('tracks')
+    parser.add_argument('-o', '--output', default='tracks.root')
+    parser.add_argument('-e', '--events', type=int, nargs='+')
+    parser.add_argument('-n', '--max_events', type=int)
+    args = parser.parse_args()
+    render_tracks(args.tracks, args.output, args.events, args.max_events)
@@ -1,22 +1,37 @@
 #!/usr/bin/env python2
 import os
-from time import sleep
 import numpy as np
 import copy
 import json
 import argparse
 import shutil
+import functools
 import subprocess
-import filelock
 import ROOT as r
 import config
 import shipunit as u
 import geomGeant4
 from ShipGeoConfig import ConfigRegistry
 import shipDet_conf
-from analyse import analyse
+from analyse import StreamingAnalysis
 from disney_common import create_id, ParseParams
 from common import generate_geo
+from geometry_cache import GeometryCache, LIGHT, HEAVY
+from worker_server import request_shard
+
+STREAMING_TASK = '''
+#include "FairTask.h"
+#include "TPyDispatcher.h"
+
+class StreamingTask : public FairTask {
+public:
+    StreamingTask(TPyDispatcher* dispatcher)
+        : FairTask("StreamingTask"), fDispatcher(dispatcher) {}
+    virtual void Exec(Option_t*) { fDispatcher->Dispatch(); }
+private:
+    TPyDispatcher* fDispatcher;
+};
+'''
 
 
 def generate(
@@ -24,7 +39,9 @@ def generate(
         paramFile,
         outFile,
         seed=1,
-        nEvents=None
+        nEvents=None,
+        firstEvent=0,
+        analysis=None
 ):
     """Generate muon background and transport it through the geometry.
 
@@ -36,15 +53,20 @@ def generate(
         File with the muon shield parameters
     outFile : str
         File in which `cbmsim` tree is saved
+
+        If None, the tree is only kept in memory, one event at a time.
     seed : int
         Determines the seed passed on to the MuonBackGenerator instance
     nEvents : int
         Number of events to be read from inputFile
 
         If falsy, generate will run over the entire file.
+    firstEvent : int
+        First event to be read from inputFile
+    analysis : StreamingAnalysis
+        If given, every event is analysed as soon as it is transported
 
     """
-    firstEvent = 0
     dy = 10.
     vessel_design = 5
     shield_design = 8
@@ -66,6 +88,11 @@ def generate(
 
     run = r.FairRunSim()
     run.SetName(mcEngine)  # Transport engine
+    if outFile is None:
+        outFile = r.TMemFile('output', 'recreate')
+        keep_tree = False
+    else:
+        keep_tree = True
     run.SetOutputFile(outFile)  # Output file
     # user configuration file default g4Config.C
     run.SetUserConfig('g4Config.C')
@@ -79,15 +106,25 @@ def generate(
         MuonBackgen.SetSameSeed(sameSeed)
     primGen.AddGenerator(MuonBackgen)
     if not nEvents:
-        nEvents = MuonBackgen.GetNevents()
+        nEvents = MuonBackgen.GetNevents() - firstEvent
     else:
-        nEvents = min(nEvents, MuonBackgen.GetNevents())
+        nEvents = min(nEvents, MuonBackgen.GetNevents() - firstEvent)
     print 'Process ', nEvents, ' from input file, with Phi random=', phiRandom
     if followMuon:
         modules['Veto'].SetFastMuon()
     run.SetGenerator(primGen)
     run.SetStoreTraj(r.kFALSE)
+    if analysis is not None:
+        if not hasattr(r, 'StreamingTask'):
+            r.gInterpreter.Declare(STREAMING_TASK)
+        # executed by FairMCApplication at the end of every event
+        dispatcher = r.TPyDispatcher(analysis.fill_current_event)
+        task = r.StreamingTask(dispatcher)
+        r.SetOwnership(task, False)
+        run.AddTask(task)
     run.Init()
+    if not keep_tree:
+        r.FairRootManager.Instance().GetOutTree().SetCircular(1)
     print 'Initialised run.'
     geomGeant4.setMagnetField()
     print 'Start run of {} events.'.format(nEvents)
@@ -95,6 +132,111 @@ def generate(
     print 'Finished simulation of {} events.'.format(nEvents)
 
 
+def run_shard(inputFile, paramFile, outFile, hists, xs_path, seed=1,
+              nEvents=None, firstEvent=0, keep_tree=False, bound=None,
+              tracks=None, hits=None):
+    """Simulate a shard of muons and analyse it, returns the muon weights.
+
+    The events are analysed while they are transported, the `cbmsim` tree is
+    only written to `outFile` if `keep_tree` is set. With `bound` the shard
+    stops as soon as the sum of the muon weights exceeds it. With `tracks`
+    the tracks of some events in the acceptance are saved to be drawn by
+    `render_tracks.py`, with `hits` the muon hits are saved to be analysed
+    again by `reanalyse.py`.
+
+    """
+    try:
+        analysis = StreamingAnalysis(
+            hists, bound=bound, tracks=tracks, hits=hits)
+        generate(
+            inputFile=inputFile,
+            paramFile=paramFile,
+            outFile=outFile if keep_tree else None,
+            seed=seed,
+            nEvents=nEvents,
+            firstEvent=firstEvent,
+            analysis=analysis
+        )
+    except Exception as e:
+        raise RuntimeError(
+            "Simulation failed with exception: %s",
+            e
+        )
+    try:
+        xs = analysis.close()
+        np.save(xs_path, np.array(xs))
+    except Exception as e:
+        raise RuntimeError(
+            "Analysis failed with exception: %s",
+            e
+        )
+    return xs
+
+
+def build_geometry(params, directory, key):
+    """Create and weigh the geometry of `params` in `directory`."""
+    paramFile = generate_geo(
+        os.path.join(directory, 'params_{}.root'.format(key)),
+        params
+    )
+    geoinfoFile = os.path.join(directory, 'geoinfo.csv')
+    subprocess.call(
+        [
+            'python2',
+            '/code/get_geo.py',
+            '-g', paramFile,
+            '-o', geoinfoFile
+            ])
+    shutil.move(
+        '/shield/geofiles/' + os.path.basename(paramFile),
+        os.path.join(directory, 'geo_{}.root'.format(key))
+    )
+    with open(geoinfoFile, 'r') as f:
+        length, weight = map(float, f.read().strip().split(','))
+    return length, weight
+
+
+def fetch_geometry(params, tmpl):
+    """Get the geometry of `params` from the cache, creating it if needed.
+
+    The geometry stays pinned in the cache until the caller unpins it.
+
+    """
+    tmpl['status'] = 'Fetching geometry...'
+    cache = GeometryCache()
+    key = create_id(params)
+    entry = cache.fetch(
+        key, functools.partial(build_geometry, params), pin=True)
+    tmpl['weight'] = entry['weight']
+    tmpl['length'] = entry['length']
+    if entry['built'] and entry['status'] == LIGHT:
+        shutil.copy(cache.geo_file(key), '/output/geo_{}.root'.format(key))
+    return cache, entry
+
+
+def create_geometry(params, tmpl):
+    """Create and weigh the geometry of `params` for the simulation jobs.
+
+    The parameter file is written to /output, to be passed to the simulation
+    jobs with `--geofile` if the geometry is light enough.
+
+    """
+    cache, entry = fetch_geometry(params, tmpl)
+    key = create_id(params)
+    tmpl['error'] = None
+    if entry['status'] == LIGHT:
+        shutil.copy(
+            cache.params_file(key),
+            '/output/params_{}.root'.format(key)
+        )
+        tmpl['status'] = 'Created geometry.'
+    else:
+        tmpl['status'] = 'Too heavy.'
+    cache.unpin(key)
+    with open(args.results, 'w') as f:
+        json.dump(tmpl, f)
+
+
 def main():
 
     tmpl = copy.deepcopy(config.RESULTS_TEMPLATE)
@@ -111,107 +253,63 @@ def main():
             json.dump(tmpl, f)
         raise
     tmpl['status'] = 'Parsed parameters.'
-    paramFile = '/shared/params_{}.root'.format(
-        create_id(params)
-    )
-    geoinfoFile = paramFile.replace('params', 'geoinfo')
-    heavy = '/shared/heavy_{}'.format(create_id(params))
-    lockfile = paramFile + '.lock'
-
-    if os.path.exists(geoinfoFile):
-        geolockfile = geoinfoFile + '.lock'
-        lock = filelock.FileLock(geolockfile)
-        if not lock.is_locked:
-            with lock:
-                with open(geoinfoFile, 'r') as f:
-                    length, weight = map(float, f.read().strip().split(','))
-
-                tmpl['weight'] = weight
-                tmpl['length'] = length
-
-    while not os.path.exists(paramFile) and not os.path.exists(heavy):
-        lock = filelock.FileLock(lockfile)
-        if not lock.is_locked:
-            with lock:
-                tmpl['status'] = 'Aquired lock.'
-                tmp_paramFile = generate_geo(
-                    paramFile.replace('.', '.tmp.'),
-                    params
-                )
-                subprocess.call(
-                    [
-                        'python2',
-                        '/code/get_geo.py',
-                        '-g', tmp_paramFile,
-                        '-o', geoinfoFile
-                        ])
-                shutil.move(
-                    '/shield/geofiles/' + os.path.basename(tmp_paramFile),
-                    paramFile.replace(
-                        'shared', 'output'
-                    ).replace(
-                        'params', 'geo'
-                    )
-                )
-                with open(geoinfoFile, 'r') as f:
-                    length, weight = map(float, f.read().strip().split(','))
-
-                tmpl['weight'] = weight
-                tmpl['length'] = length
-                if weight < 3e6:
-                    shutil.move(tmp_paramFile, paramFile)
-                else:
-                    open(heavy, 'a').close()
-                    with open(args.results, 'w') as f:
-                        json.dump(tmpl, f)
-                tmpl['status'] = 'Created geometry.'
-        else:
-            sleep(60)
-
-    if os.path.exists(heavy):
-        tmpl['status'] = 'Too heavy.'
-        tmpl['error'] = None
-        with open(args.results, 'w') as f:
-            json.dump(tmpl, f)
+    if args.geometry_only:
+        create_geometry(params, tmpl)
         return
 
+    cache = None
+    if args.geofile:
+        # created and weighed by a geometry job, see `create_geometry`
+        paramFile = args.geofile
+    else:
+        cache, entry = fetch_geometry(params, tmpl)
+        if entry['status'] == HEAVY:
+            cache.unpin(create_id(params))
+            tmpl['status'] = 'Too heavy.'
+            tmpl['error'] = None
+            with open(args.results, 'w') as f:
+                json.dump(tmpl, f)
+            return
+        paramFile = cache.params_file(create_id(params))
+
     outFile = "/output/ship.conical.MuonBack-TGeant4.root"
     try:
-        try:
+        shard = dict(
+            inputFile=args.input,
+            paramFile=paramFile,
+            outFile=outFile,
+            hists=args.hists,
+            xs_path=args.xs_path,
+            seed=args.seed,
+            nEvents=args.nEvents,
+            firstEvent=args.firstEvent,
+            keep_tree=args.keep_tree,
+            bound=args.bound,
+            tracks=args.tracks,
+            hits=args.hits
+        )
+        xs = None
+        if args.worker and os.path.exists(args.worker):
+            tmpl['status'] = 'Simulating in worker...'
+            xs = request_shard(args.worker, shard)
+        if xs is None:
             tmpl['status'] = 'Simulating...'
-            generate(
-                inputFile=args.input,
-                paramFile=paramFile,
-                outFile=outFile,
-                seed=args.seed,
-                nEvents=args.nEvents
-            )
-        except Exception as e:
-            raise RuntimeError(
-                "Simulation failed with exception: %s",
-                e
-            )
-        try:
-            tmpl['status'] = 'Analysing...'
-            chain = r.TChain('cbmsim')
-            chain.Add(outFile)
-            xs = analyse(chain, args.hists)
-            np.save(args.xs_path, np.array(xs))
-            tmpl['muons'] = len(xs)
-            tmpl['muons_w'] = sum(xs)
-        except Exception as e:
-            raise RuntimeError(
-                "Analysis failed with exception: %s",
-                e
-            )
+            xs = run_shard(**shard)
+        tmpl['muons'] = len(xs)
+        tmpl['muons_w'] = sum(xs)
+        # stopped early, muons_w is only a lower bound
+        tmpl['bounded'] = (args.bound is not None and
+                           tmpl['muons_w'] > args.bound)
         tmpl['error'] = None
         tmpl['status'] = 'Done.'
     except RuntimeError, e:
         tmpl['error'] = e.__repr__()
     finally:
+        if cache is not None:
+            cache.unpin(create_id(params))
         with open(args.results, 'w') as f:
             json.dump(tmpl, f)
-        if os.path.exists(outFile):
+        if not args.keep_tree and os.path.exists(outFile):
             os.remove(outFile)
 
 
@@ -230,7 +328,41 @@ if __name__ == '__main__':
     parser.add_argument('--params', required=True)
     parser.add_argument('--seed', type=int, default=1)
     parser.add_argument('--xs_path', default='xs.npz')
+    parser.add_argument(
+        '--tracks',
+        help='File for the tracks of some events in the acceptance'
+    )
+    parser.add_argument(
+        '--hits',
+        help='File for the muon hits, to be analysed again later'
+    )
     parser.add_argument('-n', '--nEvents', type=int)
+    parser.add_argument('--firstEvent', type=int, default=0)
+    parser.add_argument(
+        '--worker',
+        help='Socket of a warm worker to run the shard, e.g. {}. The '
+        'worker only saves loading the libraries, every shard still '
+        'initialises its own run'.format(config.WORKER_SOCKET)
+    )
+    parser.add_argument(
+        '--geofile',
+        help='Parameter file of a geometry created by a geometry job'
+    )
+    parser.add_argument(
+        '--geometry_only',
+        help='Only create and weigh the geometry',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--bound',
+        help='Stop once the sum of the muon weights exceeds this bound',
+        type=float
+    )
+    parser.add_argument(
+        '--keep_tree',
+        help='Write the cbmsim tree of the shard to /output',
+        action='store_true'
+    )
 
     args = parser.parse_args()
     main()
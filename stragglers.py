@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""Speculative re-submission of straggling shards."""
+import time
+import collections
+
+import numpy as np
+from disneylandClient import Job
+
+from disney_jobs import JobTracker, STATUS_FINAL
+
+SLOW_QUANTILE = 0.9
+SLOW_FACTOR = 1.5
+MIN_RUNTIMES = 32  # observed shard runtimes before speculating
+MAX_COPIES = 1  # speculative copies per shard
+RUNTIME_HISTORY = 1000
+
+
+class StragglerTracker(JobTracker):
+    """Job tracker which submits speculative copies of slow shards.
+
+    Each job of a group is a shard. The runtime of every shard, from the
+    first poll seeing it pulled to the first poll seeing it completed, is
+    recorded in `runtimes`, which may be shared between trackers. A shard
+    running longer than `slow_factor` times the `slow_quantile` of the
+    recorded runtimes is submitted again with the same input, up to
+    `max_copies` times.
+
+    A group is reported as soon as each of its shards has a completed
+    attempt, or when all attempts are final. The reported jobs contain one
+    attempt per shard in the original order: the first completed one, or else
+    the latest one. Once a shard has a completed attempt, its other attempts
+    are cancelled, and so are the attempts left over when a group is removed.
+
+    """
+
+    def __init__(self,
+                 stub,
+                 runtimes=None,
+                 slow_quantile=SLOW_QUANTILE,
+                 slow_factor=SLOW_FACTOR,
+                 min_runtimes=MIN_RUNTIMES,
+                 max_copies=MAX_COPIES,
+                 **kwargs):
+        super(StragglerTracker, self).__init__(stub, **kwargs)
+        self.runtimes = runtimes if runtimes is not None else \
+            collections.deque(maxlen=RUNTIME_HISTORY)
+        self.slow_quantile = slow_quantile
+        self.slow_factor = slow_factor
+        self.min_runtimes = min_runtimes
+        self.max_copies = max_copies
+        self.shards = {
+            # key: list of indices of the attempts of each shard in the group
+        }
+        self.running = {
+            # job id: time the job was first seen pulled or running
+        }
+
+    def add(self, jobs, key=None):
+        jobs = list(jobs)
+        if key is None:
+            key = next(self._keys)
+        self.shards[key] = [[i] for i in range(len(jobs))]
+        return super(StragglerTracker, self).add(jobs, key)
+
+    def remove(self, key):
+        jobs = super(StragglerTracker, self).remove(key)
+        picked = self._pick(key, jobs)
+        self.shards.pop(key, None)
+        for job in jobs:
+            self.running.pop(job.id, None)
+        picked_ids = set(job.id for job in picked)
+        for job in jobs:
+            if job.id not in picked_ids and job.status not in STATUS_FINAL:
+                self._cancel_job(job)
+        return picked
+
+    def peek(self, key):
+        """Return the jobs of a group like `remove`, but keep tracking it."""
+        with self._lock:
+            return self._pick(key, self.groups[key])
+
+    def _pick(self, key, jobs):
+        picked = []
+        for shard in self._attempts(key, jobs):
+            completed = [
+                jobs[i] for i in shard if jobs[i].status == Job.COMPLETED
+            ]
+            picked.append(completed[0] if completed else jobs[shard[-1]])
+        return picked
+
+    def _attempts(self, key, jobs):
+        return self.shards.get(key) or [[i] for i in range(len(jobs))]
+
+    def _get_job(self, job):
+        job = super(StragglerTracker, self)._get_job(job)
+        now = time.time()
+        if job.status in (Job.PULLED, Job.RUNNING):
+            self.running.setdefault(job.id, now)
+        elif job.status == Job.COMPLETED and job.id in self.running:
+            self.runtimes.append(now - self.running.pop(job.id))
+        else:
+            self.running.pop(job.id, None)
+        return job
+
+    def threshold(self):
+        """Runtime after which a shard is a straggler, None if unknown."""
+        if len(self.runtimes) < self.min_runtimes:
+            return None
+        return self.slow_factor * np.percentile(
+            list(self.runtimes), 100 * self.slow_quantile)
+
+    def poll(self):
+        final = super(StragglerTracker, self).poll()
+        self._cancel_losers()
+        with self._lock:
+            done = [
+                key for key, jobs in self.groups.items()
+                if all(
+                    any(jobs[i].status == Job.COMPLETED for i in shard)
+                    for shard in self._attempts(key, jobs))
+            ]
+        final += [(key, self.remove(key)) for key in done]
+        self._speculate()
+        return final
+
+    def _cancel_losers(self):
+        """Cancel the unfinished attempts of shards which completed."""
+        with self._lock:
+            losers = [(key, i, jobs[i])
+                      for key, jobs in self.groups.items()
+                      for shard in self._attempts(key, jobs)
+                      if any(jobs[j].status == Job.COMPLETED for j in shard)
+                      for i in shard if jobs[i].status not in STATUS_FINAL]
+        for key, i, job in losers:
+            cancelled = self._cancel_job(job)
+            if cancelled is None:
+                continue
+            with self._lock:
+                self.running.pop(job.id, None)
+                if key in self.groups:
+                    self.groups[key][i] = cancelled
+
+    def _speculate(self):
+        threshold = self.threshold()
+        if threshold is None:
+            return
+        now = time.time()
+        with self._lock:
+            slow = [(key, n, jobs[shard[-1]])
+                    for key, jobs in self.groups.items()
+                    for n, shard in enumerate(self._attempts(key, jobs))
+                    if len(shard) <= self.max_copies
+                    and jobs[shard[-1]].id in self.running
+                    and now - self.running[jobs[shard[-1]].id] > threshold]
+        for key, n, job in slow:
+            copy = self.stub.CreateJob(
+                Job(input=job.input, kind=job.kind, metadata=job.metadata))
+            print('[{}] Shard {} is slow, submitted job {} as a copy'.format(
+                time.time(), job.id, copy.id))
+            with self._lock:
+                tracked = key in self.groups
+                if tracked:
+                    self.shards[key][n].append(len(self.groups[key]))
+                    self.groups[key].append(copy)
+            if not tracked:
+                # the group finished while the copy was submitted
+                self._cancel_job(copy)
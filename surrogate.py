@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""Surrogate models which are updated incrementally instead of refit.
+
+skopt clones its base estimator and fits the clone on the whole history on
+every `tell`. The estimators here keep their fitted models in a
+`SurrogateState` which is shared by all clones, and only fit the new data on
+top of the latest model fitted on a prefix of the history. A full refit is
+done whenever the history has grown by `refit_growth` since the last one.
+
+"""
+import copy
+import time
+import hashlib
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.ensemble import GradientBoostingRegressor
+from skopt.learning import (GaussianProcessRegressor, RandomForestRegressor,
+                            GradientBoostingQuantileRegressor)
+from skopt.learning.gaussian_process.gpr import _param_for_white_kernel_in_Sum
+from skopt.learning.gaussian_process.kernels import WhiteKernel
+
+REFIT_GROWTH = 1.5
+HISTORY = 4  # fitted models kept per state
+
+
+def _Digest(X, y):
+    h = hashlib.md5()
+    h.update(np.ascontiguousarray(X, dtype=float).tobytes())
+    h.update(np.ascontiguousarray(y, dtype=float).tobytes())
+    return h.hexdigest()
+
+
+class SurrogateState(object):
+    """Fitted models and fit timings shared between clones of a surrogate.
+
+    `sklearn.clone` deep-copies parameters which are not estimators, so
+    `__deepcopy__` returns the instance itself to keep it shared.
+
+    Models are looked up by a digest of their training data, so a model
+    fitted with constant-liar values never becomes the base of a fit on the
+    real history. Only the latest `history` fits are kept, plus the fit
+    pinned by `commit` after every real `tell`, which would otherwise be
+    pushed out by the constant-liar fits of a batch `ask`.
+
+    """
+
+    def __init__(self, history=HISTORY):
+        self.history = history
+        self.fits = [
+            # (n_samples, digest, n_samples at last full fit, model)
+        ]
+        self.pinned = None
+        self.fit_times = [
+            # (n_samples, seconds, full)
+        ]
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def find(self, X, y):
+        """Return the latest fit on a prefix of `(X, y)` or None."""
+        fits = list(reversed(self.fits))
+        if self.pinned is not None:
+            fits.append(self.pinned)
+        for fit in fits:
+            n_samples, digest, _, _ = fit
+            if n_samples <= len(y) and _Digest(X[:n_samples],
+                                               y[:n_samples]) == digest:
+                return fit
+        return None
+
+    def add(self, X, y, n_full, model):
+        self.fits.append((len(y), _Digest(X, y), n_full, model))
+        del self.fits[:-self.history]
+
+    def commit(self):
+        """Pin the latest fit as the base for fits on the real history."""
+        if self.fits:
+            self.pinned = self.fits[-1]
+
+    def record(self, n_samples, seconds, full):
+        self.fit_times.append((n_samples, seconds, full))
+        print('[{}] {} surrogate fit on {} points took {:.2f} s'.format(
+            time.time(), 'Full' if full else 'Incremental', n_samples,
+            seconds))
+
+    def total_fit_time(self):
+        return sum(seconds for _, seconds, _ in self.fit_times)
+
+
+class _Incremental(object):
+    """Fit logic shared by the incremental surrogates.
+
+    Subclasses implement `_fit_full` and `_fit_update`. The fitted model is
+    the set of fitted attributes (ending in `_`) of the instance.
+
+    """
+
+    def fit(self, X, y):
+        X, y = np.asarray(X), np.asarray(y)
+        state = self.state if self.state is not None else SurrogateState()
+        start = time.time()
+        previous = state.find(X, y)
+        if previous is not None and previous[0] == len(y):
+            self.__dict__.update(previous[3])
+            return self
+
+        full = previous is None or len(y) >= previous[2] * self.refit_growth
+        if full:
+            self._fit_full(X, y)
+            n_full = len(y)
+        else:
+            self._fit_update(X, y, previous[3])
+            n_full = previous[2]
+        state.add(X, y, n_full, {
+            key: value
+            for key, value in self.__dict__.items() if key.endswith('_')
+        })
+        state.record(len(y), time.time() - start, full)
+        return self
+
+
+class IncrementalForest(_Incremental, RandomForestRegressor):
+    """Random forest which adds `trees_per_update` trees on new data.
+
+    The new trees are trained on the whole history and replace the oldest
+    trees, so the forest keeps `n_estimators` trees.
+
+    """
+
+    def __init__(self,
+                 n_estimators=500,
+                 max_depth=7,
+                 n_jobs=-1,
+                 random_state=None,
+                 trees_per_update=50,
+                 refit_growth=REFIT_GROWTH,
+                 state=None):
+        super(IncrementalForest, self).__init__(
+            n_estimators=n_estimators,
+            max_depth=max_depth,
+            n_jobs=n_jobs,
+            random_state=random_state)
+        self.trees_per_update = trees_per_update
+        self.refit_growth = refit_growth
+        self.state = state
+
+    def _fit_full(self, X, y):
+        RandomForestRegressor.fit(self, X, y)
+
+    def _fit_update(self, X, y, model):
+        self.__dict__.update(model)
+        self.estimators_ = list(model['estimators_'])
+        n_estimators = self.n_estimators
+        self.n_estimators = len(self.estimators_) + self.trees_per_update
+        self.warm_start = True
+        try:
+            RandomForestRegressor.fit(self, X, y)
+        finally:
+            self.n_estimators = n_estimators
+            self.warm_start = False
+        self.estimators_ = self.estimators_[-n_estimators:]
+
+
+class IncrementalGaussianProcess(_Incremental, GaussianProcessRegressor):
+    """Gaussian process which warm-starts its kernel hyperparameters.
+
+    Updates reuse the hyperparameters of the previous fit without optimising
+    them, full refits start the optimisation from them.
+
+    """
+
+    def __init__(self,
+                 kernel=None,
+                 alpha=1e-7,
+                 normalize_y=True,
+                 noise='gaussian',
+                 n_restarts_optimizer=0,
+                 random_state=None,
+                 refit_growth=REFIT_GROWTH,
+                 state=None):
+        super(IncrementalGaussianProcess, self).__init__(
+            kernel=kernel,
+            alpha=alpha,
+            normalize_y=normalize_y,
+            noise=noise,
+            n_restarts_optimizer=n_restarts_optimizer,
+            random_state=random_state)
+        self.refit_growth = refit_growth
+        self.state = state
+
+    def _fit_kernel(self, X, y, kernel, optimizer):
+        initial_kernel, initial_optimizer = self.kernel, self.optimizer
+        if kernel is not None:
+            self.kernel = clone(kernel)
+        self.optimizer = optimizer
+        try:
+            GaussianProcessRegressor.fit(self, X, y)
+        finally:
+            self.kernel, self.optimizer = initial_kernel, initial_optimizer
+
+        # skopt zeroes the noise of the fitted kernel, restore it so the
+        # kernel can be used as the starting point of the next fit
+        warm_kernel = clone(self.kernel_)
+        white_present, white_param = _param_for_white_kernel_in_Sum(
+            warm_kernel)
+        if white_present and self.noise_:
+            warm_kernel.set_params(
+                **{white_param: WhiteKernel(noise_level=self.noise_)})
+        self.warm_kernel_ = warm_kernel
+
+    def _fit_full(self, X, y):
+        fits = self.state.fits if self.state is not None else []
+        kernel = fits[-1][3]['warm_kernel_'] if fits else None
+        self._fit_kernel(X, y, kernel, self.optimizer)
+
+    def _fit_update(self, X, y, model):
+        self._fit_kernel(X, y, model['warm_kernel_'], None)
+
+
+class IncrementalQuantileBoosting(_Incremental,
+                                  GradientBoostingQuantileRegressor):
+    """Quantile gradient boosting which adds stages fitted on new data."""
+
+    def __init__(self,
+                 quantiles=None,
+                 base_estimator=None,
+                 n_jobs=1,
+                 random_state=None,
+                 stages_per_update=10,
+                 refit_growth=REFIT_GROWTH,
+                 state=None):
+        super(IncrementalQuantileBoosting, self).__init__(
+            quantiles=quantiles,
+            base_estimator=base_estimator,
+            n_jobs=n_jobs,
+            random_state=random_state)
+        self.stages_per_update = stages_per_update
+        self.refit_growth = refit_growth
+        self.state = state
+
+    def _fit_full(self, X, y):
+        GradientBoostingQuantileRegressor.fit(self, X, y)
+
+    def _fit_update(self, X, y, model):
+        regressors = []
+        for regressor in model['regressors_']:
+            regressor = copy.deepcopy(regressor)
+            regressor.set_params(
+                warm_start=True,
+                n_estimators=regressor.n_estimators + self.stages_per_update)
+            regressors.append(regressor.fit(X, y))
+        self.regressors_ = regressors
+
+
+def CommitSurrogate(clf):
+    """Pin the model of `clf` after telling it real results."""
+    state = getattr(getattr(clf, 'base_estimator_', None), 'state', None)
+    if state is not None:
+        state.commit()
+
+
+def CreateSurrogate(clf_type):
+    """Incremental counterparts of the surrogates used by `CreateOptimizer`."""
+    if clf_type == 'rf':
+        return IncrementalForest(
+            n_estimators=500, max_depth=7, n_jobs=-1, state=SurrogateState())
+    elif clf_type == 'gb':
+        return IncrementalQuantileBoosting(
+            base_estimator=GradientBoostingRegressor(
+                n_estimators=100, max_depth=4, loss='quantile'),
+            state=SurrogateState())
+    elif clf_type == 'gp':
+        return IncrementalGaussianProcess(
+            alpha=1e-7,
+            normalize_y=True,
+            noise='gaussian',
+            state=SurrogateState())
+    return None
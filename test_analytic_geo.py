@@ -0,0 +1,61 @@
+import os
+import numpy as np
+import analytic_geo
+from config import DEFAULT_POINT
+from disney_common import AddFixedParams, CreateDiscreteSpace
+from geometry_cache import GeometryCache
+from point_store import PointStore, CanonicalId
+
+
+space = CreateDiscreteSpace()
+
+
+def test_batch():
+    points = [AddFixedParams(list(map(float, p))) for p in space.rvs(5)]
+    masses = analytic_geo.MagnetMass(points)
+    lengths = analytic_geo.MagnetLength(points)
+    assert masses.shape == lengths.shape == (5, )
+    for point, mass, length in zip(points, masses, lengths):
+        assert np.isclose(analytic_geo.MagnetMass(point), mass)
+        assert np.isclose(analytic_geo.MagnetLength(point), length)
+
+
+def test_length():
+    # magnet lengths of the default point plus the gaps between them
+    assert analytic_geo.MagnetLength(DEFAULT_POINT) == 3430.
+
+
+def test_simpson():
+    # integrate the cross section of every magnet on a fine grid in z
+    dZ, entrance, exit = analytic_geo._Magnets(DEFAULT_POINT)
+    volumes = 0.
+    for t in np.linspace(0, 1, 1001)[:-1] + 0.0005:
+        plane = [(1 - t) * i + t * o for i, o in zip(entrance, exit)]
+        for n, x, y in analytic_geo._Corners(*plane):
+            volumes += n * analytic_geo._Area(x, y) * 2 * dZ / 1000
+    assert np.allclose(analytic_geo.MagnetVolumes(DEFAULT_POINT), volumes)
+
+
+def test_weight_deviation():
+    checked = [('id', 3430., 3430., 2e6, 2e6 * 1.01)] * \
+        analytic_geo.MIN_CHECKED
+    assert np.isclose(analytic_geo.WeightDeviation(checked), 0.01)
+    assert analytic_geo.WeightDeviation(checked[1:]) is None
+
+
+def test_check_catalog(tmpdir):
+    store = PointStore(str(tmpdir.join('points.sqlite')))
+    store.add(DEFAULT_POINT, 1., image_tag='tag', seed=1, sampling=37)
+    cache = GeometryCache(str(tmpdir.join('cache')))
+    assert analytic_geo.CheckCatalog(store, cache.root) == []
+    weight = analytic_geo.MagnetMass(DEFAULT_POINT) * 1.01
+
+    def build(directory, key):
+        with open(os.path.join(directory, 'geo.root'), 'w') as f:
+            f.write('geometry')
+        return 3430., weight
+
+    cache.fetch(CanonicalId(DEFAULT_POINT), build)
+    (checked, ) = analytic_geo.CheckCatalog(store, cache.root)
+    assert checked[1] == checked[2] == 3430.
+    assert np.isclose(checked[4] / checked[3], 1 / 1.01)
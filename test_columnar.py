@@ -0,0 +1,62 @@
+import numpy as np
+import columnar
+
+
+def loop_weights(event, pid, x, y, z, px, py, pz, eloss, n_events):
+    """Per-event weights as calculated by `analyse.StreamingAnalysis`."""
+    xs = [0.] * n_events
+    for i in range(len(event)):
+        if not eloss[i] > 0:
+            continue
+        if (
+                z[i] > (columnar.Z_Sensitive_Plane - 1) and
+                z[i] < (columnar.Z_Sensitive_Plane + 1) and
+                abs(pid[i]) == 13
+        ):
+            P = np.sqrt(px[i]**2 + py[i]**2 + pz[i]**2)
+            x_ = x[i] * pid[i] / 13.
+            if P > 1 and abs(y[i]) < 500 and (x_ < 260 and x_ > -300):
+                xs[event[i]] += np.sqrt((560. - (x_ + 300.)) / 560.)
+    return np.array(xs)
+
+
+def random_hits(n_hits, n_events, seed=1):
+    rng = np.random.RandomState(seed)
+    event = np.sort(rng.randint(0, n_events, n_hits))
+    pid = rng.choice([13, -13, 22, 11], n_hits).astype(float)
+    x = rng.uniform(-400, 400, n_hits)
+    y = rng.uniform(-600, 600, n_hits)
+    z = columnar.Z_Sensitive_Plane + rng.uniform(-2, 2, n_hits)
+    px, py = rng.normal(0, 1, (2, n_hits))
+    pz = rng.exponential(5, n_hits)
+    eloss = rng.choice([0., 1e-3], n_hits)
+    return event, pid, x, y, z, px, py, pz, eloss
+
+
+def test_same_as_loop():
+    n_events = 100
+    event, pid, x, y, z, px, py, pz, eloss = hits = random_hits(2000,
+                                                                n_events)
+    selected = columnar.select_hits(pid, z, eloss)
+    p = columnar.momentum(px[selected], py[selected], pz[selected])
+    _, accepted, w = columnar.muon_weights(pid[selected], x[selected],
+                                           y[selected], p)
+    xs = columnar.event_weights(event[selected], w, n_events)
+    assert accepted.any() and (~accepted).any()
+    assert np.allclose(xs, loop_weights(*(hits + (n_events, ))),
+                       rtol=1e-12)
+    assert xs.shape == (n_events, )
+
+
+def test_hit_records():
+    n_events = 100
+    event, pid, x, y, z, px, py, pz, eloss = random_hits(2000, n_events)
+    muons = (eloss > 0) & (np.abs(pid) == 13)
+    hits = columnar.hit_records(event[muons], pid[muons], x[muons], y[muons],
+                                z[muons], px[muons], py[muons], pz[muons])
+    xs = columnar.analyse_hits(hits, n_events)
+    stored = [hits[name].astype(float) for name in ('x', 'y', 'z', 'px', 'py',
+                                                     'pz')]
+    assert np.allclose(xs, loop_weights(event[muons], pid[muons], *(stored + [
+        eloss[muons], n_events])), rtol=1e-12)
+    assert columnar.analyse_hits(hits, n_events, p_min=1e9).sum() == 0
@@ -12,3 +12,11 @@ def test_parameter_number():
     space = disney_common.CreateDiscreteSpace()
     params = disney_common.AddFixedParams(space.rvs()[0])
     assert len(params) == 56
+
+
+def test_muons_bound():
+    for W in (1.5e6, 1.9e6, 2.5e6):
+        bound = disney_common.MuonsBound(W, 1e4)
+        assert abs(disney_common.FCN(W, bound, None) - 1e4) < 1e-6
+    assert disney_common.MuonsBound(2e6, 1.) is None
+    assert disney_common.MuonsBound(config.WEIGHT_LIMIT + 1, 1e4) is None
@@ -0,0 +1,147 @@
+import itertools
+import pytest
+
+disneyland = pytest.importorskip('disneylandClient')
+Job = disneyland.Job
+
+from disney_jobs import JobTracker  # noqa: E402
+from stragglers import StragglerTracker  # noqa: E402
+
+
+class FakeStub(object):
+    """Disneyland stub keeping the jobs in memory."""
+
+    def __init__(self):
+        self.jobs = {}
+        self.cancelled = []
+        self._ids = itertools.count(1)
+
+    def CreateJob(self, job):
+        created = Job(id=next(self._ids), status=Job.PENDING, input=job.input,
+                      kind=job.kind, metadata=job.metadata)
+        self.jobs[created.id] = created.status
+        return created
+
+    def GetJob(self, request):
+        return Job(id=request.id, status=self.jobs[request.id])
+
+    def ModifyJob(self, job):
+        self.cancelled.append(job.id)
+        self.jobs[job.id] = job.status
+        return Job(id=job.id, status=job.status)
+
+    def set(self, jobs, status):
+        for job in jobs:
+            self.jobs[job.id] = status
+
+
+def create(stub, n):
+    return [stub.CreateJob(Job(input='', kind='point', metadata=''))
+            for _ in range(n)]
+
+
+def test_add_poll():
+    stub = FakeStub()
+    with JobTracker(stub) as tracker:
+        first, second = create(stub, 2), create(stub, 1)
+        key = tracker.add(first)
+        tracker.add(second, key='second')
+        assert len(tracker) == 2
+        assert tracker.poll() == []
+
+        stub.set(first[:1], Job.COMPLETED)
+        stub.set(second, Job.RUNNING)
+        assert tracker.poll() == []
+        assert [(k, new.status) for k, _, new in tracker.changes] == \
+            [(key, Job.COMPLETED), ('second', Job.RUNNING)]
+
+        stub.set(first[1:], Job.FAILED)
+        ((final_key, jobs), ) = tracker.poll()
+        assert final_key == key
+        assert [job.status for job in jobs] == [Job.COMPLETED, Job.FAILED]
+        assert len(tracker) == 1
+
+
+def test_backoff():
+    stub = FakeStub()
+    with JobTracker(stub, min_interval=1, max_interval=5,
+                    backoff=2) as tracker:
+        jobs = create(stub, 1)
+        tracker.add(jobs)
+        intervals = []
+        for _ in range(3):
+            tracker.poll()
+            intervals.append(tracker.interval)
+        assert intervals == [2, 4, 5]
+        stub.set(jobs, Job.RUNNING)
+        tracker.poll()
+        assert tracker.interval == 1
+
+
+def test_expire():
+    stub = FakeStub()
+    with JobTracker(stub) as tracker:
+        old = tracker.add(create(stub, 1))
+        tracker.add(create(stub, 1))
+        tracker.started[old] -= 100
+        ((key, jobs), ) = tracker.expire(50)
+        assert key == old and jobs[0].status == Job.PENDING
+        assert len(tracker) == 1
+        assert stub.cancelled == []
+
+
+def test_cancel():
+    stub = FakeStub()
+    with JobTracker(stub) as tracker:
+        jobs = create(stub, 2)
+        stub.set(jobs[:1], Job.COMPLETED)
+        key = tracker.add(jobs)
+        tracker.poll()
+        cancelled = tracker.cancel(key)
+        assert stub.cancelled == [jobs[1].id]
+        assert [job.status for job in cancelled] == \
+            [Job.COMPLETED, Job.FAILED]
+        assert len(tracker) == 0
+
+
+def straggler_tracker(stub):
+    # every running shard is slow
+    return StragglerTracker(stub, runtimes=[1.], min_runtimes=1,
+                            slow_factor=0)
+
+
+def test_speculate_and_cancel_losers():
+    stub = FakeStub()
+    with straggler_tracker(stub) as tracker:
+        shards = create(stub, 2)
+        stub.set(shards, Job.RUNNING)
+        key = tracker.add(shards)
+        assert tracker.poll() == []
+        copies = tracker.groups[key][2:]
+        assert len(copies) == 2 and len(stub.jobs) == 4
+
+        # the copy of the first shard wins, the original is cancelled
+        stub.set(copies[:1], Job.COMPLETED)
+        assert tracker.poll() == []
+        assert stub.cancelled == [shards[0].id]
+
+        # the original of the second shard wins, its copy is cancelled
+        stub.set(shards[1:], Job.COMPLETED)
+        ((final_key, jobs), ) = tracker.poll()
+        assert final_key == key
+        assert [job.id for job in jobs] == [copies[0].id, shards[1].id]
+        assert stub.cancelled == [shards[0].id, copies[1].id]
+        assert len(tracker) == 0
+
+
+def test_straggler_cancel():
+    stub = FakeStub()
+    with straggler_tracker(stub) as tracker:
+        shards = create(stub, 1)
+        stub.set(shards, Job.RUNNING)
+        key = tracker.add(shards)
+        tracker.poll()
+        copy = tracker.groups[key][1]
+        (job, ) = tracker.cancel(key)
+        assert sorted(stub.cancelled) == [shards[0].id, copy.id]
+        assert job.id == copy.id and job.status == Job.FAILED
@@ -0,0 +1,43 @@
+import json
+import numpy as np
+import pytest
+
+disneyland = pytest.importorskip('disneylandClient')
+Job = disneyland.Job
+
+from disney_oneshot import get_partial_result  # noqa: E402
+
+
+class ShardJob(object):
+    def __init__(self, status, muons_w=None, weight=None, length=None):
+        self.status = status
+        result = dict(muons_w=muons_w, weight=weight, length=length,
+                      error=None)
+        self.output = json.dumps(['variable=' + json.dumps(result)])
+
+
+def test_partial_result():
+    jobs = [
+        ShardJob(Job.COMPLETED, 1., weight=1000., length=20.),
+        ShardJob(Job.COMPLETED, 3.),
+        ShardJob(Job.FAILED),
+        ShardJob(Job.RUNNING),
+    ]
+    weight, length, muons_w, error, k = get_partial_result(jobs, min_shards=2)
+    assert (weight, length, k) == (1000., 20., 2)
+    # 4 shards estimated from the mean of 2
+    assert muons_w == 8.
+    assert np.isclose(error, 4 * np.sqrt(2. / 3))
+
+
+def test_partial_result_too_few_shards():
+    jobs = [ShardJob(Job.COMPLETED, 1., weight=1000., length=20.),
+            ShardJob(Job.FAILED)]
+    with pytest.raises(Exception):
+        get_partial_result(jobs, min_shards=2)
+
+
+def test_partial_result_single_shard():
+    jobs = [ShardJob(Job.COMPLETED, 1., weight=1000., length=20.),
+            ShardJob(Job.FAILED)]
+    assert get_partial_result(jobs, min_shards=1)[3] == float('inf')
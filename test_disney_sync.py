@@ -0,0 +1,61 @@
+import pytest
+
+disneyland = pytest.importorskip('disneylandClient')
+
+from disney_sync import IterNewJobs  # noqa: E402
+
+
+class ListedJob(object):
+    def __init__(self, id):
+        self.id = id
+
+
+class Response(object):
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+
+class ListStub(object):
+    """Stub listing the jobs with ids 1 to `n`, newest first by default."""
+
+    def __init__(self, n, newest_first=True):
+        self.jobs = [ListedJob(id) for id in range(1, n + 1)]
+        if newest_first:
+            self.jobs.reverse()
+        self.requests = []
+
+    def ListJobs(self, request):
+        self.requests.append(request.how_many)
+        if request.how_many:
+            return Response(self.jobs[:request.how_many])
+        return Response(list(self.jobs))
+
+
+def ids(pages):
+    return [[job.id for job in page] for page in pages]
+
+
+def test_new_jobs_in_pages():
+    stub = ListStub(250)
+    pages = ids(IterNewJobs(stub, 'point', 200, page=10))
+    assert pages == [list(range(i, i + 10)) for i in range(201, 251, 10)]
+    # the limit is doubled until the watermark is reached
+    assert stub.requests == [10, 20, 40, 80]
+
+
+def test_short_history():
+    stub = ListStub(5)
+    assert ids(IterNewJobs(stub, 'point', 2, page=10)) == [[3, 4, 5]]
+    assert stub.requests == [10]
+
+
+def test_no_new_jobs():
+    stub = ListStub(20)
+    assert ids(IterNewJobs(stub, 'point', 20, page=10)) == []
+
+
+def test_oldest_first():
+    stub = ListStub(30, newest_first=False)
+    pages = ids(IterNewJobs(stub, 'point', 25, page=10))
+    assert pages == [[26, 27, 28, 29, 30]]
+    assert stub.requests == [10, 0]
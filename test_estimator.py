@@ -0,0 +1,52 @@
+import numpy as np
+from weighter.estimator import (proposal, importance_weights, estimate,
+                                sample_size, top_up_size)
+
+
+def test_estimate():
+    rng = np.random.RandomState(1)
+    n_muons = 2000
+    xs = rng.exponential(1, n_muons) * (rng.uniform(0, 1, n_muons) < 0.1)
+    q = proposal(xs + 0.01, np.ones(n_muons))
+    estimates, errors = [], []
+    for _ in range(500):
+        unique, counts = np.unique(
+            rng.choice(n_muons, 200, p=q), return_counts=True)
+        weights = importance_weights(unique, counts, q, n_muons)
+        assert np.isclose(weights.sum(), n_muons)
+        muons_w, error, ess = estimate(xs[unique], weights, counts)
+        assert 1 <= ess <= 200
+        estimates.append(muons_w)
+        errors.append(error)
+    # self-normalisation is only unbiased asymptotically
+    assert abs(np.mean(estimates) / xs.sum() - 1) < 0.05
+    assert np.isclose(np.mean(errors), np.std(estimates), rtol=0.2)
+
+
+def test_full_sample():
+    xs = np.arange(10.)
+    muons_w, error, ess = estimate(xs, np.ones(10))
+    assert np.isclose(muons_w, xs.sum())
+    assert np.isclose(ess, 10)
+    q = proposal(np.zeros(10), np.ones(10))
+    assert np.allclose(q, 0.1)
+
+
+def test_sample_size():
+    rng = np.random.RandomState(2)
+    n_muons = 5000
+    xs = rng.exponential(1, n_muons) * (rng.uniform(0, 1, n_muons) < 0.05)
+    q = proposal(xs, np.ones(n_muons))
+    n = sample_size(xs, q, 0.05)
+    assert 0 < n < n_muons
+    estimates = []
+    for _ in range(300):
+        unique, counts = np.unique(rng.choice(n_muons, n, p=q),
+                                   return_counts=True)
+        estimates.append(estimate(
+            xs[unique], importance_weights(unique, counts, q, n_muons),
+            counts)[0])
+    assert np.isclose(np.std(estimates) / xs.sum(), 0.05, rtol=0.3)
+    assert sample_size(np.zeros(10), np.ones(10) / 10, 0.05) is None
+    assert top_up_size(100, 10., 2., 0.1) == 400
+    assert top_up_size(100, 10., 0.5, 0.1) == 100
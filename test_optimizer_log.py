@@ -0,0 +1,82 @@
+import numpy as np
+from optimizer_log import OptimizerLog
+
+
+class Recorder(object):
+    """Stands in for the optimizer, remembers what it was told."""
+
+    def __init__(self):
+        self.rng = np.random.RandomState(1)
+        self.Xi = []
+        self.yi = []
+
+    def tell(self, X, y):
+        self.Xi += X
+        self.yi += y
+
+
+def test_replay_after_snapshot(tmpdir):
+    path = str(tmpdir.join('optimizer.log'))
+    log = OptimizerLog(path, snapshot_every=2)
+    clf = Recorder()
+    for i in range(3):
+        log.ask(clf, [[i]])
+        clf.tell([[i]], [float(i)])
+        log.tell(clf, [[i]], [float(i)])
+
+    # the snapshot holds the first two tells, only the third is replayed
+    resumed, pending = OptimizerLog(path).resume(Recorder())
+    assert resumed.Xi == [[0], [1], [2]]
+    assert resumed.yi == [0., 1., 2.]
+    assert pending == []
+
+
+def test_resume_without_snapshot(tmpdir):
+    path = str(tmpdir.join('optimizer.log'))
+    log = OptimizerLog(path)
+    clf = Recorder()
+    log.ask(clf, [[0], [1]])
+    state = clf.rng.get_state()[1].copy()
+    clf.rng.rand()
+    log.tell(clf, [[0]], [1.])
+
+    resumed, pending = OptimizerLog(path).resume(Recorder())
+    assert resumed.Xi == [[0]]
+    assert pending == [[1]]
+    # the random state is the one of the last ask
+    assert (resumed.rng.get_state()[1] == state).all()
+
+
+def test_truncate_partial_line(tmpdir):
+    path = str(tmpdir.join('optimizer.log'))
+    log = OptimizerLog(path)
+    clf = Recorder()
+    log.ask(clf, [[0]])
+    log.tell(clf, [[0]], [1.])
+    with open(path) as f:
+        complete = f.read()
+    with open(path, 'a') as f:
+        f.write('{"event": "tell", "X": [[1')
+
+    resumed, pending = OptimizerLog(path).resume(Recorder())
+    assert resumed.Xi == [[0]]
+    with open(path) as f:
+        assert f.read() == complete
+
+    # events appended after the truncation are read again
+    log.ask(clf, [[2]])
+    assert OptimizerLog(path).resume(Recorder())[1] == [[2]]
+
+
+def test_pending_excludes_tells_and_drops(tmpdir):
+    path = str(tmpdir.join('optimizer.log'))
+    log = OptimizerLog(path)
+    clf = Recorder()
+    log.ask(clf, [[0], [1], [2]])
+    log.tell(clf, [[0]], [1.])
+    log.drop([[1]])
+    log.ask(clf, [[3]])
+
+    resumed, pending = OptimizerLog(path).resume(Recorder())
+    assert pending == [[2], [3]]
+    assert resumed.Xi == [[0]]
@@ -0,0 +1,96 @@
+import json
+from point_store import PointStore, CanonicalId
+from disney_common import AddFixedParams, CreateDiscreteSpace, create_id
+from config import IMAGE_TAG, METADATA_TEMPLATE
+
+
+space = CreateDiscreteSpace()
+
+
+class PointJob(object):
+    def __init__(self, id, metadata, output):
+        self.id = id
+        self.metadata = metadata
+        self.output = output
+
+
+def metadata(point, seed=1, sampling=37, image_tag=IMAGE_TAG):
+    user = dict(METADATA_TEMPLATE['user'])
+    user.update(
+        params=str(point), seed=seed, sampling=sampling, image_tag=image_tag)
+    return json.dumps({'user': user, 'disney': {}})
+
+
+def test_canonical_id():
+    point = AddFixedParams(space.rvs(random_state=1)[0])
+    assert CanonicalId(point) == create_id([float(x) for x in point])
+    assert CanonicalId(point) == CanonicalId([float(x) for x in point])
+
+
+def test_add_get(tmpdir):
+    store = PointStore(str(tmpdir.join('points.sqlite')))
+    point = AddFixedParams(space.rvs(random_state=1)[0])
+    store.add(point, 1.5, image_tag=IMAGE_TAG, seed=1, sampling=37)
+    assert len(store) == 1
+    assert store.get(point, [IMAGE_TAG], seed='1', sampling='37') == 1.5
+    assert store.get(point, [IMAGE_TAG], seed=2, sampling=37) is None
+    assert store.get(point, ['other'], seed=1, sampling=37) is None
+    store.add(point, 1., image_tag=IMAGE_TAG, seed=1, sampling=37,
+              uncertainty=float('inf'), shards=3, bounded=True)
+    assert store.get(point, [IMAGE_TAG], seed=1, sampling=37) is None
+    store.add(point, 2., image_tag=IMAGE_TAG, seed=1, sampling=37,
+              uncertainty=0.1, shards=12, partial=True)
+    assert store.get(point, [IMAGE_TAG], seed=1, sampling=37) is None
+
+
+def test_import_and_query(tmpdir):
+    path = str(tmpdir.join('points.sqlite'))
+    points = [AddFixedParams(list(map(float, p)))
+              for p in space.rvs(3, random_state=2)]
+    jobs = [
+        PointJob(1, metadata(points[0]), '1.0'),
+        PointJob(2, metadata(points[1], seed=2), '2.0'),
+        PointJob(3, metadata(points[2], image_tag='old'), '3.0'),
+        PointJob(4, metadata(points[2][:10]), '4.0'),
+        PointJob(5, metadata(points[0]), 'not a loss'),
+    ]
+    assert PointStore(path).import_jobs(jobs) == 3
+
+    # a second connection sees the same points
+    store = PointStore(path)
+    X, y = store.query([IMAGE_TAG], seed=1, sampling=37)
+    assert y == [1.0]
+    assert X == [[float(x) for x in points[0]]]
+    X, y = store.query([IMAGE_TAG, 'old'])
+    assert sorted(y) == [1.0, 2.0, 3.0]
+
+
+def test_import_keeps_results(tmpdir):
+    store = PointStore(str(tmpdir.join('points.sqlite')))
+    point = AddFixedParams(list(map(float, space.rvs(random_state=4)[0])))
+    store.add(point, 1.5, image_tag=IMAGE_TAG, seed=1, sampling=37,
+              weight=1000., length=20., muons_w=3.)
+    assert store.import_jobs([PointJob(7, metadata(point), '2.5')]) == 1
+    assert store.db.execute(
+        'SELECT weight, length, muons_w, loss, job_id FROM points').fetchall(
+        ) == [(1000., 20., 3., 2.5, 7)]
+
+
+class ShardJob(PointJob):
+    def __init__(self, id, metadata, status):
+        super(ShardJob, self).__init__(id, metadata, '')
+        self.status = status
+
+
+def test_update_shards(tmpdir):
+    store = PointStore(str(tmpdir.join('points.sqlite')))
+    point = AddFixedParams(list(map(float, space.rvs(random_state=3)[0])))
+    running, completed = 2, 4
+    assert store.import_shards([
+        ShardJob(1, metadata(point), running),
+        ShardJob(2, metadata(point), completed),
+    ]) == 2
+    assert store.unfinished_shards([completed]) == [1]
+    assert store.update_shards([ShardJob(1, metadata(point), running)]) == 0
+    assert store.update_shards([ShardJob(1, metadata(point), completed)]) == 1
+    assert store.unfinished_shards([completed]) == []
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from weighter.sparse_results import SparseResults
+
+
+def test_aggregations(tmpdir):
+    n_muons = 50
+    rng = np.random.RandomState(1)
+    dense = np.zeros((3, n_muons))
+    simulated = np.zeros((3, n_muons), dtype=bool)
+    results = SparseResults(str(tmpdir.join('results')), n_muons)
+    for row in range(3):
+        muons = np.sort(rng.choice(n_muons, 30, replace=False))
+        values = rng.uniform(0, 1, 30) * (rng.uniform(0, 1, 30) < 0.3)
+        dense[row, muons] = values
+        simulated[row, muons] = True
+        assert results.append('point{}'.format(row), muons, values) == row
+
+    # reopened from disk
+    results = SparseResults(str(tmpdir.join('results')), n_muons)
+    assert len(results) == 3 and 'point1' in results
+    assert np.allclose(results.point_sums(), dense.sum(axis=1))
+    assert np.allclose(results.muon_sums(), dense.sum(axis=0))
+    evaluations = simulated.sum(axis=0)
+    assert np.array_equal(results.evaluations, evaluations)
+    seen = evaluations > 0
+    assert np.allclose(results.muon_means()[seen],
+                       dense.sum(axis=0)[seen] / evaluations[seen])
+    assert np.allclose(results.hit_frequency()[seen],
+                       (dense > 0).sum(axis=0)[seen] / evaluations[seen])
+    muons, values = results.point('point2')
+    assert np.allclose(dense[2, muons], values)
+    assert np.count_nonzero(dense[2]) == len(muons)
+    assert np.allclose(results.matrix().toarray(), dense.astype(np.float32))
+    with pytest.raises(ValueError):
+        results.append('point0', [1], [1.])
@@ -0,0 +1,63 @@
+"""Check the weighter scripts for undefined names.
+
+The weighter only runs inside the job container with ROOT, so a misspelled
+name would otherwise only show up in a failed importance sampling job.
+
+"""
+import os
+import glob
+import builtins
+import symtable
+
+WEIGHTER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'weighter')
+
+
+def module_table(path):
+    with open(path) as f:
+        return symtable.symtable(f.read(), path, 'exec')
+
+
+def star_imports(path):
+    """Modules of the weighter imported with `from module import *`."""
+    with open(path) as f:
+        return [
+            line.split()[1] for line in f
+            if line.startswith('from ') and line.rstrip().endswith('import *')
+        ]
+
+
+def defined_names(path):
+    """Names defined at the top level of a weighter module."""
+    table = module_table(path)
+    names = set(
+        symbol.get_name() for symbol in table.get_symbols()
+        if symbol.is_assigned() or symbol.is_imported()
+        or symbol.is_namespace())
+    for module in star_imports(path):
+        names |= set(
+            name
+            for name in defined_names(os.path.join(WEIGHTER, module + '.py'))
+            if not name.startswith('_'))
+    return names
+
+
+def undefined_names(path):
+    defined = defined_names(path) | set(dir(builtins))
+    undefined = set()
+    tables = [module_table(path)]
+    while tables:
+        table = tables.pop()
+        tables += table.get_children()
+        for symbol in table.get_symbols():
+            if not symbol.is_referenced():
+                continue
+            if table.get_type() == 'module' or symbol.is_global():
+                if symbol.get_name() not in defined:
+                    undefined.add(symbol.get_name())
+    return undefined
+
+
+def test_undefined_names():
+    for path in glob.glob(os.path.join(WEIGHTER, '*.py')):
+        assert undefined_names(path) == set(), path
@@ -1,8 +1,15 @@
 import numpy as np
 import re
 import os
+import shutil
 import argparse
 from utils import loss
+from sparse_results import SparseResults
+
+CUM_DTYPE = np.dtype('float32')
+CHUNK_SIZE = 2**22  # muons converted at once
+PROCESSED = 'processed_{}.txt'  # results already in the arrays
+SPARSE = 'sparse_{}'  # directory of the per-point results, see SparseResults
 
 
 def get_xs_path(tag, id):
@@ -13,44 +20,107 @@ def get_indeces_path(tag, id):
     return os.path.join("/input", "index_" + tag + str(id) + '.npy')
 
 
-def get_number(filename):
-    return re.findall(r'\d+', filename)[0]
+def load_processed(tag):
+    '''
+    Keys of the results already folded into the cumulative arrays.
+    '''
+    path = os.path.join("/input", PROCESSED.format(tag))
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return set(f.read().splitlines())
 
 
-def load_previous_cumulative_arrays():
-    cum_loss = np.load("/input/cumloss.npy")
-    cum_indeces = np.load("/input/cumindeces.npy")
-    return cum_loss, cum_indeces
+def open_cumulative_array(name):
+    '''
+    Copy the cumulative array `name` from /input to /output and memory-map it.
+
+    Arrays of another dtype, e.g. as first written by weighter.py, are
+    converted to `CUM_DTYPE` once.
+    '''
+    source = os.path.join("/input", name)
+    target = os.path.join("/output", name)
+    previous = np.load(source, mmap_mode='r')
+    if previous.dtype == CUM_DTYPE:
+        if os.path.abspath(source) != os.path.abspath(target):
+            shutil.copyfile(source, target)
+        return np.load(target, mmap_mode='r+')
+    cumulative = np.lib.format.open_memmap(
+        target + '.tmp', mode='w+', dtype=CUM_DTYPE, shape=previous.shape)
+    for start in range(0, len(previous), CHUNK_SIZE):
+        cumulative[start:start + CHUNK_SIZE] = \
+            previous[start:start + CHUNK_SIZE]
+    cumulative.flush()
+    del cumulative, previous
+    os.rename(target + '.tmp', target)
+    return np.load(target, mmap_mode='r+')
+
+
+def open_sparse_results(tag, n_muons):
+    '''
+    Copy the per-point results of `tag` from /input to /output to append to.
+    '''
+    source = os.path.join("/input", SPARSE.format(tag))
+    target = os.path.join("/output", SPARSE.format(tag))
+    if os.path.isdir(source) and \
+            os.path.abspath(source) != os.path.abspath(target):
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        shutil.copytree(source, target)
+    return SparseResults(target, n_muons)
 
 
-def load_previous_results(tag):
+def result_key(tag, number):
     '''
-    This function should load all the previous results from eos and calculate the mean over each muon.
+    Name, sizes and modification times of the result files of a point.
+
+    A point which is simulated again under the same number gets a new key.
+    Only the metadata of the files is read, so finding the new results does
+    not grow with the number of results already processed.
     '''
-    prev_results = []
-    prev_indeces = []
-    files = os.listdir("/input")
+    stats = [
+        os.stat(path)
+        for path in (get_xs_path(tag, number), get_indeces_path(tag, number))
+    ]
+    return '{}:{}'.format(
+        os.path.basename(get_xs_path(tag, number)),
+        ':'.join('{}:{:.6f}'.format(stat.st_size, stat.st_mtime)
+                 for stat in stats))
 
-    for filename in files:
-        if "xs_" + tag in filename:
-            number = get_number(filename)
-            xs = np.load(get_xs_path(tag, number))
-            prev_results.append(loss(np.array(xs)))
 
-            indeces = np.load(get_indeces_path(tag, number))
-            prev_indeces.append(indeces)
+def new_results(tag, processed):
+    '''
+    Numbers and keys of the points whose results are not in `processed` yet.
+    '''
+    pattern = re.compile(r'^xs_' + re.escape(tag) + r'(\d+)\.npy$')
+    results = []
+    for filename in sorted(os.listdir("/input")):
+        match = pattern.match(filename)
+        if match is None:
+            continue
+        key = result_key(tag, match.group(1))
+        if key not in processed:
+            results.append((match.group(1), key))
+    return results
+
+
+def accumulate(cumulative, indeces, values):
+    '''
+    cumulative[indeces] += values, also for repeated indeces.
 
-    return prev_results, prev_indeces
+    Only touches the pages of `cumulative` at `indeces`.
+    '''
+    unique, inverse = np.unique(indeces, return_inverse=True)
+    cumulative[unique] += np.bincount(
+        inverse, weights=values).astype(cumulative.dtype)
 
 
 def calculate_cuminfo(muon_loss, muon_indeces, old_cumloss, old_cumindeces):
     '''
-    Function accumulates new results.
+    Function accumulates the results of one point.
     '''
-    for i in range(len(muon_loss)):
-        old_cumloss[muon_indeces[i]] += muon_loss[i]
-        old_cumindeces[muon_indeces[i]] += 1
-
+    accumulate(old_cumloss, muon_indeces, muon_loss)
+    accumulate(old_cumindeces, muon_indeces, np.ones(len(muon_indeces)))
     return old_cumloss, old_cumindeces
 
 
@@ -61,11 +131,25 @@ def main():
         default='')
     args = parser.parse_args()
 
-    cum_loss, cum_indeces = load_previous_cumulative_arrays()
-    prev_loss, prev_indeces = load_previous_results(args.tag)
-    cum_loss, cum_indeces = calculate_cuminfo(prev_loss, prev_indeces, cum_loss, cum_indeces)
-    np.save("/output/cumloss.npy", cum_loss)
-    np.save("/output/cumindeces.npy", cum_indeces)
+    processed = load_processed(args.tag)
+    cum_loss = open_cumulative_array("cumloss.npy")
+    cum_indeces = open_cumulative_array("cumindeces.npy")
+    sparse_results = open_sparse_results(args.tag, len(cum_loss))
+    results = new_results(args.tag, processed)
+    # one point at a time, so only one result file is in memory
+    for number, key in results:
+        xs = np.load(get_xs_path(args.tag, number))
+        indeces = np.load(get_indeces_path(args.tag, number))
+        muon_loss = loss(xs)
+        calculate_cuminfo(muon_loss, indeces, cum_loss, cum_indeces)
+        if key not in sparse_results:
+            sparse_results.append(key, indeces, muon_loss)
+        processed.add(key)
+    cum_loss.flush()
+    cum_indeces.flush()
+    with open(os.path.join("/output", PROCESSED.format(args.tag)), 'w') as f:
+        f.write(''.join(name + '\n' for name in sorted(processed)))
+    print('Added the results of {} points.'.format(len(results)))
 
 
 if __name__ == "__main__":
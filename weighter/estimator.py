@@ -0,0 +1,78 @@
+import numpy as np
+
+DEFENSIVE_SHARE = 0.1
+
+
+def proposal(muon_loss, muon_indeces, defensive=DEFENSIVE_SHARE):
+    '''
+    Probability of every muon to be drawn for a simulation.
+
+    Muons are drawn proportionally to their mean loss so far, mixed with a
+    uniform share `defensive`, so that muons without any loss so far are still
+    drawn and the estimate stays unbiased.
+    '''
+    mean_loss = muon_loss / muon_indeces
+    uniform = np.ones(len(mean_loss)) / len(mean_loss)
+    if np.sum(mean_loss) <= 0:
+        return uniform
+    return (1 - defensive) * mean_loss / np.sum(mean_loss) + \
+        defensive * uniform
+
+
+def importance_weights(unique, counts, q, n_muons):
+    '''
+    Self-normalised weights of the unique drawn muons.
+
+    The weights sum to `n_muons`, so that the weighted sum of the results of
+    the drawn muons estimates the sum over all muons.
+    '''
+    weights = counts / (n_muons * q[unique])
+    return n_muons * weights / np.sum(weights)
+
+
+def estimate(xs, weights, counts=None):
+    '''
+    Self-normalised importance sampling estimate of the sum over all muons.
+
+    `xs` are the results of the unique drawn muons, `weights` their
+    `importance_weights` and `counts` how often each of them was drawn.
+
+    Returns the estimate, its standard error from the delta method and the
+    effective sample size of the weights.
+    '''
+    xs = np.asarray(xs, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    counts = np.ones(len(xs)) if counts is None else np.asarray(counts)
+    n_muons = np.sum(weights)
+    normalised = weights / n_muons
+    mean = np.dot(normalised, xs)
+    # every draw of a muon carries an equal share of its weight
+    error = n_muons * np.sqrt(
+        np.sum(normalised**2 / counts * (xs - mean)**2))
+    ess = 1. / np.sum(normalised**2 / counts)
+    return n_muons * mean, error, ess
+
+
+def sample_size(mean_loss, q, target):
+    '''
+    Number of draws from `q` for a relative error `target` of the estimate.
+
+    Predicted from the variance of the estimate if the results of the muons
+    were their `mean_loss` so far. Returns None without any loss so far.
+    '''
+    n_muons = len(mean_loss)
+    total = np.sum(mean_loss)
+    if total <= 0:
+        return None
+    variance = np.sum((mean_loss - total / n_muons)**2 / q)
+    return int(np.ceil(variance / (target * total)**2))
+
+
+def top_up_size(n, muons_w, error, target):
+    '''
+    Total number of draws after which the relative error should meet
+    `target`, given the `error` of the estimate `muons_w` from `n` draws.
+    '''
+    if error <= target * muons_w:
+        return n
+    return int(np.ceil(n * (error / (target * muons_w))**2))
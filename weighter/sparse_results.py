@@ -0,0 +1,150 @@
+import os
+import numpy as np
+
+ENTRY_DTYPE = np.dtype([
+    ('point', '<u4'),
+    ('muon', '<u4'),
+    ('value', '<f4'),
+])
+CHUNK_SIZE = 2**22  # entries aggregated at once
+
+
+class SparseResults(object):
+    '''
+    Appendable points x muons matrix of per-muon results in COO form.
+
+    Only the non-zero results are stored, as (point, muon, value) entries in
+    a binary file which is memory-mapped for reading. How often each muon was
+    simulated at all is counted in a dense memory-mapped array, so that means
+    over the points include the zeros. Rows are numbered in the order the
+    points were appended, their keys are kept one per line in a text file.
+
+    Only one process may append at a time.
+    '''
+
+    def __init__(self, directory, n_muons):
+        self.directory = directory
+        self.n_muons = n_muons
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.entries_path = os.path.join(directory, 'entries.bin')
+        self.points_path = os.path.join(directory, 'points.txt')
+        evaluations_path = os.path.join(directory, 'evaluations.npy')
+        if not os.path.exists(evaluations_path):
+            np.save(evaluations_path, np.zeros(n_muons, dtype=np.uint32))
+        self.evaluations = np.load(evaluations_path, mmap_mode='r+')
+        if len(self.evaluations) != n_muons:
+            raise ValueError('Results of {} muons in {}, expected {}'.format(
+                len(self.evaluations), directory, n_muons))
+        self.points = []
+        if os.path.exists(self.points_path):
+            with open(self.points_path) as f:
+                self.points = f.read().splitlines()
+        self.rows = {key: row for row, key in enumerate(self.points)}
+
+    def __len__(self):
+        return len(self.points)
+
+    def __contains__(self, key):
+        return str(key) in self.rows
+
+    def append(self, key, muons, values):
+        '''
+        Add the results `values` of the simulated `muons` of a point.
+
+        Returns the row of the point.
+        '''
+        key = str(key)
+        if '\n' in key or key in self.rows:
+            raise ValueError('Invalid or duplicate point {!r}'.format(key))
+        muons = np.asarray(muons)
+        values = np.asarray(values)
+        nonzero = values != 0
+        row = len(self.points)
+        entries = np.empty(np.count_nonzero(nonzero), dtype=ENTRY_DTYPE)
+        entries['point'] = row
+        entries['muon'] = muons[nonzero]
+        entries['value'] = values[nonzero]
+        with open(self.entries_path, 'ab') as f:
+            entries.tofile(f)
+        np.add.at(self.evaluations, muons, 1)
+        self.evaluations.flush()
+        with open(self.points_path, 'a') as f:
+            f.write(key + '\n')
+        self.points.append(key)
+        self.rows[key] = row
+        return row
+
+    def entries(self):
+        '''
+        Memory-mapped array of all entries.
+        '''
+        if not os.path.exists(self.entries_path) or \
+                not os.path.getsize(self.entries_path):
+            return np.empty(0, dtype=ENTRY_DTYPE)
+        return np.memmap(self.entries_path, dtype=ENTRY_DTYPE, mode='r')
+
+    def _bincount(self, column, minlength, weights=True):
+        entries = self.entries()
+        result = np.zeros(minlength)
+        for start in range(0, len(entries), CHUNK_SIZE):
+            chunk = entries[start:start + CHUNK_SIZE]
+            result += np.bincount(
+                chunk[column],
+                weights=chunk['value'] if weights else None,
+                minlength=minlength)
+        return result
+
+    def point_sums(self):
+        '''
+        Sum of the results of each point, e.g. its `muons_w`.
+        '''
+        return self._bincount('point', len(self.points))
+
+    def muon_sums(self):
+        '''
+        Sum of the results of each muon over all points.
+        '''
+        return self._bincount('muon', self.n_muons)
+
+    def muon_means(self):
+        '''
+        Mean result of each muon over the points which simulated it.
+        '''
+        evaluations = np.asarray(self.evaluations, dtype=float)
+        means = np.zeros(self.n_muons)
+        simulated = evaluations > 0
+        means[simulated] = self.muon_sums()[simulated] / evaluations[simulated]
+        return means
+
+    def hit_frequency(self):
+        '''
+        Fraction of the simulations of each muon with a non-zero result.
+        '''
+        evaluations = np.asarray(self.evaluations, dtype=float)
+        frequency = np.zeros(self.n_muons)
+        simulated = evaluations > 0
+        frequency[simulated] = self._bincount(
+            'muon', self.n_muons, weights=False)[simulated] / \
+            evaluations[simulated]
+        return frequency
+
+    def point(self, key):
+        '''
+        Muons with non-zero results of a point and their results.
+        '''
+        entries = self.entries()
+        row = self.rows[str(key)]
+        selected = entries[entries['point'] == row]
+        return selected['muon'].astype(np.int64), \
+            selected['value'].astype(np.float64)
+
+    def matrix(self):
+        '''
+        All results as a `scipy.sparse.csr_matrix` of points x muons.
+        '''
+        from scipy.sparse import coo_matrix
+        entries = self.entries()
+        return coo_matrix(
+            (entries['value'], (entries['point'], entries['muon'])),
+            shape=(len(self.points), self.n_muons)).tocsr()
@@ -23,6 +23,10 @@ def get_indeces_path(tag, id):
     return os.path.join("/output", "index_" + tag + str(id) + '.npy')
 
 
+def get_counts_path(tag, id):
+    return os.path.join("/output", "counts_" + tag + str(id) + '.npy')
+
+
 def start_slave(command_line):
     '''
     Start the slave.py with Popen and wait to finish.
@@ -41,49 +45,49 @@ def load_previous_cumulative_arrays():
         return np.array([]), np.array([])
 
 
-def sample_muons(muon_loss, muon_indeces, share=0.05):
+def draw_muons(p, size):
     '''
-    Function sample the indexes of muons according to weights
+    Draw `size` indexes of muons with replacement from the probabilities `p`
     '''
-    if share is None:
-        share = 0.05
-
-    weights = muon_loss / muon_indeces
-    sample_size = int(len(weights) * share)
-
-    if sample_size == 0:
-        raise
-
-    return np.random.choice(len(weights), size=sample_size, p=weights/np.sum(weights), replace=True)
+    return np.random.choice(len(p), size=size, p=p, replace=True)
 
 
 def create_muons_files(filename_read, filename_write, indexes):
     '''
     Function takes all the muons, choose subsample according to indeces and saves it to filename_write
+
+    Every selected muon is written once, in the order of the input file.
+    Returns the unique indexes and how often each of them was selected.
     '''
+    unique, counts = np.unique(indexes, return_counts=True)
     f = r.TFile.Open(filename_read, 'read')
     intuple = f.Get('pythia8-Geant4')
     out = r.TFile.Open(filename_write, 'recreate')
-    outtuple = intuple.CloneTree(0)
-
-    i = 0
-    ind_cur = 0
-    indexes = np.sort(indexes)
-
-    for muon in intuple:
-        while (i == indexes[ind_cur]):
-            outtuple.Fill(muon)
-            if (ind_cur < len(indexes) - 1 and indexes[ind_cur] != indexes[ind_cur + 1]):
-                ind_cur += 1
-                break
-            ind_cur += 1
-            if (ind_cur == len(indexes)):
-                break
-        i += 1
-
+    out.cd()
+    if len(unique) == intuple.GetEntries():
+        outtuple = intuple.CloneTree(-1, 'fast')
+    else:
+        entries = r.TEntryList(intuple)
+        for index in unique:
+            entries.Enter(int(index))
+        intuple.SetEntryList(entries)
+        # only reads the baskets of the selected entries
+        outtuple = intuple.CopyTree('')
     outtuple.Write()
-    f.Close()
     out.Close()
+    f.Close()
+    return unique, counts
+
+
+def merge_hists(filenames, filename_write):
+    '''
+    Add up the histograms of several runs of slave.py into filename_write
+    '''
+    merger = r.TFileMerger(False)
+    merger.OutputFile(filename_write, 'recreate')
+    for filename in filenames:
+        merger.AddFile(filename)
+    return merger.Merge()
 
 
 def count_muons(filename_read):
@@ -1,7 +1,15 @@
 import numpy as np
 import os
+import json
 import argparse
 from utils import *
+from estimator import (proposal, importance_weights, estimate, sample_size,
+                       top_up_size)
+
+RESULTS = '/output/result.json'
+MUONS_FILE = '/shield/worker_files/sampling_is/muons.root'
+MIN_SAMPLE = 100  # smallest pilot sample
+MAX_TOP_UPS = 2  # rounds of additional draws after the pilot
 
 
 SLAVE_CMD = '''python2 slave.py ''' \
@@ -9,10 +17,71 @@ SLAVE_CMD = '''python2 slave.py ''' \
             '''-f /shield/worker_files/sampling_is/''' \
             '''muons.root ''' \
             '''--results /output/result.json ''' \
-            '''--hists /output/hists_{tag}.root --seed {seed} ''' \
+            '''--hists {hists_path} --seed {seed} ''' \
             '''--xs_path {xs_path}'''
 
 
+def pilot_size(mean_loss, p, share, target_error, max_share):
+    '''
+    Number of muons drawn before the first simulation.
+
+    Without `target_error` it is the share `share` of all muons. Otherwise it
+    is the size predicted for `target_error` from the mean losses so far, at
+    most the share `share`, and the estimate is topped up if the pilot turns
+    out to be too small.
+    '''
+    n_muons = len(p)
+    size = int(share * n_muons)
+    if target_error is not None:
+        predicted = sample_size(mean_loss, p, target_error)
+        if predicted is not None:
+            size = min(size, predicted)
+    return int(np.clip(size, min(MIN_SAMPLE, n_muons), max_share * n_muons))
+
+
+def step_hists(step):
+    return '/tmp/hists_{}.root'.format(step)
+
+
+def simulate(args, indeces, step):
+    '''
+    Simulate every muon of the unique `indeces` once.
+
+    Returns the xs of the muons, in the order of `indeces`, or None if
+    slave.py reported an error. The histograms go to `step_hists(step)`.
+    '''
+    step_args = argparse.Namespace(**vars(args))
+    step_args.xs_path = '/tmp/xs_{}.npy'.format(step)
+    step_args.hists_path = step_hists(step)
+    create_muons_files(args.input, MUONS_FILE, indeces)
+    start_slave(get_command_line(SLAVE_CMD, step_args))
+    with open(RESULTS) as f:
+        if json.load(f)['error'] is not None:
+            return None
+    return np.load(step_args.xs_path)
+
+
+def report_estimate(xs_path, weights, counts, sampled):
+    '''
+    Add the importance sampling estimate of muons_w to the results of slave.py
+
+    The results are those of the last run of slave.py, so the number of
+    simulated muons is replaced by that of all runs.
+    '''
+    with open(RESULTS) as f:
+        result = json.load(f)
+    if result['error'] is None:
+        xs = np.load(xs_path)
+        muons_w, error, ess = estimate(xs, weights, counts)
+        if not sampled:
+            # all muons simulated once, nothing to estimate
+            error, ess = 0., float(len(xs))
+        result.update(muons=len(xs), muons_w=muons_w, muons_w_error=error,
+                      ess=ess)
+        with open(RESULTS, 'w') as f:
+            json.dump(result, f)
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -25,7 +94,20 @@ def main():
     parser.add_argument('--point_id', type=int, required=True)
     parser.add_argument('--tag', default="")
     parser.add_argument('--seed', type=int, default=1)
-    parser.add_argument('--share_muons', type=float)
+    parser.add_argument(
+        '--share_muons',
+        type=float,
+        default=0.05,
+        help='Share of the muons drawn, or of the pilot with --target_error')
+    parser.add_argument(
+        '--target_error',
+        type=float,
+        help='Relative error of muons_w to reach by drawing more muons')
+    parser.add_argument(
+        '--max_share',
+        type=float,
+        default=0.5,
+        help='Share of the muons drawn at most with --target_error')
 
     args = parser.parse_args()
     args.xs_path = os.path.join("/output", get_xs_path(args.tag, args.point_id))
@@ -34,17 +116,50 @@ def main():
     muon_loss, muon_indeces = load_previous_cumulative_arrays()
 
     if len(muon_loss) == 0:
-        next_indeces = np.arange(number_of_muons)
+        draws = np.arange(number_of_muons)
+        p = None
         np.save("/output/cumloss.npy", np.zeros(number_of_muons))
         np.save("/output/cumindeces.npy", np.ones(number_of_muons) * 1e-5)
     else:
-        next_indeces = sample_muons(muon_loss, muon_indeces, share=args.share_muons)
+        p = proposal(muon_loss, muon_indeces)
+        draws = draw_muons(p, pilot_size(
+            muon_loss / muon_indeces, p, args.share_muons, args.target_error,
+            args.max_share))
+    max_size = int(args.max_share * number_of_muons)
 
-    create_muons_files(args.input, "/shield/worker_files/sampling_is/muons.root", next_indeces)
-    np.save(get_indeces_path(args.tag, args.point_id), next_indeces)
+    # every muon is simulated once, top-ups only simulate the new ones
+    simulated = np.empty(0, dtype=np.int64)
+    simulated_xs = np.empty(0)
+    for step in range(MAX_TOP_UPS + 1):
+        new = np.setdiff1d(draws, simulated)
+        xs = simulate(args, new, step)
+        if xs is None:
+            return
+        simulated = np.concatenate([simulated, new])
+        simulated_xs = np.concatenate([simulated_xs, xs])
+        next_indeces, counts = np.unique(draws, return_counts=True)
+        xs = simulated_xs[np.argsort(simulated)]
+        if p is None:
+            weights = np.ones(len(next_indeces))
+            break
+        weights = importance_weights(next_indeces, counts, p, number_of_muons)
+        if args.target_error is None or step == MAX_TOP_UPS:
+            break
+        muons_w, error, _ = estimate(xs, weights, counts)
+        size = min(top_up_size(len(draws), muons_w, error, args.target_error),
+                   max_size)
+        if size <= len(draws):
+            break
+        print('Error {} of muons_w {} from {} muons, drawing {} more.'.format(
+            error, muons_w, len(draws), size - len(draws)))
+        draws = np.concatenate([draws, draw_muons(p, size - len(draws))])
 
-    command_line = get_command_line(SLAVE_CMD, args)
-    start_slave(command_line)
+    merge_hists([step_hists(i) for i in range(step + 1)],
+                '/output/hists_{}.root'.format(args.tag))
+    np.save(args.xs_path, xs)
+    np.save(get_indeces_path(args.tag, args.point_id), next_indeces)
+    np.save(get_counts_path(args.tag, args.point_id), counts)
+    report_estimate(args.xs_path, weights, counts, sampled=p is not None)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,157 @@
+#!/usr/bin/env python2
+"""Warm FairShip worker which runs shards for `slave.py` on the same node.
+
+Loading the libraries and modules of FairShip takes a large part of a short
+shard. The worker loads them once and then accepts shards as JSON requests
+on a unix socket. FairRunSim and Geant4 can only be initialised once per
+process, so every shard runs in a child forked from the warm worker, which
+still configures FairShip, initialises the run and builds the physics tables
+of Geant4. Only the loading of the libraries is saved, hence `slave.py` uses
+the worker only when asked to with `--worker`.
+
+Since the worker does not see the /output of the job, the files of a shard
+are exchanged through a directory next to the socket.
+
+"""
+import os
+import json
+import shutil
+import signal
+import socket
+import argparse
+import traceback
+
+import config
+
+READY_TIMEOUT = 10  # seconds to connect to the worker
+
+
+def _send(connection, message):
+    connection.sendall((json.dumps(message) + '\n').encode('utf8'))
+
+
+def _receive(connection):
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = connection.recv(4096)
+        if not chunk:
+            raise RuntimeError('Worker closed the connection')
+        data += chunk
+    return json.loads(data.decode('utf8'))
+
+
+def request_shard(path, shard):
+    """Run a shard in the worker listening on `path`, see `slave.run_shard`.
+
+    Returns
+    -------
+    list
+        Muon weights of the shard, or None if no worker is listening
+
+    """
+    workdir = os.path.join(
+        os.path.dirname(path), 'shards', '{}_{}'.format(
+            socket.gethostname(), os.getpid()))
+    if os.path.exists(workdir):
+        shutil.rmtree(workdir)
+    os.makedirs(workdir)
+    try:
+        request = dict(shard)
+        request['paramFile'] = os.path.join(
+            workdir, os.path.basename(shard['paramFile']))
+        shutil.copy(shard['paramFile'], request['paramFile'])
+        for key in ('outFile', 'hists', 'xs_path', 'tracks', 'hits'):
+            if shard.get(key):
+                request[key] = os.path.join(workdir,
+                                            os.path.basename(shard[key]))
+
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(READY_TIMEOUT)
+        try:
+            connection.connect(path)
+        except socket.error:
+            connection.close()
+            return None
+        connection.settimeout(None)
+        try:
+            _send(connection, request)
+            reply = _receive(connection)
+        finally:
+            connection.close()
+        if reply['error']:
+            raise RuntimeError(reply['error'])
+
+        for key in ('outFile', 'hists', 'xs_path', 'tracks', 'hits'):
+            if request.get(key) and os.path.exists(request[key]):
+                shutil.move(request[key], shard[key])
+        return reply['xs']
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _run(connection):
+    """Run the shard requested on `connection` in a forked child."""
+    import slave
+    try:
+        request = _receive(connection)
+        xs = slave.run_shard(**request)
+        reply = {'error': None, 'xs': [float(x) for x in xs]}
+    except Exception as e:
+        traceback.print_exc()
+        reply = {'error': e.__repr__(), 'xs': None}
+    _send(connection, reply)
+
+
+def _reap(signum, frame):
+    try:
+        while os.waitpid(-1, os.WNOHANG)[0]:
+            pass
+    except OSError:
+        # no children left
+        pass
+
+
+def warm_up():
+    """Load everything which does not depend on the geometry."""
+    import ROOT as r
+    r.gErrorIgnoreLevel = r.kWarning
+    r.gSystem.Load('libpythia8')
+    import slave  # noqa, imports FairShip
+    for cls in ('FairRunSim', 'FairPrimaryGenerator', 'MuonBackGenerator',
+                'TGeant4'):
+        getattr(r, cls)
+
+
+def serve(path):
+    warm_up()
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(64)
+    signal.signal(signal.SIGCHLD, _reap)
+    print('Worker listening on {}'.format(path))
+    try:
+        while True:
+            try:
+                connection, _ = server.accept()
+            except socket.error:
+                # interrupted by SIGCHLD
+                continue
+            if os.fork() == 0:
+                server.close()
+                try:
+                    _run(connection)
+                finally:
+                    os._exit(0)
+            connection.close()
+    finally:
+        server.close()
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket', default=config.WORKER_SOCKET)
+    args = parser.parse_args()
+    serve(args.socket)